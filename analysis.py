@@ -1,52 +1,176 @@
 # reddit_analyzer/analysis.py
+import argparse
+import functools
+import os
+import math
+import numpy as np
 import pandas as pd
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
-import re
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 from collections import Counter
 
 from utils import setup_logger
+import metrics
+from text_processing import tokenize_text, tokenize_series, TOKENIZER_VERSION
 
+# NLTK e scikit-learn sono importati al primo uso: importare questo modulo resta leggero
 logger = setup_logger(__name__)
 
-# Inizializza VADER una sola volta
-try:
-    analyzer = SentimentIntensityAnalyzer()
-except LookupError:
-    logger.info("Download del lexicon VADER di NLTK...")
+# Risorse NLTK usate dal progetto: nome per nltk.download() -> percorso per nltk.data.find().
+# Si installano una volta con: python analysis.py --setup-nltk
+NLTK_RESOURCES = {
+    'vader_lexicon': 'sentiment/vader_lexicon.zip',
+    'stopwords': 'corpora/stopwords',
+}
+CUSTOM_STOPWORDS = ('reddit', 'com', 'https', 'www', 'http', 'https www',
+                    'post', 'commento', 'commenti', 'thread', 'subreddit',
+                    'essere', 'fare', 'dire', 'potere', 'volere', 'avere',
+                    'sto', 'sta', 'stai', 'fatto', 'detto', 'dice', 'dico',
+                    'anni', 'mese', 'giorni', 'settimana', 'grazie', 'ciao',
+                    'vorrei', 'sapere', 'qualcuno', 'secondo', 'cosa', 'come',
+                    'perché', 'quando', 'dove', 'chi', 'più', 'meno', 'molto',
+                    'sempre', 'solo', 'anche')
+
+def _missing_nltk_resource(resource):
+    return LookupError(f"Risorsa NLTK '{resource}' non installata: eseguire una volta 'python analysis.py --setup-nltk'.")
+
+@functools.lru_cache(maxsize=None)
+def get_sentiment_analyzer():
+    """ Analizzatore VADER, creato al primo uso e poi riutilizzato. Solleva LookupError se il lexicon manca. """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    try:
+        return SentimentIntensityAnalyzer()
+    except LookupError as e:
+        raise _missing_nltk_resource('vader_lexicon') from e
+
+@functools.lru_cache(maxsize=None)
+def get_italian_stopwords():
+    """ Stopword italiane di NLTK più CUSTOM_STOPWORDS (frozenset, lookup O(1)), caricate al primo uso. """
+    from nltk.corpus import stopwords
+    try:
+        return frozenset(stopwords.words('italian')) | frozenset(CUSTOM_STOPWORDS)
+    except LookupError as e:
+        raise _missing_nltk_resource('stopwords') from e
+
+def missing_nltk_resources():
+    """ Risorse di NLTK_RESOURCES non ancora installate. """
     import nltk
-    nltk.download('vader_lexicon', quiet=True)
-    analyzer = SentimentIntensityAnalyzer()
-
-try:
-    stop_words_italian_base = stopwords.words('italian')
-    custom_stopwords = ['reddit', 'com', 'https', 'www', 'http', 'https www', 
-                        'post', 'commento', 'commenti', 'thread', 'subreddit', 
-                        'essere', 'fare', 'dire', 'potere', 'volere', 'avere',
-                        'sto', 'sta', 'stai', 'fatto', 'detto', 'dice', 'dico',
-                        'anni', 'mese', 'giorni', 'settimana', 'grazie', 'ciao',
-                        'vorrei', 'sapere', 'qualcuno', 'secondo', 'cosa', 'come',
-                        'perché', 'quando', 'dove', 'chi', 'più', 'meno', 'molto',
-                        'sempre', 'solo', 'anche'] 
-    stop_words_italian = list(set(stop_words_italian_base + custom_stopwords))
-except LookupError:
-    logger.info("Download delle stopwords NLTK...")
+    missing = []
+    for resource, path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            missing.append(resource)
+    return missing
+
+def setup_nltk_resources():
+    """ Scarica le risorse NLTK mancanti (rete necessaria). Restituisce quelle ancora mancanti dopo il download. """
     import nltk
-    nltk.download('stopwords', quiet=True)
-    nltk.download('punkt', quiet=True) 
-    stop_words_italian_base = stopwords.words('italian')
-    custom_stopwords = ['reddit', 'com', 'https', 'www', 'http', 'https www', 
-                        'post', 'commento', 'commenti', 'thread', 'subreddit', 
-                        'essere', 'fare', 'dire', 'potere', 'volere', 'avere',
-                        'sto', 'sta', 'stai', 'fatto', 'detto', 'dice', 'dico',
-                        'anni', 'mese', 'giorni', 'settimana', 'grazie', 'ciao',
-                        'vorrei', 'sapere', 'qualcuno', 'secondo', 'cosa', 'come',
-                        'perché', 'quando', 'dove', 'chi', 'più', 'meno', 'molto',
-                        'sempre', 'solo', 'anche'] 
-    stop_words_italian = list(set(stop_words_italian_base + custom_stopwords))
+    for resource in missing_nltk_resources():
+        logger.info(f"Download della risorsa NLTK '{resource}'...")
+        nltk.download(resource, quiet=True)
+    return missing_nltk_resources()
+
+
+# Da incrementare quando cambiano analizzatore, lexicon o soglie:
+# i sentiment salvati nel DB con una versione diversa vengono ricalcolati.
+SENTIMENT_ANALYZER_VERSION = "vader-1"
+
+def build_sentiment_text(titolo, contenuto):
+    """ Testo su cui si calcola il sentiment di un post: titolo + contenuto (come nella dashboard). """
+    return f"{titolo or ''} {contenuto or ''}"
+
+def compute_text_hash(text):
+    """ Hash del testo analizzato, usato per ricalcolare il sentiment solo se il testo cambia. """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+SENTIMENT_POSITIVE_THRESHOLD = 0.05
+SENTIMENT_NEGATIVE_THRESHOLD = -0.05
+
+# Sotto questa soglia di testi unici il costo di avvio dei processi supera il guadagno
+PARALLEL_SENTIMENT_MIN_TEXTS = 2000
+# Testi accumulati dal backfill (database.rescore_post_sentiment) prima di ogni calcolo: ben sopra
+# la soglia del pool, così il ricalcolo di un corpus grande usa tutti i core e ammortizza l'avvio dei processi
+SENTIMENT_BACKFILL_MIN_TEXTS = 4 * PARALLEL_SENTIMENT_MIN_TEXTS
+# Caratteri di testo per chunk inviato a un processo worker (il costo di VADER è ~lineare nella lunghezza)
+SENTIMENT_CHUNK_TARGET_CHARS = 200_000
+
+def score_posts_sentiment(posts, max_workers=None):
+    """
+    Calcola il sentiment di una lista di post (dizionari con 'titolo' e 'contenuto').
+    Restituisce una lista di tuple (sentiment_score, sentiment_label, text_hash),
+    nello stesso ordine dei post. Testi identici vengono analizzati una sola volta.
+    max_workers è passato ad analyze_sentiment_batch().
+    """
+    texts = [build_sentiment_text(post.get('titolo'), post.get('contenuto')) for post in posts]
+    sentiments = analyze_sentiment_batch(texts, max_workers=max_workers)
+    return [(score, label, compute_text_hash(text))
+            for text, score, label in zip(texts, sentiments['sentiment_score'], sentiments['sentiment_label'])]
+
+def _compound_score(text):
+    """ Punteggio 'compound' VADER di un testo (funzione di modulo, eseguibile nei processi worker). """
+    return get_sentiment_analyzer().polarity_scores(text)['compound'] if text else 0.0
+
+def _adaptive_chunksize(texts, workers):
+    """
+    Dimensione dei chunk per executor.map: circa SENTIMENT_CHUNK_TARGET_CHARS caratteri per chunk
+    (chunk più piccoli per testi lunghi), ma almeno 4 chunk per worker per bilanciare il carico.
+    """
+    average_length = max(1.0, sum(len(text) for text in texts) / max(1, len(texts)))
+    by_length = max(1, int(SENTIMENT_CHUNK_TARGET_CHARS / average_length))
+    by_balance = max(1, math.ceil(len(texts) / (workers * 4)))
+    return min(by_length, by_balance)
+
+def label_sentiment_scores(scores):
+    """ Assegna le label 'positivo' / 'negativo' / 'neutrale' a un array di punteggi, in modo vettoriale. """
+    scores = np.asarray(scores, dtype=float)
+    return np.select(
+        [scores >= SENTIMENT_POSITIVE_THRESHOLD, scores <= SENTIMENT_NEGATIVE_THRESHOLD],
+        ['positivo', 'negativo'],
+        default='neutrale'
+    )
+
+@metrics.timed("sentiment")
+def analyze_sentiment_batch(texts, max_workers=None):
+    """
+    Analizza il sentiment di molti testi in blocco.
+    - I testi identici (crosspost, contenuti vuoti) vengono analizzati una sola volta.
+    - Se i testi unici sono molti, vengono distribuiti su un pool di processi con una
+      dimensione dei chunk adattata alla lunghezza media dei testi.
+    - Le label sono ottenute con una soglia vettoriale sui punteggi.
 
+    Args:
+        texts (iterable | pd.Series): Testi da analizzare (NaN/None sono trattati come vuoti).
+        max_workers (int, optional): Processi da usare. Default: numero di CPU; 1 = nessun pool.
+
+    Returns:
+        pd.DataFrame: colonne 'sentiment_score' e 'sentiment_label', con lo stesso indice
+        della Series in ingresso (o un RangeIndex per altri iterabili).
+    """
+    series = texts if isinstance(texts, pd.Series) else pd.Series(list(texts), dtype=object)
+    if series.empty:
+        return pd.DataFrame({'sentiment_score': pd.Series(dtype='float'), 'sentiment_label': pd.Series(dtype='str')},
+                            index=series.index)
+
+    metrics.add_rows("sentiment", len(series))
+    codes, unique_texts = pd.factorize(series.fillna('').astype(str))
+    unique_texts = list(unique_texts)
+    workers = max_workers or os.cpu_count() or 1
+
+    if workers > 1 and len(unique_texts) >= PARALLEL_SENTIMENT_MIN_TEXTS:
+        chunksize = _adaptive_chunksize(unique_texts, workers)
+        logger.info(f"Sentiment batch: {len(series)} testi ({len(unique_texts)} unici) su {workers} processi, chunksize {chunksize}...")
+        get_sentiment_analyzer() # Creato prima del pool: i processi figli (fork) lo ereditano già pronto
+        with metrics.span("sentiment_pool") as span, ProcessPoolExecutor(max_workers=workers) as executor:
+            unique_scores = list(executor.map(_compound_score, unique_texts, chunksize=chunksize))
+            span.add_rows(len(unique_texts))
+    else:
+        logger.info(f"Sentiment batch: {len(series)} testi ({len(unique_texts)} unici) in un solo processo...")
+        unique_scores = [_compound_score(text) for text in unique_texts]
+
+    scores = np.asarray(unique_scores, dtype=float)[codes]
+    return pd.DataFrame({'sentiment_score': scores, 'sentiment_label': label_sentiment_scores(scores)},
+                        index=series.index)
 
 def analyze_sentiment(text):
     """
@@ -56,12 +180,12 @@ def analyze_sentiment(text):
     if not text or pd.isna(text):
         return 0.0, 'neutrale'
     
-    vs = analyzer.polarity_scores(str(text))
+    vs = get_sentiment_analyzer().polarity_scores(str(text))
     compound_score = vs['compound']
     
-    if compound_score >= 0.05:
+    if compound_score >= SENTIMENT_POSITIVE_THRESHOLD:
         label = 'positivo'
-    elif compound_score <= -0.05:
+    elif compound_score <= SENTIMENT_NEGATIVE_THRESHOLD:
         label = 'negativo'
     else:
         label = 'neutrale'
@@ -79,9 +203,9 @@ def add_sentiment_to_df(df, text_column='contenuto', _query_key=None):
         return df
 
     logger.info(f"Analisi del sentiment sulla colonna '{text_column}' per query_key: '{_query_key}'...")
-    sentiments = df[text_column].apply(analyze_sentiment)
-    df['sentiment_score'] = sentiments.apply(lambda x: x[0])
-    df['sentiment_label'] = sentiments.apply(lambda x: x[1])
+    sentiments = analyze_sentiment_batch(df[text_column])
+    df['sentiment_score'] = sentiments['sentiment_score']
+    df['sentiment_label'] = sentiments['sentiment_label']
     logger.info("Analisi del sentiment completata.")
     return df
 
@@ -93,23 +217,89 @@ def preprocess_text_for_keywords(text):
     - Tokenizza
     - Rimuove stopwords
     - Restituisce una stringa di token puliti
+    Per molti testi usare tokenize_keyword_texts(), che lavora in batch.
     """
-    if not text or pd.isna(text):
-        return ""
-    
-    text = str(text).lower()
-    text = re.sub(r'[^\w\s]', '', text) 
-    text = re.sub(r'\d+', '', text)     
-    
-    tokens = word_tokenize(text, language='italian')
-    current_stopwords = stop_words_italian if isinstance(stop_words_italian, (list, set)) else []
-    filtered_tokens = [
-        word for word in tokens 
-        if word.isalpha() and len(word) > 2 and word not in current_stopwords
-    ]
-    return " ".join(filtered_tokens)
+    return " ".join(tokenize_text(text, get_italian_stopwords()))
+
+def tokenize_keyword_texts(texts):
+    """
+    Preprocessing per keyword in batch (text_processing.tokenize_series) con le stopword italiane.
+    Accetta una Series o una lista di testi; restituisce una Series di stringhe di token.
+    """
+    series = texts if isinstance(texts, pd.Series) else pd.Series(list(texts), dtype=object)
+    return tokenize_series(series, get_italian_stopwords())
+
 
+def document_terms_from_tokens(keyword_tokens):
+    """
+    Termini di un documento per l'indice keyword, dai token già preprocessati (stringa separata
+    da spazi, vedi tokenize_keyword_texts()): unigrammi e bigrammi (come ngram_range=(1, 2) del
+    TfidfVectorizer), con le occorrenze. Restituisce un Counter {termine: conteggio}.
+    """
+    tokens = keyword_tokens.split() if keyword_tokens else []
+    terms = Counter(tokens)
+    terms.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+    return terms
 
+@metrics.timed("index_keywords")
+def extract_top_keywords_from_index(conn, query_term=None, categoria=None, top_n=20,
+                                    max_features=1000, min_df=2, max_df=0.95):
+    """
+    Estrae le keyword più importanti dall'indice keyword persistente, senza rielaborare i testi
+    né riaddestrare un TfidfVectorizer. I conteggi per documento vengono letti dal DB per la
+    selezione (query e/o subreddit, oppure tutto il corpus) e pesati con l'idf globale
+    (smooth idf, come scikit-learn), normalizzati L2 per documento e sommati per termine.
+    min_df, max_df e max_features si applicano alla selezione, come in extract_top_keywords_tfidf.
+    Restituisce una lista di tuple (keyword, score).
+    """
+    from database import fetch_keyword_doc_terms, count_indexed_documents
+
+    doc_terms = fetch_keyword_doc_terms(conn, query_term=query_term, categoria=categoria)
+    if doc_terms.empty:
+        logger.warning(f"Nessun documento indicizzato per query '{query_term}' / subreddit '{categoria}'.")
+        return []
+
+    logger.info(f"Estrazione keywords dall'indice per query '{query_term}' / subreddit '{categoria}'...")
+    metrics.add_rows("index_keywords", len(doc_terms))
+    n_docs = doc_terms['post_id'].nunique()
+    selection_doc_freq = doc_terms.groupby('term')['post_id'].size()
+    min_doc_count = min_df if isinstance(min_df, int) else math.ceil(min_df * n_docs)
+    max_doc_count = max_df if isinstance(max_df, int) else max_df * n_docs
+    kept_terms = selection_doc_freq[(selection_doc_freq >= min_doc_count) & (selection_doc_freq <= max_doc_count)].index
+    if kept_terms.empty:
+        logger.warning("Nessun termine rimasto dopo i filtri min_df/max_df.")
+        return []
+    if max_features is not None and len(kept_terms) > max_features:
+        term_totals = doc_terms[doc_terms['term'].isin(kept_terms)].groupby('term')['term_count'].sum()
+        kept_terms = term_totals.sort_values(ascending=False, kind='stable').index[:max_features]
+
+    doc_terms = doc_terms[doc_terms['term'].isin(kept_terms)].copy()
+    total_docs = count_indexed_documents(conn)
+    idf = np.log((1 + total_docs) / (1 + doc_terms['doc_freq'].to_numpy(dtype=float))) + 1
+    doc_terms['weight'] = doc_terms['term_count'].to_numpy(dtype=float) * idf
+    doc_norms = np.sqrt((doc_terms['weight'] ** 2).groupby(doc_terms['post_id']).transform('sum'))
+    doc_terms['weight'] = doc_terms['weight'] / doc_norms
+
+    scores = doc_terms.groupby('term')['weight'].sum()
+    scores = scores[scores > 0.01].sort_values(ascending=False, kind='stable')
+    logger.info(f"Estrazione keywords dall'indice completata. Trovate {len(scores)} keyword prima del top_n.")
+    return [(term, float(score)) for term, score in scores.head(top_n).items()]
+
+
+def _keyword_tokens_for_df(df, text_column):
+    """
+    Token per keyword di ogni riga: riusa quelli salvati nel DB (colonna 'keyword_tokens',
+    calcolata dal contenuto) se aggiornati, e tokenizza in batch solo le righe restanti.
+    """
+    if text_column != 'contenuto' or 'keyword_tokens' not in df.columns or 'tokens_version' not in df.columns:
+        return tokenize_keyword_texts(df[text_column])
+    processed_texts = df['keyword_tokens'].where(df['tokens_version'] == TOKENIZER_VERSION).astype(object)
+    missing = processed_texts.isna()
+    if missing.any():
+        processed_texts[missing] = tokenize_keyword_texts(df.loc[missing, text_column])
+    return processed_texts
+
+@metrics.timed("tfidf_keywords")
 def extract_top_keywords_tfidf(df, text_column='contenuto', top_n=20):
     """
     Estrae le keyword più importanti da una colonna di testo usando TF-IDF.
@@ -121,11 +311,14 @@ def extract_top_keywords_tfidf(df, text_column='contenuto', top_n=20):
 
     logger.info(f"Estrazione keywords TF-IDF dalla colonna '{text_column}'...")
     
-    processed_texts = df[text_column].apply(preprocess_text_for_keywords)
+    processed_texts = _keyword_tokens_for_df(df, text_column)
     valid_texts = processed_texts[processed_texts.str.len() > 0]
     if valid_texts.empty:
         logger.warning("Nessun testo valido rimasto dopo il preprocessing per l'estrazione keyword.")
         return []
+    metrics.add_rows("tfidf_keywords", len(valid_texts))
+
+    from sklearn.feature_extraction.text import TfidfVectorizer # Import pigro: scikit-learn solo se serve
 
     try:
         vectorizer = TfidfVectorizer(
@@ -187,7 +380,8 @@ def get_overall_sentiment_distribution(df):
     logger.info("Distribuzione generale del sentiment calcolata.")
     return sentiment_counts
 
-if __name__ == '__main__':
+def _run_analysis_test():
+    """ Test manuale dell'analisi sui post salvati per una query di esempio. """
     from database import create_connection, fetch_all_posts_as_df, initialize_database
     
     logger.info("Avvio script analysis in modalità test.")
@@ -226,4 +420,27 @@ if __name__ == '__main__':
     else:
         logger.error("Impossibile connettersi al database per il test di analisi.")
 
-    logger.info("Script analysis (test) completato.")
\ No newline at end of file
+    logger.info("Script analysis (test) completato.")
+
+def main(argv=None):
+    """ python analysis.py --setup-nltk | --check-nltk, oppure senza opzioni per il test di analisi. """
+    parser = argparse.ArgumentParser(description="Analisi dei post e installazione delle risorse NLTK.")
+    parser.add_argument("--setup-nltk", action="store_true",
+                        help=f"Scarica le risorse NLTK mancanti ({', '.join(NLTK_RESOURCES)}) ed esce.")
+    parser.add_argument("--check-nltk", action="store_true",
+                        help="Verifica che le risorse NLTK siano installate (codice 1 se ne manca qualcuna).")
+    args = parser.parse_args(argv)
+
+    if args.setup_nltk or args.check_nltk:
+        missing = setup_nltk_resources() if args.setup_nltk else missing_nltk_resources()
+        if missing:
+            logger.error(f"Risorse NLTK mancanti: {', '.join(missing)}. Eseguire 'python analysis.py --setup-nltk'.")
+            return 1
+        logger.info(f"Risorse NLTK installate: {', '.join(NLTK_RESOURCES)}.")
+        return 0
+    _run_analysis_test()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
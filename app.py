@@ -1,23 +1,44 @@
 # reddit_analyzer/app.py
+import re
+import threading
+import weakref
+from contextlib import contextmanager
 import streamlit as st
 import pandas as pd
 import hashlib # Lo manteniamo se vuoi usarlo per debug futuri
 
 # ... (altre importazioni) ...
-from scraper import RedditScraper
-from database import create_connection, initialize_database, fetch_all_posts_as_df, fetch_posts_by_query_as_df
-from analysis import ( # add_sentiment_to_df è importato dalla funzione cachata
-    get_subreddit_distribution,
-    get_average_score_per_subreddit,
-    get_overall_sentiment_distribution
+# scraper (client HTTP) e visualization (plotly) sono importati solo dove servono: la pagina compare prima
+from response_cache import ResponseCache
+from snapshots import load_posts_with_snapshot
+from scheduler import RefreshScheduler, DEFAULT_REFRESH_INTERVAL_SECONDS, MIN_REFRESH_INTERVAL_SECONDS
+from database import (
+    create_connection,
+    initialize_database,
+    get_data_version,
+    add_tracked_query,
+    remove_tracked_query,
+    schedule_tracked_query_now,
+    fetch_tracked_queries,
+    dataframe_memory_usage,
+    fetch_posts_page,
+    fetch_post_content,
+    open_posts_export,
+    fetch_query_catalog,
+    fetch_subreddit_distribution,
+    fetch_average_score_per_subreddit,
+    rescore_post_sentiment,
+    index_post_keywords,
+    search_posts,
+    count_search_results,
+    quote_fts_query
 )
-from visualization import (
-    plot_sentiment_distribution,
-    plot_subreddit_distribution,
-    plot_average_score_per_subreddit,
-    plot_score_distribution
+from analysis import ( # add_sentiment_to_df è importato dalla funzione cachata
+    get_overall_sentiment_distribution,
+    extract_top_keywords_from_index
 )
 from utils import setup_logger
+import metrics
 
 logger = setup_logger("reddit_app")
 
@@ -25,28 +46,177 @@ initialize_database()
 
 st.set_page_config(page_title="Reddit Post Analyzer", layout="wide", initial_sidebar_state="expanded")
 
+MAX_POSTS_PER_SEARCH = 1000 # = scraper.LISTING_RESULT_CAP, ripetuto per non importare lo scraper all'avvio
+
+@st.cache_resource
+def get_dashboard_connection():
+    """
+    Una volta per processo: connessione SQLite condivisa da tutti i rerun e da tutte le sessioni,
+    con il lock che ne serializza l'uso. Streamlit esegue ogni rerun in un thread nuovo, quindi una
+    connessione per thread verrebbe riaperta (e riconfigurata con i PRAGMA) a ogni interazione.
+    """
+    return create_connection(check_same_thread=False), threading.Lock()
+
+@contextmanager
+def dashboard_connection():
+    """ Connessione condivisa della dashboard (None se non disponibile), riservata al thread corrente nel blocco with. """
+    conn, lock = get_dashboard_connection()
+    with lock:
+        yield conn
+
+@st.cache_resource
+def backfill_stored_sentiment():
+    """
+    Una volta per processo: calcola il sentiment dei post salvati che ne sono privi
+    (o con versione dell'analizzatore obsoleta). I post nuovi lo ricevono già all'inserimento.
+    Usa una connessione propria, per non bloccare le altre sessioni durante il ricalcolo.
+    """
+    conn = create_connection()
+    if not conn:
+        return 0
+    try:
+        return rescore_post_sentiment(conn)
+    finally:
+        conn.close()
+
+@st.cache_resource
+def backfill_keyword_index():
+    """
+    Una volta per processo: indicizza le keyword dei post salvati non ancora presenti
+    nell'indice. I post nuovi vengono indicizzati già all'inserimento.
+    """
+    conn = create_connection()
+    if not conn:
+        return 0
+    try:
+        return index_post_keywords(conn)
+    finally:
+        conn.close()
+
+@st.cache_resource
+def start_refresh_scheduler():
+    """
+    Una volta per processo: avvia lo scheduler che aggiorna in background le query monitorate,
+    così la dashboard legge solo i dati salvati e non attende mai la rete.
+    """
+    scheduler = RefreshScheduler()
+    scheduler.start()
+    return scheduler
+
+refresh_scheduler = start_refresh_scheduler()
+
+with st.spinner("Calcolo del sentiment per i post salvati..."):
+    backfill_stored_sentiment()
+with st.spinner("Aggiornamento dell'indice delle keyword..."):
+    backfill_keyword_index()
+
 # --- Funzioni Dati e Analisi ---
+# Colonne caricate per i grafici della pagina principale: titoli e contenuti restano nel DB
+# e vengono letti solo dalle viste che li mostrano o li analizzano
+ANALYSIS_COLUMNS = ('post_id', 'categoria', 'punteggio', 'timestamp_retrieval', 'sentiment_score', 'sentiment_label')
+SENTIMENT_TEXT_COLUMNS = ('post_id', 'titolo', 'contenuto')
+
 @st.cache_data
-def load_data_from_db_cached(query_term_for_cache_key: str | None):
-    logger.info(f"LOAD_DATA_FROM_DB_CACHED - Chiamata con query_key: {query_term_for_cache_key}")
-    conn = create_connection()
+def load_data_from_db_cached(query_term_for_cache_key: str | None, columns: tuple = ANALYSIS_COLUMNS, data_version: int | None = None):
+    logger.info(f"LOAD_DATA_FROM_DB_CACHED - Chiamata con query_key: {query_term_for_cache_key}, colonne: {columns}")
     actual_query_term = query_term_for_cache_key if query_term_for_cache_key != "TUTTI I POST" else None
     df = pd.DataFrame()
-    if conn:
-        try:
-            if actual_query_term:
-                df = fetch_posts_by_query_as_df(conn, actual_query_term)
-            else:
-                df = fetch_all_posts_as_df(conn)
-            logger.info(f"LOAD_DATA_FROM_DB_CACHED - Caricati {len(df)} righe per query_key: {query_term_for_cache_key}")
-        except Exception as e:
-            logger.error(f"Errore in load_data_from_db_cached: {e}")
-        finally:
-            conn.close()
+    with dashboard_connection() as conn:
+        if conn:
+            try:
+                # Solo le colonne richieste, con tipi compatti: dallo snapshot colonnare se allineato
+                # al DB (lettura in memory-map), altrimenti da SQLite riscrivendo lo snapshot
+                df = load_posts_with_snapshot(conn, columns=columns, query_term=actual_query_term)
+                logger.info(f"LOAD_DATA_FROM_DB_CACHED - Caricati {len(df)} righe per query_key: {query_term_for_cache_key}")
+            except Exception as e:
+                logger.error(f"Errore in load_data_from_db_cached: {e}")
     return df
 
+@st.cache_data
+def load_subreddit_aggregates_cached(query_term_for_cache_key: str, data_version: int | None = None):
+    """
+    Distribuzione e punteggio medio per subreddit, letti dai rollup SQL precalcolati:
+    non richiedono il caricamento dei post (né dei loro contenuti).
+    """
+    actual_query_term = query_term_for_cache_key if query_term_for_cache_key != "TUTTI I POST" else None
+    with dashboard_connection() as conn:
+        if not conn:
+            return pd.DataFrame(columns=['categoria', 'count']), pd.DataFrame(columns=['categoria', 'average_score'])
+        return (fetch_subreddit_distribution(conn, actual_query_term),
+                fetch_average_score_per_subreddit(conn, actual_query_term))
+
+@st.cache_data
+def load_top_keywords_cached(query_term_for_cache_key: str, top_n: int = 20, data_version: int | None = None):
+    """
+    Keyword principali lette dall'indice keyword persistente (nessun nuovo fit TF-IDF).
+    """
+    actual_query_term = query_term_for_cache_key if query_term_for_cache_key != "TUTTI I POST" else None
+    with dashboard_connection() as conn:
+        if not conn:
+            return []
+        return extract_top_keywords_from_index(conn, query_term=actual_query_term, top_n=top_n)
+
+SEARCH_PAGE_SIZE = 50
+RAW_DATA_PAGE_SIZE = 50
+# Ordinamenti della vista dei dati grezzi: (colonna, decrescente), eseguiti in SQL
+RAW_DATA_SORT_OPTIONS = {
+    "Più recenti": ('timestamp_retrieval', True),
+    "Meno recenti": ('timestamp_retrieval', False),
+    "Punteggio più alto": ('punteggio', True),
+    "Punteggio più basso": ('punteggio', False),
+}
+
+def _go_to_next_raw_page(cursor):
+    st.session_state['raw_data_cursors'].append(cursor)
+
+def _go_to_previous_raw_page():
+    if len(st.session_state['raw_data_cursors']) > 1:
+        st.session_state['raw_data_cursors'].pop()
+
+# Formati di esportazione dei post: (formato, MIME type)
+EXPORT_FORMAT_OPTIONS = {
+    "CSV": ('csv', 'text/csv'),
+    "NDJSON (un oggetto JSON per riga)": ('ndjson', 'application/x-ndjson'),
+}
+
+def _toggle_metrics():
+    # Le metriche sono globali al processo: valgono per tutte le sessioni della dashboard
+    if st.session_state['metrics_checkbox']:
+        metrics.enable()
+    else:
+        metrics.disable()
+
+def _posts_export_data(query_term, fmt, compress):
+    """
+    Dati per st.download_button: una callable eseguita solo al clic, che legge i post dal DB
+    in streaming (open_posts_export) invece di costruire il corpus in un DataFrame.
+    Il flusso viene letto dopo il ritorno della callable, fuori dal lock della connessione condivisa:
+    usa quindi una connessione propria, chiusa quando il flusso non è più referenziato.
+    """
+    def open_export():
+        conn = create_connection(check_same_thread=False)
+        stream = open_posts_export(conn, fmt, query_term=query_term, compress=compress)
+        weakref.finalize(stream, conn.close)
+        return stream
+    return open_export
+
+@st.cache_data
+def search_posts_cached(fts_query: str, query_term_for_cache_key: str, page: int, data_version: int | None = None):
+    """
+    Ricerca full-text (FTS5, ordinata per BM25): carica solo la pagina di post corrispondenti
+    e il numero totale di risultati.
+    """
+    actual_query_term = query_term_for_cache_key if query_term_for_cache_key != "TUTTI I POST" else None
+    with dashboard_connection() as conn:
+        if not conn:
+            return pd.DataFrame(), 0
+        total = count_search_results(conn, fts_query, query_term=actual_query_term)
+        results = search_posts(conn, fts_query, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE,
+                               query_term=actual_query_term)
+    return results, total
+
 @st.cache_data # RIATTIVIAMO LA CACHE
-def run_sentiment_analysis_cached(_df: pd.DataFrame, text_column: str, query_key_for_cache: str):
+def run_sentiment_analysis_cached(_df: pd.DataFrame, text_column: str, query_key_for_cache: str, data_version: int | None = None):
     """
     Funzione wrapper cachata per l'analisi del sentiment.
     query_key_for_cache è cruciale per l'invalidamento corretto della cache.
@@ -69,80 +239,241 @@ st.sidebar.markdown("Analizza i post di Reddit per query specifiche.")
 
 st.sidebar.header("1. Recupera Post")
 query_input = st.sidebar.text_input("Termine di ricerca:", placeholder="Es: intelligenza artificiale", key="query_text_input")
-num_posts_input = st.sidebar.number_input("Numero di post da recuperare:", min_value=5, max_value=500, value=25, step=5, key="num_posts_input")
+num_posts_input = st.sidebar.number_input("Numero di post da recuperare:", min_value=5, max_value=MAX_POSTS_PER_SEARCH, value=25, step=5, key="num_posts_input")
+
+incremental_input = st.sidebar.checkbox("Solo post nuovi (incrementale)", value=False, key="incremental_checkbox",
+                                        help="Ordina per 'new' e si ferma alla prima pagina di post già salvati.")
+deep_crawl_input = st.sidebar.checkbox("Deep crawl (oltre il limite di ~1000 risultati)", value=False, key="deep_crawl_checkbox",
+                                       help="Suddivide la ricerca per ordinamento e finestra temporale; il numero indicato vale per ogni partizione.")
+background_input = st.sidebar.checkbox("Aggiorna in background (query monitorata)", value=False, key="background_checkbox",
+                                       help="Il recupero avviene fuori dalla pagina e viene ripetuto periodicamente "
+                                            "(solo post nuovi); i dati compaiono al successivo aggiornamento della pagina.")
+if background_input:
+    refresh_interval_minutes = st.sidebar.number_input(
+        "Aggiorna ogni (minuti):", min_value=MIN_REFRESH_INTERVAL_SECONDS // 60,
+        value=DEFAULT_REFRESH_INTERVAL_SECONDS // 60, step=15, key="refresh_interval_input"
+    )
 
 if st.sidebar.button("Cerca e Salva Post", key="scrape_button"):
-    if query_input:
+    if query_input and background_input and not deep_crawl_input:
+        with dashboard_connection() as conn:
+            tracked = add_tracked_query(conn, query_input, num_posts_input, int(refresh_interval_minutes) * 60)
+        if tracked:
+            refresh_scheduler.wake()
+            st.sidebar.success(f"'{query_input}' è monitorata: il primo recupero parte subito in background, "
+                               f"poi ogni {int(refresh_interval_minutes)} minuti.")
+        else:
+            st.sidebar.error(f"Impossibile monitorare '{query_input}'.")
+    elif query_input:
+        from scraper import RedditScraper, deep_crawl_and_store
         with st.spinner(f"Recupero di circa {num_posts_input} post per '{query_input}'... Potrebbe richiedere tempo."):
-            scraper = RedditScraper(query=query_input, num_posts=num_posts_input)
+            # La cache su disco permette di rieseguire un refresh senza riscaricare le pagine recenti
+            scraper = RedditScraper(query=query_input, num_posts=num_posts_input, cache=ResponseCache())
             try:
-                inserted_count = scraper.scrape_and_store()
-                st.sidebar.success(f"Completato! {inserted_count} nuovi post inseriti nel database per '{query_input}'.")
+                if deep_crawl_input:
+                    inserted_count, crawl_report = deep_crawl_and_store(query_input, posts_per_partition=num_posts_input, cache=ResponseCache())
+                    productive_partitions = sum(1 for entry in crawl_report if entry['new_unique'] > 0)
+                    st.sidebar.success(f"Deep crawl completato! {inserted_count} nuovi post inseriti per '{query_input}' ({productive_partitions}/{len(crawl_report)} partizioni con post nuovi).")
+                elif incremental_input:
+                    stats = scraper.scrape_incremental()
+                    st.sidebar.success(f"Completato! {stats['fetched']} post scaricati, {stats['new']} nuovi, {stats['skipped']} già presenti per '{query_input}'.")
+                else:
+                    inserted_count = scraper.scrape_and_store()
+                    st.sidebar.success(f"Completato! {inserted_count} nuovi post inseriti nel database per '{query_input}'.")
                 st.cache_data.clear() 
-                st.experimental_rerun() 
+                st.rerun()
             except Exception as e:
                 st.sidebar.error(f"Errore durante lo scraping: {e}")
                 logger.error(f"Errore scraping in Streamlit UI: {e}", exc_info=True)
     else:
         st.sidebar.warning("Inserisci un termine di ricerca.")
 
+with dashboard_connection() as conn:
+    tracked_queries_df = fetch_tracked_queries(conn)
+if not tracked_queries_df.empty:
+    with st.sidebar.expander(f"Query monitorate ({len(tracked_queries_df)})"):
+        st.dataframe(tracked_queries_df[['query_term', 'interval_seconds', 'next_run_at', 'last_status', 'last_new_posts']],
+                     hide_index=True, use_container_width=True)
+        tracked_query = st.selectbox("Query:", tracked_queries_df['query_term'].tolist(), key="tracked_query_selector")
+        tracked_now_col, tracked_remove_col = st.columns(2)
+        if tracked_now_col.button("Aggiorna ora", key="tracked_refresh_now_button"):
+            with dashboard_connection() as conn:
+                schedule_tracked_query_now(conn, tracked_query)
+            refresh_scheduler.wake()
+        if tracked_remove_col.button("Non monitorare", key="tracked_remove_button"):
+            with dashboard_connection() as conn:
+                remove_tracked_query(conn, tracked_query)
+            refresh_scheduler.wake()
+            st.rerun()
+
 st.sidebar.markdown("---")
 st.sidebar.header("2. Seleziona Dati da Analizzare")
 
-conn_sidebar = create_connection()
 query_options = ["TUTTI I POST"] 
-if conn_sidebar:
+query_post_counts = {}
+query_catalog_df = pd.DataFrame()
+with dashboard_connection() as conn_sidebar:
     try:
-        queries_in_db_df = pd.read_sql_query("SELECT DISTINCT query_term FROM posts ORDER BY query_term", conn_sidebar)
-        if not queries_in_db_df.empty:
-            query_options.extend(queries_in_db_df['query_term'].tolist())
+        # Il catalogo 'queries' è precalcolato: nessuna scansione di 'posts' a ogni rerun
+        query_catalog_df = fetch_query_catalog(conn_sidebar) if conn_sidebar else pd.DataFrame()
+        if not query_catalog_df.empty:
+            query_options.extend(query_catalog_df['query_term'].tolist())
+            query_post_counts = dict(zip(query_catalog_df['query_term'], query_catalog_df['post_count']))
     except Exception as e: 
         logger.warning(f"Impossibile caricare query dal DB per la sidebar: {e}")
-    finally:
-        conn_sidebar.close()
 
 selected_query_for_analysis = st.sidebar.selectbox(
     "Scegli la query da analizzare (o tutti i post):", 
     options=query_options,
     index=0,
+    format_func=lambda option: f"{option} ({query_post_counts[option]} post)" if query_post_counts.get(option) is not None else option,
     key="query_selector" 
 )
 
+if selected_query_for_analysis in query_post_counts:
+    selected_stats = query_catalog_df.set_index('query_term').loc[selected_query_for_analysis]
+    st.sidebar.caption(f"Ultimo recupero: {selected_stats['last_scraped']} · Punteggio medio: {selected_stats['average_score']:.1f} "
+                       f"(min {selected_stats['score_min']}, max {selected_stats['score_max']})")
+
+if st.sidebar.button("Aggiorna punteggi dei post salvati", key="refresh_scores_button"):
+    refresh_query = selected_query_for_analysis if selected_query_for_analysis != "TUTTI I POST" else None
+    with st.spinner(f"Aggiornamento dei punteggi per '{selected_query_for_analysis}'..."):
+        try:
+            from scraper import RedditScraper
+            updated_count = RedditScraper(query=refresh_query).refresh_stored_posts()
+            st.sidebar.success(f"Aggiornati {updated_count} post per '{selected_query_for_analysis}'.")
+            st.cache_data.clear()
+            st.rerun()
+        except Exception as e:
+            st.sidebar.error(f"Errore durante l'aggiornamento dei punteggi: {e}")
+            logger.error(f"Errore refresh punteggi in Streamlit UI: {e}", exc_info=True)
+
+st.sidebar.markdown("---")
+st.sidebar.header("3. Cerca nei Post Salvati")
+search_input = st.sidebar.text_input("Cerca in titoli e contenuti:", placeholder="Es: machine learning", key="search_text_input")
+advanced_search_input = st.sidebar.checkbox("Sintassi FTS5 avanzata", value=False, key="advanced_search_checkbox",
+                                            help="Operatori AND/OR/NOT, frasi tra virgolette, prefissi (es. svilupp*). "
+                                                 "Se disattivata, tutte le parole inserite devono comparire nel post.")
+
+# Versione dei dati del DB: fa parte delle chiavi di cache, così i post salvati in background
+# dallo scheduler compaiono al rerun successivo senza svuotare tutta la cache
+with dashboard_connection() as conn:
+    current_data_version = get_data_version(conn) if conn else None
+
 # --- Main Page ---
 st.title(f"📊 Analisi Post Reddit: '{selected_query_for_analysis}'")
 
-df_display = load_data_from_db_cached(query_term_for_cache_key=selected_query_for_analysis)
+if search_input.strip():
+    fts_query = search_input.strip() if advanced_search_input else quote_fts_query(search_input)
+    st.header(f"🔎 Risultati della ricerca: {search_input.strip()}")
+    search_page = st.number_input("Pagina dei risultati:", min_value=1, value=1, step=1, key="search_page_input")
+    search_results, search_total = search_posts_cached(fts_query, selected_query_for_analysis, int(search_page), data_version=current_data_version)
+    if search_results.empty:
+        st.info(f"Nessun post trovato per la ricerca in '{selected_query_for_analysis}' (pagina {search_page}).")
+    else:
+        first_result = (int(search_page) - 1) * SEARCH_PAGE_SIZE + 1
+        st.caption(f"Risultati {first_result}-{first_result + len(search_results) - 1} di {search_total}, ordinati per rilevanza.")
+        search_columns = [col for col in ['titolo', 'categoria', 'punteggio', 'sentiment_label', 'contenuto', 'url_post'] if col in search_results.columns]
+        st.dataframe(search_results[search_columns], height=300, hide_index=True)
+    st.markdown("---")
+
+df_display = load_data_from_db_cached(query_term_for_cache_key=selected_query_for_analysis, data_version=current_data_version)
 
 if df_display.empty:
     st.warning(f"Nessun post trovato nel database per '{selected_query_for_analysis}'. Prova a recuperare dei post o a selezionare un'altra query.")
 else:
     st.success(f"Trovati {len(df_display)} post per '{selected_query_for_analysis}'.")
+    st.caption(f"Memoria dei dati caricati per i grafici: {dataframe_memory_usage(df_display)['totale'] / 1024 ** 2:.2f} MB "
+               f"({len(df_display.columns)} colonne).")
     
     if st.checkbox("Mostra dati grezzi (tabella dei post)", value=False, key="show_raw_data_checkbox"):
-        display_columns = [col for col in ['post_id', 'titolo', 'categoria', 'punteggio', 'contenuto', 'url_post', 'timestamp_retrieval'] if col in df_display.columns]
-        st.dataframe(df_display[display_columns], height=300)
+        raw_sort_label = st.selectbox("Ordina per:", list(RAW_DATA_SORT_OPTIONS), key="raw_data_sort_selector")
+        raw_sort_by, raw_descending = RAW_DATA_SORT_OPTIONS[raw_sort_label]
+        # Pila dei cursori keyset delle pagine visitate: si azzera se cambiano query o ordinamento
+        raw_pager_key = (selected_query_for_analysis, raw_sort_label)
+        if st.session_state.get('raw_data_pager_key') != raw_pager_key:
+            st.session_state['raw_data_pager_key'] = raw_pager_key
+            st.session_state['raw_data_cursors'] = [None]
+        raw_cursors = st.session_state['raw_data_cursors']
+
+        with dashboard_connection() as conn:
+            raw_page, raw_next_cursor = fetch_posts_page(
+                conn,
+                query_term=selected_query_for_analysis if selected_query_for_analysis != "TUTTI I POST" else None,
+                after=raw_cursors[-1], page_size=RAW_DATA_PAGE_SIZE, sort_by=raw_sort_by, descending=raw_descending
+            )
+        raw_selection = st.dataframe(raw_page, height=300, hide_index=True, on_select="rerun", selection_mode="single-row",
+                                     key=f"raw_data_table_{raw_sort_label}_{len(raw_cursors)}")
+
+        nav_prev, nav_info, nav_next = st.columns([1, 2, 1])
+        nav_prev.button("◀ Pagina precedente", key="raw_data_prev_button", disabled=len(raw_cursors) == 1,
+                        on_click=_go_to_previous_raw_page)
+        nav_info.caption(f"Pagina {len(raw_cursors)} · {len(raw_page)} post. Seleziona una riga per leggere il contenuto completo.")
+        nav_next.button("Pagina successiva ▶", key="raw_data_next_button", disabled=raw_next_cursor is None,
+                        on_click=_go_to_next_raw_page, args=(raw_next_cursor,))
+
+        # Il contenuto completo viene letto dal DB solo per la riga selezionata
+        selected_rows = raw_selection.selection.rows if raw_selection else []
+        if selected_rows and selected_rows[0] < len(raw_page):
+            with dashboard_connection() as conn:
+                selected_post = fetch_post_content(conn, raw_page.iloc[selected_rows[0]]['post_id'])
+            if selected_post:
+                with st.expander(selected_post['titolo'], expanded=True):
+                    st.write(selected_post['contenuto'] or "_(nessun contenuto testuale)_")
+                    st.markdown(f"[Apri su Reddit]({selected_post['url_post']})")
+
+    with st.expander("Esporta i post"):
+        export_format_label = st.selectbox("Formato:", list(EXPORT_FORMAT_OPTIONS), key="export_format_selector")
+        export_compress = st.checkbox("Comprimi (gzip)", value=True, key="export_gzip_checkbox")
+        export_fmt, export_mime = EXPORT_FORMAT_OPTIONS[export_format_label]
+        export_query_term = selected_query_for_analysis if selected_query_for_analysis != "TUTTI I POST" else None
+        export_name = "reddit_posts"
+        if export_query_term is not None:
+            export_name += "_" + re.sub(r'[^\w-]+', '_', export_query_term)
+        st.download_button(
+            "Scarica i post", data=_posts_export_data(export_query_term, export_fmt, export_compress),
+            file_name=f"{export_name}.{export_fmt}{'.gz' if export_compress else ''}",
+            mime='application/gzip' if export_compress else export_mime, key="export_posts_button", on_click="ignore"
+        )
 
     st.markdown("---")
     st.header("Analisi del Contenuto e Punteggi")
+    from visualization import (
+        plot_sentiment_distribution,
+        plot_subreddit_distribution,
+        plot_average_score_per_subreddit,
+        plot_score_distribution
+    )
 
-    df_for_sentiment_analysis = df_display.copy()
-    text_col_for_sentiment = 'full_text_for_sentiment'
-
-    if 'titolo' in df_for_sentiment_analysis.columns and 'contenuto' in df_for_sentiment_analysis.columns:
-        df_for_sentiment_analysis[text_col_for_sentiment] = df_for_sentiment_analysis['titolo'].fillna('') + " " + df_for_sentiment_analysis['contenuto'].fillna('')
-    elif 'titolo' in df_for_sentiment_analysis.columns:
-         df_for_sentiment_analysis[text_col_for_sentiment] = df_for_sentiment_analysis['titolo'].fillna('')
-    elif 'contenuto' in df_for_sentiment_analysis.columns:
-         df_for_sentiment_analysis[text_col_for_sentiment] = df_for_sentiment_analysis['contenuto'].fillna('')
-    else:
-        df_for_sentiment_analysis[text_col_for_sentiment] = "" 
-        logger.warning("Né 'titolo' né 'contenuto' trovati per creare la colonna di testo per il sentiment.")
-    
-    df_with_sentiment = run_sentiment_analysis_cached( # Chiamata alla funzione cachata
-        _df=df_for_sentiment_analysis, 
-        text_column=text_col_for_sentiment,
-        query_key_for_cache=selected_query_for_analysis # Passa la query selezionata come chiave per la cache
+    stored_sentiment_available = (
+        'sentiment_label' in df_display.columns and 'sentiment_score' in df_display.columns
+        and df_display['sentiment_label'].notna().all()
     )
+    if stored_sentiment_available:
+        # Sentiment già calcolato all'inserimento e salvato nel DB: nessun ricalcolo
+        df_with_sentiment = df_display
+    else:
+        # I testi servono solo qui: vengono caricati a parte, senza appesantire df_display
+        df_for_sentiment_analysis = load_data_from_db_cached(selected_query_for_analysis, columns=SENTIMENT_TEXT_COLUMNS,
+                                                             data_version=current_data_version).copy()
+        text_col_for_sentiment = 'full_text_for_sentiment'
+
+        if 'titolo' in df_for_sentiment_analysis.columns and 'contenuto' in df_for_sentiment_analysis.columns:
+            df_for_sentiment_analysis[text_col_for_sentiment] = df_for_sentiment_analysis['titolo'].fillna('') + " " + df_for_sentiment_analysis['contenuto'].fillna('')
+        elif 'titolo' in df_for_sentiment_analysis.columns:
+             df_for_sentiment_analysis[text_col_for_sentiment] = df_for_sentiment_analysis['titolo'].fillna('')
+        elif 'contenuto' in df_for_sentiment_analysis.columns:
+             df_for_sentiment_analysis[text_col_for_sentiment] = df_for_sentiment_analysis['contenuto'].fillna('')
+        else:
+            df_for_sentiment_analysis[text_col_for_sentiment] = "" 
+            logger.warning("Né 'titolo' né 'contenuto' trovati per creare la colonna di testo per il sentiment.")
+        
+        df_with_sentiment = run_sentiment_analysis_cached( # Chiamata alla funzione cachata
+            _df=df_for_sentiment_analysis, 
+            text_column=text_col_for_sentiment,
+            query_key_for_cache=selected_query_for_analysis, # Passa la query selezionata come chiave per la cache
+            data_version=current_data_version
+        )
     
     col1, col2 = st.columns(2)
 
@@ -170,30 +501,59 @@ else:
     st.header("Analisi per Subreddit")
     
     col3, col4 = st.columns(2)
+    subreddit_dist, avg_score_subreddit = load_subreddit_aggregates_cached(selected_query_for_analysis, data_version=current_data_version)
 
     with col3:
         st.subheader("Distribuzione Post per Subreddit")
-        if 'categoria' in df_display.columns: 
-            subreddit_dist = get_subreddit_distribution(df_display)
-            if not subreddit_dist.empty:
-                fig_subreddit = plot_subreddit_distribution(subreddit_dist, top_n=10)
-                st.plotly_chart(fig_subreddit, use_container_width=True)
-            else:
-                st.info("Nessun dato di subreddit da visualizzare.")
+        if not subreddit_dist.empty:
+            fig_subreddit = plot_subreddit_distribution(subreddit_dist, top_n=10)
+            st.plotly_chart(fig_subreddit, use_container_width=True)
         else:
-            st.info("Colonna 'categoria' non trovata per l'analisi dei subreddit.")
+            st.info("Nessun dato di subreddit da visualizzare.")
 
     with col4:
         st.subheader("Punteggio Medio per Subreddit")
-        if 'categoria' in df_display.columns and 'punteggio' in df_display.columns: 
-            avg_score_subreddit = get_average_score_per_subreddit(df_display)
-            if not avg_score_subreddit.empty:
-                fig_avg_score = plot_average_score_per_subreddit(avg_score_subreddit, top_n=10)
-                st.plotly_chart(fig_avg_score, use_container_width=True)
-            else:
-                st.info("Nessun dato di punteggio per subreddit da visualizzare.")
+        if not avg_score_subreddit.empty:
+            fig_avg_score = plot_average_score_per_subreddit(avg_score_subreddit, top_n=10)
+            st.plotly_chart(fig_avg_score, use_container_width=True)
         else:
-            st.info("Colonne 'categoria' o 'punteggio' non trovate.")
+            st.info("Nessun dato di punteggio per subreddit da visualizzare.")
+
+    st.markdown("---")
+    st.header("Keyword Principali")
+    top_keywords = load_top_keywords_cached(selected_query_for_analysis, data_version=current_data_version)
+    if top_keywords:
+        st.dataframe(pd.DataFrame(top_keywords, columns=['keyword', 'score']), use_container_width=True, hide_index=True)
+    else:
+        st.info("Nessuna keyword disponibile per la selezione corrente.")
             
     st.sidebar.markdown("---")
-    st.sidebar.info("Progetto Reddit Analyzer v0.6") # Versione aggiornata
\ No newline at end of file
+    st.sidebar.info("Progetto Reddit Analyzer v0.6") # Versione aggiornata
+
+# Pannello in fondo alla pagina: include i tempi delle fasi eseguite in questo rerun
+st.markdown("---")
+with st.expander("Prestazioni"):
+    st.checkbox("Raccogli metriche di tempo per fase", value=metrics.is_enabled(), key="metrics_checkbox",
+                on_change=_toggle_metrics,
+                help="Richieste HTTP, normalizzazione, inserimenti, letture SQL, sentiment, keyword e grafici. "
+                     "Le metriche sono del processo del server, condivise da tutte le sessioni.")
+    span_summary = metrics.span_summary()
+    if span_summary:
+        st.dataframe(pd.DataFrame(span_summary).rename(columns={
+            'span': 'Fase', 'calls': 'Chiamate', 'errors': 'Errori', 'total_seconds': 'Totale (s)',
+            'mean_ms': 'Media (ms)', 'p95_ms': 'p95 (ms)', 'max_ms': 'Max (ms)', 'rows': 'Righe',
+            'rows_per_second': 'Righe/s', 'bytes': 'Byte'}), use_container_width=True, hide_index=True)
+        http_counters = {counter['labels'].get('status', 'cache'): counter['value'] for counter in metrics.snapshot()['counters']
+                         if counter['name'] in ('http_responses_total', 'http_cache_hits_total')}
+        if http_counters:
+            st.caption("Risposte HTTP: " + ", ".join(f"{status}: {count}" for status, count in sorted(http_counters.items())))
+        export_prom, export_json, reset_col = st.columns(3)
+        export_prom.download_button("Scarica (Prometheus)", data=metrics.to_prometheus(), file_name="reddit_analyzer_metrics.prom",
+                                    mime='text/plain', key="metrics_prometheus_button", on_click="ignore")
+        export_json.download_button("Scarica (JSON)", data=metrics.to_json(), file_name="reddit_analyzer_metrics.json",
+                                    mime='application/json', key="metrics_json_button", on_click="ignore")
+        reset_col.button("Azzera metriche", key="metrics_reset_button", on_click=metrics.reset)
+    elif metrics.is_enabled():
+        st.info("Nessuna fase misurata finora: le metriche compaiono dal prossimo recupero o calcolo non in cache.")
+    else:
+        st.caption(f"Raccolta disattivata (costo nullo). Si può attivare anche con {metrics.METRICS_ENV_VAR}=1.")
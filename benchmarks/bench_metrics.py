@@ -0,0 +1,70 @@
+# reddit_analyzer/benchmarks/bench_metrics.py
+"""
+Costo della strumentazione di metrics.py per chiamata, con la raccolta spenta e accesa.
+
+Misura, su una funzione vuota:
+- chiamata diretta (riferimento);
+- funzione decorata con metrics.timed();
+- blocco `with metrics.span(...)` con add_rows().
+La differenza rispetto al riferimento è il costo aggiunto a ogni fase strumentata.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_metrics.py [--calls 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+
+def noop():
+    return None
+
+@metrics.timed("bench_timed")
+def timed_noop():
+    return None
+
+
+def run_direct(calls):
+    for _ in range(calls):
+        noop()
+
+def run_timed(calls):
+    for _ in range(calls):
+        timed_noop()
+
+def run_span(calls):
+    for _ in range(calls):
+        with metrics.span("bench_span") as span:
+            noop()
+            span.add_rows(1)
+
+
+def ns_per_call(func, calls):
+    started = time.perf_counter()
+    func(calls)
+    return (time.perf_counter() - started) * 1e9 / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo per chiamata della strumentazione di metrics.py.")
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"{'variante':<32}{'spenta (ns)':>14}{'accesa (ns)':>14}")
+    for label, func in (("chiamata diretta", run_direct), ("@metrics.timed()", run_timed), ("with metrics.span()", run_span)):
+        metrics.disable()
+        disabled = ns_per_call(func, args.calls)
+        metrics.enable()
+        metrics.reset()
+        enabled = ns_per_call(func, args.calls)
+        print(f"{label:<32}{disabled:>14.0f}{enabled:>14.0f}")
+    metrics.disable()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# reddit_analyzer/benchmarks/bench_sentiment_backfill.py
+"""
+Backfill del sentiment (database.rescore_post_sentiment) su un DB temporaneo con un corpus
+sintetico (default 20.000 post senza sentiment), con 1 processo e con il pool di processi.
+
+Verifica che con più worker il backfill passi davvero dal pool di analyze_sentiment_batch()
+(span 'sentiment_pool' di metrics.py) e che i punteggi salvati coincidano con quelli del
+calcolo in un solo processo. Esce con codice 1 se una delle verifiche fallisce.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_sentiment_backfill.py [--posts 20000] [--workers 4] [--seed 42]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+from analysis import get_sentiment_analyzer  # noqa: E402
+from database import create_connection, initialize_database, rescore_post_sentiment  # noqa: E402
+
+VOCABULARY = (
+    "ottimo pessimo bello brutto utile inutile fantastico terribile felice triste odio amo "
+    "python codice progetto lavoro errore problema soluzione libreria great bad love hate "
+    "good awful nice broken fixed thanks sorry fast slow"
+).split()
+
+
+def build_db(path, n_posts, seed):
+    """ Crea il DB in path con n_posts post sintetici, tutti senza sentiment. """
+    rng = random.Random(seed)
+    initialize_database(path)
+    conn = create_connection(path)
+    try:
+        rows = [(f"bench{i}", "bench", " ".join(rng.choices(VOCABULARY, k=rng.randint(3, 12))),
+                 " ".join(rng.choices(VOCABULARY, k=rng.randint(0, 80))), "bench", rng.randint(0, 500), "")
+                for i in range(n_posts)]
+        with conn:
+            conn.executemany(''' INSERT INTO posts(post_id, query_term, titolo, contenuto, categoria, punteggio, url_post)
+                                 VALUES(?,?,?,?,?,?,?) ''', rows)
+    finally:
+        conn.close()
+
+def run_backfill(path, max_workers):
+    """ Azzera il sentiment salvato ed esegue il backfill: (post ricalcolati, secondi, punteggi salvati). """
+    conn = create_connection(path)
+    try:
+        with conn:
+            conn.execute("UPDATE posts SET sentiment_score = NULL, sentiment_label = NULL, text_hash = NULL, sentiment_version = NULL")
+        started = time.perf_counter()
+        rescored = rescore_post_sentiment(conn, max_workers=max_workers)
+        elapsed = time.perf_counter() - started
+        scores = conn.execute("SELECT post_id, sentiment_score FROM posts ORDER BY post_id").fetchall()
+    finally:
+        conn.close()
+    return rescored, elapsed, scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill del sentiment con e senza pool di processi.")
+    parser.add_argument("--posts", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 1))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    get_sentiment_analyzer() # Caricamento del lessico VADER escluso dalle misure
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.db")
+        build_db(path, args.posts, args.seed)
+
+        serial_count, serial_seconds, serial_scores = run_backfill(path, max_workers=1)
+        metrics.enable()
+        pool_count, pool_seconds, pool_scores = run_backfill(path, max_workers=args.workers)
+        pool_span = next((entry for entry in metrics.span_summary() if entry['span'] == 'sentiment_pool'), None)
+        metrics.disable()
+
+    print(f"{'variante':<28}{'post':>10}{'secondi':>10}{'post/s':>12}")
+    print(f"{'1 processo':<28}{serial_count:>10}{serial_seconds:>10.2f}{serial_count / serial_seconds:>12.0f}")
+    print(f"{f'pool ({args.workers} processi)':<28}{pool_count:>10}{pool_seconds:>10.2f}{pool_count / pool_seconds:>12.0f}")
+
+    failures = []
+    if pool_span is None:
+        failures.append("il backfill non è passato dal pool di processi (nessuno span 'sentiment_pool').")
+    else:
+        print(f"\nPool usato {pool_span['calls']} volte per {pool_span['rows']} testi unici.")
+    if serial_scores != pool_scores:
+        failures.append("i punteggi del pool non coincidono con quelli in un solo processo.")
+    for failure in failures:
+        print(f"ERRORE: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
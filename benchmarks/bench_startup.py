@@ -0,0 +1,90 @@
+# reddit_analyzer/benchmarks/bench_startup.py
+"""
+Benchmark dell'avvio a freddo: tempo di import di ogni modulo del progetto, misurato in un
+interprete nuovo per ogni ripetizione (nessun modulo già in cache), più:
+- "app.py (import iniziali)": gli import di primo livello di app.py, cioè quanto la dashboard
+  carica prima di disegnare la pagina (letti da app.py, senza eseguire Streamlit);
+- "cli.py --help": tempo fino al primo output della CLI;
+- il costo differito al primo uso di VADER, delle stopword e di scikit-learn.
+
+Con --detail MODULO stampa le dipendenze più lente di quel modulo (python -X importtime).
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_startup.py [--repeat 5] [--detail analysis]
+"""
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('utils', 'metrics', 'text_processing', 'database', 'snapshots', 'rate_limiter', 'response_cache',
+           'analysis', 'visualization', 'scraper', 'scheduler', 'worker', 'cli')
+# Costi spostati al primo uso dagli import pigri di analysis.py
+FIRST_USE = {
+    "analysis.get_sentiment_analyzer()": "import analysis; analysis.get_sentiment_analyzer()",
+    "analysis.get_italian_stopwords()": "import analysis; analysis.get_italian_stopwords()",
+    "sklearn TfidfVectorizer": "from sklearn.feature_extraction.text import TfidfVectorizer",
+}
+TIMER_TEMPLATE = "import sys, time; sys.path.insert(0, {path!r}); t = time.perf_counter(); {code}; print(time.perf_counter() - t)"
+
+
+def app_startup_imports():
+    """ Istruzioni di import di primo livello di app.py (eseguite a ogni avvio della dashboard). """
+    with open(os.path.join(PROJECT_DIR, 'app.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return "; ".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+def time_in_fresh_interpreter(code, repeat):
+    """ Mediana (secondi) del tempo di esecuzione di code in repeat interpreti nuovi. """
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", TIMER_TEMPLATE.format(path=PROJECT_DIR, code=code)],
+                                cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+def time_command(args, repeat):
+    """ Mediana (secondi) del tempo totale di un comando, avvio dell'interprete compreso. """
+    code = f"import subprocess; subprocess.run({[sys.executable] + args!r}, cwd={PROJECT_DIR!r}, capture_output=True, check=True)"
+    return time_in_fresh_interpreter(code, repeat)
+
+def print_import_detail(module, top=15):
+    """ Le top dipendenze per tempo cumulativo di import di module (python -X importtime). """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "").split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    print(f"\nDipendenze più lente di '{module}' (cumulativo / proprio, ms):")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:>9.1f} {self_us / 1000:>9.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo di import a freddo dei moduli del progetto.")
+    parser.add_argument("--repeat", type=int, default=5, help="Interpreti nuovi per misura (si riporta la mediana).")
+    parser.add_argument("--detail", metavar="MODULO", help="Mostra le dipendenze più lente di MODULO.")
+    args = parser.parse_args()
+
+    print(f"{'modulo':<40}{'import a freddo (ms)':>22}")
+    for module in MODULES:
+        print(f"{module:<40}{1000 * time_in_fresh_interpreter(f'import {module}', args.repeat):>22.0f}")
+    print(f"{'app.py (import iniziali)':<40}{1000 * time_in_fresh_interpreter(app_startup_imports(), args.repeat):>22.0f}")
+    print(f"{'cli.py --help (processo completo)':<40}{1000 * time_command(['cli.py', '--help'], args.repeat):>22.0f}")
+
+    print(f"\n{'primo uso (import del modulo compreso)':<40}{'(ms)':>22}")
+    for label, code in FIRST_USE.items():
+        print(f"{label:<40}{1000 * time_in_fresh_interpreter(code, args.repeat):>22.0f}")
+
+    if args.detail:
+        print_import_detail(args.detail)
+
+
+if __name__ == "__main__":
+    main()
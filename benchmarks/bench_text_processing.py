@@ -0,0 +1,131 @@
+# reddit_analyzer/benchmarks/bench_text_processing.py
+"""
+Benchmark del preprocessing testuale su un corpus sintetico (default 100.000 post).
+
+Confronta, sugli stessi testi:
+- normalizzazione di titoli/contenuti: versione precedente (replace + regex non compilata)
+  contro text_processing.normalize_text(), la funzione usata dallo scraper per ogni post
+  (confronto tra le due implementazioni riga per riga: lo scraper normalizza pagine di al
+  massimo 100 post, troppo piccole perché una versione vettoriale pandas convenga);
+- tokenizzazione per keyword: versione precedente (regex non compilate, word_tokenize di NLTK,
+  stopword in una lista) contro la pipeline batch di analysis.tokenize_keyword_texts();
+- token salvati nel DB: costo di _keyword_tokens_for_df() quando i token sono già in cache.
+Verifica inoltre che i risultati delle due versioni coincidano.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_text_processing.py [--posts 100000] [--seed 42]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nltk.tokenize import word_tokenize  # noqa: E402
+
+import analysis  # noqa: E402
+from text_processing import normalize_text, TOKENIZER_VERSION  # noqa: E402
+
+VOCABULARY = (
+    "python codice programmazione sviluppo linguaggio libreria errore progetto lavoro università "
+    "esame computer rete server dati modello intelligenza artificiale reddit post commento thread "
+    "anche sempre molto perché quando dove come cosa the and cannot gonna wanna città però "
+    "machine learning rust java javascript framework database query indice prestazioni memoria"
+).split()
+PUNCTUATION = ["", "", "", ",", ".", "!", "?", ":", ";", "'", "(", ")", "..."]
+SEPARATORS = [" ", " ", " ", " ", "  ", "\n", "\r\n", "\t", " \n\n "]
+
+
+def build_corpus(n_posts, seed):
+    """ Genera n_posts testi sintetici con punteggiatura, numeri, URL e spazi irregolari. """
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n_posts):
+        words = []
+        for _ in range(rng.randint(0, 120)):
+            word = rng.choice(VOCABULARY)
+            if rng.random() < 0.1:
+                word = word.capitalize()
+            if rng.random() < 0.05:
+                word += str(rng.randint(0, 2024))
+            if rng.random() < 0.01:
+                word = f"https://www.reddit.com/r/{word}"
+            words.append(word + rng.choice(PUNCTUATION) + rng.choice(SEPARATORS))
+        texts.append("".join(words))
+    return texts
+
+
+def legacy_normalize_content(content_text):
+    """ RedditScraper._normalize_content prima di text_processing. """
+    if not content_text:
+        return ""
+    content = content_text.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+    content = content.replace('\t', ' ')
+    content = re.sub(r'\s+', ' ', content).strip()
+    return content
+
+
+def legacy_preprocess_text_for_keywords(text, stop_words_list):
+    """ analysis.preprocess_text_for_keywords prima di text_processing. """
+    if not text or pd.isna(text):
+        return ""
+    text = str(text).lower()
+    text = re.sub(r'[^\w\s]', '', text)
+    text = re.sub(r'\d+', '', text)
+    tokens = word_tokenize(text, language='italian')
+    filtered_tokens = [
+        word for word in tokens
+        if word.isalpha() and len(word) > 2 and word not in stop_words_list
+    ]
+    return " ".join(filtered_tokens)
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<42} {elapsed:8.2f} s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100_000, help="Numero di post sintetici (default: 100000).")
+    parser.add_argument("--seed", type=int, default=42, help="Seed del generatore (default: 42).")
+    args = parser.parse_args()
+
+    print(f"Generazione di {args.posts} post sintetici...")
+    texts = build_corpus(args.posts, args.seed)
+    series = pd.Series(texts, dtype=object)
+    print(f"Corpus: {sum(map(len, texts)) / 1e6:.1f} milioni di caratteri.\n")
+
+    print("Normalizzazione (titoli/contenuti):")
+    legacy_norm, legacy_norm_time = timed("riga per riga (replace + re.sub)", lambda: [legacy_normalize_content(t) for t in texts])
+    new_norm, new_norm_time = timed("text_processing.normalize_text (str.split)", lambda: [normalize_text(t) for t in texts])
+    assert legacy_norm == new_norm, "La normalizzazione differisce dalla versione precedente"
+
+    print("\nTokenizzazione per keyword:")
+    stop_words_list = list(analysis.get_italian_stopwords())
+    legacy_tokens, legacy_tok_time = timed("riga per riga (word_tokenize + lista)",
+                                           lambda: series.apply(legacy_preprocess_text_for_keywords, args=(stop_words_list,)))
+    batch_tokens, batch_tok_time = timed("analysis.tokenize_keyword_texts", lambda: analysis.tokenize_keyword_texts(series))
+    assert legacy_tokens.tolist() == batch_tokens.tolist(), "La tokenizzazione batch differisce dalla versione precedente"
+
+    df = pd.DataFrame({'contenuto': series, 'keyword_tokens': batch_tokens, 'tokens_version': TOKENIZER_VERSION})
+    _, cached_tok_time = timed("token salvati nel DB (_keyword_tokens_for_df)",
+                               lambda: analysis._keyword_tokens_for_df(df, 'contenuto'))
+
+    print("\nRiepilogo:")
+    print(f"  normalizzazione: {legacy_norm_time / new_norm_time:6.1f}x più veloce")
+    print(f"  tokenizzazione:  {legacy_tok_time / batch_tok_time:6.1f}x più veloce "
+          f"({legacy_tok_time / max(cached_tok_time, 1e-9):.0f}x con i token in cache)")
+    print("  output identici alla versione precedente: sì")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# reddit_analyzer/cli.py
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from utils import setup_logger
+import metrics
+from response_cache import ResponseCache
+from database import (
+    create_connection,
+    initialize_database,
+    load_posts_df,
+    fetch_query_catalog,
+    fetch_subreddit_distribution,
+    fetch_average_score_per_subreddit,
+    rescore_post_sentiment,
+    index_post_keywords
+)
+from analysis import get_overall_sentiment_distribution, extract_top_keywords_from_index
+
+# Nessun import di streamlit/plotly: questo entry point è pensato per cron e CI
+logger = setup_logger(__name__)
+
+DEFAULT_NUM_POSTS = 25
+DEFAULT_WORKERS = 4
+DEFAULT_TOP_KEYWORDS = 20
+DEFAULT_TOP_SUBREDDITS = 10
+SENTIMENT_LABELS = ('positivo', 'negativo', 'neutrale')
+# Colonne del report CSV (una riga per query)
+CSV_REPORT_COLUMNS = ('query', 'num_posts_target', 'status', 'inserted', 'scrape_seconds', 'post_count',
+                      'average_score', 'average_sentiment', 'sentiment_positivo', 'sentiment_negativo',
+                      'sentiment_neutrale', 'top_subreddit', 'top_keywords', 'error')
+
+def read_queries_file(path, default_num_posts=DEFAULT_NUM_POSTS):
+    """
+    Legge il file delle query: una query per riga, seguita facoltativamente da una virgola
+    (o un tab) e dal numero di post da recuperare, es. 'python programming, 100'.
+    Righe vuote e righe che iniziano con '#' sono ignorate.
+    Restituisce una lista di tuple (query, num_posts) senza duplicati (vale l'ultima riga).
+    Solleva ValueError se un numero di post non è valido.
+    """
+    targets = {}
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            query, num_posts = line, default_num_posts
+            for separator in ('\t', ','):
+                head, found, tail = line.rpartition(separator)
+                if found and tail.strip().lstrip('-').isdigit():
+                    query, num_posts = head.strip(), int(tail)
+                    break
+            if not query:
+                raise ValueError(f"{path}:{line_number}: query mancante.")
+            if num_posts <= 0:
+                raise ValueError(f"{path}:{line_number}: il numero di post deve essere positivo (trovato {num_posts}).")
+            targets[query] = num_posts
+    return list(targets.items())
+
+def analyze_query(conn, query_term, top_keywords=DEFAULT_TOP_KEYWORDS, top_subreddits=DEFAULT_TOP_SUBREDDITS):
+    """
+    Analisi di una query sui dati salvati: statistiche del catalogo, distribuzione e media del
+    sentiment (salvato nel DB), keyword dall'indice persistente e aggregati per subreddit dai rollup.
+    Non carica titoli né contenuti dei post.
+    """
+    catalog = fetch_query_catalog(conn)
+    catalog_row = catalog[catalog['query_term'] == query_term]
+    sentiment_df = load_posts_df(conn, columns=('sentiment_score', 'sentiment_label'), query_term=query_term)
+    sentiment_counts = get_overall_sentiment_distribution(sentiment_df)
+    subreddit_dist = fetch_subreddit_distribution(conn, query_term)
+    avg_score_subreddit = fetch_average_score_per_subreddit(conn, query_term)
+
+    average_score = catalog_row['average_score'].iloc[0] if not catalog_row.empty else None
+    average_sentiment = sentiment_df['sentiment_score'].mean() if not sentiment_df.empty else None
+    return {
+        'post_count': int(catalog_row['post_count'].iloc[0]) if not catalog_row.empty else 0,
+        'last_scraped': catalog_row['last_scraped'].iloc[0] if not catalog_row.empty else None,
+        'average_score': _round_or_none(average_score, 2),
+        'average_sentiment': _round_or_none(average_sentiment, 4),
+        'sentiment_distribution': {label: int(sentiment_counts.get(label, 0)) for label in SENTIMENT_LABELS},
+        'top_keywords': [{'keyword': term, 'score': round(score, 4)}
+                         for term, score in extract_top_keywords_from_index(conn, query_term=query_term, top_n=top_keywords)],
+        'top_subreddits': [{'categoria': row.categoria, 'count': int(row.count)}
+                           for row in subreddit_dist.head(top_subreddits).itertuples(index=False)],
+        'average_score_per_subreddit': [{'categoria': row.categoria, 'average_score': round(float(row.average_score), 2)}
+                                        for row in avg_score_subreddit.head(top_subreddits).itertuples(index=False)],
+    }
+
+def _round_or_none(value, digits):
+    """ Arrotonda un valore numerico (anche numpy); None per valori mancanti. """
+    if value is None or value != value: # NaN
+        return None
+    return round(float(value), digits)
+
+def _csv_report_rows(report):
+    """ Una riga riassuntiva per query (colonne CSV_REPORT_COLUMNS). """
+    for entry in report['queries']:
+        analysis = entry.get('analysis') or {}
+        sentiment = analysis.get('sentiment_distribution', {})
+        scrape = entry.get('scrape') or {}
+        yield {
+            'query': entry['query'],
+            'num_posts_target': entry['num_posts_target'],
+            'status': entry['status'],
+            'inserted': scrape.get('inserted'),
+            'scrape_seconds': scrape.get('seconds'),
+            'post_count': analysis.get('post_count'),
+            'average_score': analysis.get('average_score'),
+            'average_sentiment': analysis.get('average_sentiment'),
+            'sentiment_positivo': sentiment.get('positivo'),
+            'sentiment_negativo': sentiment.get('negativo'),
+            'sentiment_neutrale': sentiment.get('neutrale'),
+            'top_subreddit': analysis['top_subreddits'][0]['categoria'] if analysis.get('top_subreddits') else None,
+            'top_keywords': "; ".join(item['keyword'] for item in analysis.get('top_keywords', [])),
+            'error': entry.get('error'),
+        }
+
+def write_report(report, path):
+    """
+    Scrive il report in JSON (completo) o, se il file termina con '.csv', in CSV (una riga
+    riassuntiva per query). La scrittura è atomica. Restituisce True se riuscita.
+    """
+    tmp_path = None
+    try:
+        output_dir = os.path.dirname(path) or "."
+        os.makedirs(output_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            if path.lower().endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=CSV_REPORT_COLUMNS, lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(_csv_report_rows(report))
+            else:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Errore durante la scrittura del report '{path}': {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    logger.info(f"Report scritto in '{path}'.")
+    return True
+
+def run_batch(query_targets, skip_scrape=False, max_workers=DEFAULT_WORKERS, use_cache=True,
+              top_keywords=DEFAULT_TOP_KEYWORDS, top_subreddits=DEFAULT_TOP_SUBREDDITS):
+    """
+    Esegue la pipeline completa (recupero parallelo, aggiornamento di sentiment e indice keyword,
+    analisi per query) e restituisce il report come dizionario. Il campo 'ok' è False se almeno
+    una query è fallita o interrotta, oppure se il database non è raggiungibile.
+    """
+    started = time.perf_counter()
+    initialize_database()
+    scrape_results = {}
+    if not skip_scrape:
+        from scraper import scrape_and_store_queries_resumable # Import pigro: con --skip-scrape nessun client HTTP
+        scrape_results = scrape_and_store_queries_resumable(
+            query_targets, max_workers=max_workers, cache=ResponseCache() if use_cache else None)
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'ok': True,
+        'queries': [],
+    }
+    conn = create_connection()
+    if conn is None:
+        report['ok'] = False
+        report['error'] = "Connessione al database fallita."
+        return report
+    try:
+        # Come all'avvio della dashboard: solo i post senza sentiment/indice aggiornato
+        rescore_post_sentiment(conn)
+        index_post_keywords(conn)
+        for query, num_posts in query_targets:
+            scrape = scrape_results.get(query)
+            entry = {'query': query, 'num_posts_target': num_posts, 'status': 'ok', 'scrape': scrape, 'error': None}
+            if scrape is not None and (scrape['error'] or scrape['interrupted']):
+                entry['status'] = 'failed' if scrape['error'] else 'interrupted'
+                entry['error'] = scrape['error'] or "Recupero interrotto (vedi log): riprenderà dal cursore salvato."
+            try:
+                entry['analysis'] = analyze_query(conn, query, top_keywords=top_keywords, top_subreddits=top_subreddits)
+            except Exception as e:
+                logger.error(f"Errore durante l'analisi della query '{query}': {e}", exc_info=True)
+                entry['status'], entry['error'], entry['analysis'] = 'failed', str(e), None
+            report['ok'] = report['ok'] and entry['status'] == 'ok'
+            report['queries'].append(entry)
+    finally:
+        conn.close()
+    report['elapsed_seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+def main(argv=None):
+    """ Entry point: python cli.py queries.txt --report report.json [--report report.csv]. """
+    parser = argparse.ArgumentParser(
+        description="Recupera e analizza le query di un file senza interfaccia grafica (per cron e CI). "
+                    "Esce con codice 1 se una query fallisce o il report non può essere scritto.")
+    parser.add_argument("queries_file", help="File con una query per riga, opzionalmente seguita da ', numero_post'.")
+    parser.add_argument("--report", action="append", required=True, metavar="FILE",
+                        help="File del report: JSON, oppure CSV se termina con .csv (ripetibile).")
+    parser.add_argument("--default-posts", type=int, default=DEFAULT_NUM_POSTS,
+                        help=f"Post da recuperare per le query senza numero (default: {DEFAULT_NUM_POSTS}).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Query recuperate in parallelo (default: {DEFAULT_WORKERS}).")
+    parser.add_argument("--skip-scrape", action="store_true", help="Analizza solo i dati già salvati, senza richieste a Reddit.")
+    parser.add_argument("--no-cache", action="store_true", help="Non usare la cache su disco delle risposte HTTP.")
+    parser.add_argument("--top-keywords", type=int, default=DEFAULT_TOP_KEYWORDS)
+    parser.add_argument("--top-subreddits", type=int, default=DEFAULT_TOP_SUBREDDITS)
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Misura i tempi per fase e li scrive in FILE: JSON se termina con .json, altrimenti formato testo di Prometheus.")
+    args = parser.parse_args(argv)
+
+    try:
+        query_targets = read_queries_file(args.queries_file, default_num_posts=args.default_posts)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not query_targets:
+        parser.error(f"Nessuna query in '{args.queries_file}'.")
+
+    if args.metrics:
+        metrics.enable()
+    report = run_batch(query_targets, skip_scrape=args.skip_scrape, max_workers=args.workers, use_cache=not args.no_cache,
+                       top_keywords=args.top_keywords, top_subreddits=args.top_subreddits)
+    reports_written = all([write_report(report, path) for path in args.report])
+    if args.metrics:
+        reports_written = metrics.write_metrics(args.metrics) and reports_written
+    failed = [entry['query'] for entry in report['queries'] if entry['status'] != 'ok']
+    if failed:
+        logger.error(f"Query non completate: {', '.join(failed)}.")
+    return 0 if report['ok'] and reports_written else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,22 +1,87 @@
 # reddit_analyzer/database.py
+import argparse
+import csv
+import io
+import json
+import os
+import secrets
 import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
 import pandas as pd
 from utils import setup_logger
+from text_processing import TOKENIZER_VERSION
+import metrics
 
 logger = setup_logger(__name__)
 
 DB_NAME = "data/reddit_posts.db" # Assicurati che la cartella 'data' esista
+SQLITE_MAX_VARIABLES = 900 # Margine rispetto al limite storico di 999 parametri per query
+ALL_POSTS_ROLLUP_KEY = "" # Chiave dei rollup calcolati su tutti i post (vista "TUTTI I POST")
+# Colonne di 'posts' caricabili con load_posts_df() e quelle convertite in categoriche
+POST_COLUMNS = ('post_id', 'query_term', 'titolo', 'contenuto', 'categoria', 'punteggio', 'url_post',
+                'timestamp_retrieval', 'sentiment_score', 'sentiment_label', 'text_hash', 'sentiment_version',
+                'keyword_tokens', 'tokens_version')
+CATEGORICAL_POST_COLUMNS = ('query_term', 'categoria', 'sentiment_label', 'sentiment_version', 'tokens_version')
+# Paginazione keyset della vista dei dati grezzi (fetch_posts_page)
+PAGE_COLUMNS = ('post_id', 'titolo', 'categoria', 'punteggio', 'timestamp_retrieval', 'anteprima')
+PAGE_SORT_COLUMNS = ('timestamp_retrieval', 'punteggio')
+PREVIEW_CHARS = 200
+# Esportazione in streaming (iter_posts_export / export_posts)
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_COLUMNS = POST_COLUMNS[:10] # Colonne dei post senza quelle interne (hash, versioni, token)
+EXPORT_FETCH_SIZE = 1000 # Righe lette dal cursore per ogni blocco
+# Coda dei job di recupero condivisa dai worker (worker.py)
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+DEFAULT_JOB_MAX_ATTEMPTS = 3
+FTS_BM25_WEIGHTS = (2.0, 1.0) # Pesi BM25 di (titolo, contenuto): una corrispondenza nel titolo conta il doppio
 
-def create_connection(db_file=DB_NAME):
-    """ Crea una connessione al database SQLite specificato da db_file """
+BUSY_TIMEOUT_MS = 10000 # Attesa massima su un lock prima di "database is locked"
+
+# PRAGMA applicati a ogni connessione. Con WAL i lettori (dashboard) non bloccano
+# lo scrittore (scraper) e viceversa; synchronous=NORMAL è sicuro in modalità WAL.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA mmap_size=268435456", # 256 MB
+    "PRAGMA cache_size=-65536", # 64 MB (valori negativi = KiB)
+    "PRAGMA temp_store=MEMORY",
+)
+
+_initialized_dbs = set()
+
+def _configure_connection(conn):
+    """ Applica i PRAGMA di CONNECTION_PRAGMAS a una connessione appena aperta. """
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+
+def create_connection(db_file=DB_NAME, check_same_thread=True):
+    """
+    Crea una nuova connessione al database SQLite specificato da db_file,
+    configurata con CONNECTION_PRAGMAS. Il chiamante è responsabile di chiuderla.
+    Con check_same_thread=False la connessione può essere usata da più thread:
+    il chiamante deve serializzarne l'uso (es. con un lock).
+    """
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
-        logger.info(f"Connessione a SQLite DB {db_file} riuscita.")
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread)
+        _configure_connection(conn)
+        logger.debug(f"Connessione a SQLite DB {db_file} riuscita.")
     except sqlite3.Error as e:
         logger.error(f"Errore durante la connessione a SQLite DB {db_file}: {e}")
     return conn
 
+def _read_sql_query(sql, conn, params=None):
+    """ pd.read_sql_query misurato dallo span 'read_sql' (durata e righe lette, vedi metrics.py). """
+    with metrics.span("read_sql") as span:
+        df = pd.read_sql_query(sql, conn, params=params)
+        span.add_rows(len(df))
+    return df
+
 def create_table(conn):
     """ Crea la tabella dei post se non esiste """
     create_table_sql = """
@@ -31,29 +96,253 @@ def create_table(conn):
         timestamp_retrieval DATETIME DEFAULT CURRENT_TIMESTAMP
     );
     """
+    # Cursore di paginazione per (query, listing): permette di riprendere un recupero interrotto
+    create_cursors_sql = """
+    CREATE TABLE IF NOT EXISTS scrape_cursors (
+        query_term TEXT NOT NULL,
+        listing TEXT NOT NULL,
+        after_fullname TEXT NOT NULL,
+        posts_fetched INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (query_term, listing)
+    );
+    """
+    # Associazione molti-a-molti post <-> query: un post trovato da più query è salvato
+    # una sola volta in 'posts' e collegato a ciascuna query. La chiave primaria
+    # (query_term, post_id) è l'indice usato per i caricamenti per query.
+    create_post_queries_sql = """
+    CREATE TABLE IF NOT EXISTS post_queries (
+        query_term TEXT NOT NULL,
+        post_id TEXT NOT NULL REFERENCES posts(post_id),
+        linked_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (query_term, post_id)
+    ) WITHOUT ROWID;
+    """
+    # Catalogo delle query con statistiche precalcolate, aggiornato da insert_posts_batch
+    create_queries_sql = """
+    CREATE TABLE IF NOT EXISTS queries (
+        query_term TEXT PRIMARY KEY,
+        post_count INTEGER NOT NULL DEFAULT 0,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        score_min INTEGER,
+        score_max INTEGER,
+        last_scraped DATETIME
+    );
+    """
+    # Rollup per (query, subreddit) aggiornato a ogni inserimento; le righe con
+    # query_term = ALL_POSTS_ROLLUP_KEY aggregano l'intero corpus (ogni post una volta)
+    create_subreddit_stats_sql = """
+    CREATE TABLE IF NOT EXISTS subreddit_stats (
+        query_term TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        post_count INTEGER NOT NULL DEFAULT 0,
+        scored_count INTEGER NOT NULL DEFAULT 0,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (query_term, categoria)
+    ) WITHOUT ROWID;
+    """
+    # Indice keyword persistente: occorrenze dei termini (unigrammi e bigrammi) per post,
+    # frequenza documentale globale di ogni termine e hash del contenuto indicizzato
+    create_keyword_doc_terms_sql = """
+    CREATE TABLE IF NOT EXISTS keyword_doc_terms (
+        post_id TEXT NOT NULL,
+        term TEXT NOT NULL,
+        term_count INTEGER NOT NULL,
+        PRIMARY KEY (post_id, term)
+    ) WITHOUT ROWID;
+    """
+    create_keyword_doc_freq_sql = """
+    CREATE TABLE IF NOT EXISTS keyword_doc_freq (
+        term TEXT PRIMARY KEY,
+        doc_freq INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """
+    create_keyword_index_docs_sql = """
+    CREATE TABLE IF NOT EXISTS keyword_index_docs (
+        post_id TEXT PRIMARY KEY,
+        content_hash TEXT,
+        term_total INTEGER NOT NULL DEFAULT 0,
+        indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    # Query aggiornate periodicamente dallo scheduler di refresh (scheduler.py) e storico delle esecuzioni
+    create_tracked_queries_sql = """
+    CREATE TABLE IF NOT EXISTS tracked_queries (
+        query_term TEXT PRIMARY KEY,
+        num_posts INTEGER NOT NULL,
+        interval_seconds INTEGER NOT NULL,
+        enabled INTEGER NOT NULL DEFAULT 1,
+        next_run_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    create_scheduler_runs_sql = """
+    CREATE TABLE IF NOT EXISTS scheduler_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        query_term TEXT NOT NULL,
+        started_at DATETIME NOT NULL,
+        finished_at DATETIME,
+        status TEXT NOT NULL,
+        fetched INTEGER NOT NULL DEFAULT 0,
+        new_posts INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    );
+    """
+    # Coda dei job di recupero con lease: un job 'running' appartiene a lease_owner fino a
+    # lease_expires_at (timestamp Unix), rinnovato dai heartbeat del worker
+    create_jobs_sql = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        query_term TEXT NOT NULL,
+        num_posts INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        available_at REAL NOT NULL,
+        lease_owner TEXT,
+        lease_expires_at REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        started_at DATETIME,
+        finished_at DATETIME,
+        inserted INTEGER,
+        last_error TEXT
+    );
+    """
+    create_indexes_sql = (
+        "CREATE INDEX IF NOT EXISTS idx_post_queries_post_id ON post_queries(post_id)",
+        "CREATE INDEX IF NOT EXISTS idx_posts_categoria ON posts(categoria)",
+        # Indici della paginazione keyset (fetch_posts_page): ordinamento + post_id come spareggio
+        "CREATE INDEX IF NOT EXISTS idx_posts_timestamp_post_id ON posts(timestamp_retrieval, post_id)",
+        "CREATE INDEX IF NOT EXISTS idx_posts_punteggio_post_id ON posts(punteggio, post_id)",
+        "CREATE INDEX IF NOT EXISTS idx_keyword_doc_terms_term ON keyword_doc_terms(term)",
+        "CREATE INDEX IF NOT EXISTS idx_scheduler_runs_query_term ON scheduler_runs(query_term, run_id)",
+        # Al massimo un job in coda o in esecuzione per query: la stessa query non viene recuperata due volte
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_query ON jobs(query_term) WHERE status IN ('queued', 'running')",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs(status, available_at, job_id)",
+    )
     try:
         cursor = conn.cursor()
         cursor.execute(create_table_sql)
+        cursor.execute(create_cursors_sql)
+        cursor.execute(create_post_queries_sql)
+        cursor.execute(create_queries_sql)
+        cursor.execute(create_subreddit_stats_sql)
+        cursor.execute(create_keyword_doc_terms_sql)
+        cursor.execute(create_keyword_doc_freq_sql)
+        cursor.execute(create_keyword_index_docs_sql)
+        cursor.execute(create_tracked_queries_sql)
+        cursor.execute(create_scheduler_runs_sql)
+        cursor.execute(create_jobs_sql)
+        for index_sql in create_indexes_sql:
+            cursor.execute(index_sql)
         conn.commit()
-        logger.info("Tabella 'posts' verificata/creata con successo.")
+        _create_fulltext_index(conn)
+        _create_data_version_tracking(conn)
+        _apply_migrations(conn)
+        logger.info("Tabelle 'posts', 'post_queries', 'queries', 'subreddit_stats', indice keyword, 'scrape_cursors', tabelle dello scheduler e coda dei job verificate/create con successo.")
     except sqlite3.Error as e:
-        logger.error(f"Errore durante la creazione della tabella 'posts': {e}")
+        logger.error(f"Errore durante la creazione delle tabelle: {e}")
+
+# --- Migrazioni dello schema ---
+# Ogni migrazione porta il DB alla versione successiva (PRAGMA user_version = posizione + 1)
+# e viene eseguita una sola volta, in una transazione.
+
+def _migration_link_existing_posts(conn):
+    """ v1: popola post_queries a partire dalla colonna posts.query_term dei DB esistenti. """
+    conn.execute(''' INSERT OR IGNORE INTO post_queries(query_term, post_id, linked_at)
+                     SELECT query_term, post_id, timestamp_retrieval FROM posts ''')
+
+def _migration_build_query_catalog(conn):
+    """ v2: popola il catalogo 'queries' per i DB esistenti. """
+    rebuild_query_catalog(conn, commit=False)
+
+def _migration_build_subreddit_stats(conn):
+    """ v3: popola i rollup per subreddit per i DB esistenti. """
+    rebuild_subreddit_stats(conn, commit=False)
+
+def _migration_add_sentiment_columns(conn):
+    """
+    v4: colonne del sentiment calcolato all'inserimento. I post esistenti restano con
+    sentiment_version NULL e vengono calcolati da rescore_post_sentiment().
+    """
+    conn.execute("ALTER TABLE posts ADD COLUMN sentiment_score REAL")
+    conn.execute("ALTER TABLE posts ADD COLUMN sentiment_label TEXT")
+    conn.execute("ALTER TABLE posts ADD COLUMN text_hash TEXT")
+    conn.execute("ALTER TABLE posts ADD COLUMN sentiment_version TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_sentiment_version ON posts(sentiment_version)")
+
+def _migration_add_keyword_token_columns(conn):
+    """
+    v5: token per keyword salvati per post (text_processing.TOKENIZER_VERSION). I post esistenti
+    restano con tokens_version NULL e vengono tokenizzati da index_post_keywords().
+    """
+    conn.execute("ALTER TABLE posts ADD COLUMN keyword_tokens TEXT")
+    conn.execute("ALTER TABLE posts ADD COLUMN tokens_version TEXT")
+
+def _migration_replace_timestamp_index(conn):
+    """
+    v6: l'indice su (timestamp_retrieval, post_id) creato da create_table() per la paginazione
+    keyset copre anche le ricerche per sola data: il vecchio indice su timestamp_retrieval è superfluo.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_posts_timestamp_retrieval")
+
+SCHEMA_MIGRATIONS = [
+    _migration_link_existing_posts,
+    _migration_build_query_catalog,
+    _migration_build_subreddit_stats,
+    _migration_add_sentiment_columns,
+    _migration_add_keyword_token_columns,
+    _migration_replace_timestamp_index,
+]
 
+def _apply_migrations(conn):
+    """ Esegue le migrazioni non ancora applicate, in ordine. """
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target_version, migration in enumerate(SCHEMA_MIGRATIONS[current_version:], start=current_version + 1):
+        try:
+            with conn:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {target_version}")
+            logger.info(f"Migrazione dello schema alla versione {target_version} completata ({migration.__name__}).")
+        except sqlite3.Error as e:
+            logger.error(f"Errore durante la migrazione dello schema alla versione {target_version}: {e}")
+            raise
+
+@metrics.timed("insert_posts_batch")
 def insert_posts_batch(conn, posts_data, query_term):
     """
-    Inserisce una lista di post nel database.
-    Utilizza INSERT OR IGNORE per evitare duplicati basati su post_id.
+    Inserisce una lista di post nel database e li collega a query_term.
+    Utilizza INSERT OR IGNORE per evitare duplicati: ogni post è salvato una sola volta
+    in 'posts', mentre 'post_queries' registra ogni query che lo ha trovato.
+    Nella stessa transazione aggiorna il catalogo 'queries' e i rollup di 'subreddit_stats'
+    con i post nuovi (per la query e per l'intero corpus). Sentiment e termini dell'indice
+    keyword (token e termini) dei post mai visti vengono calcolati prima della transazione e
+    salvati insieme al post.
+    Restituisce il numero di post nuovi per questa query (nuovi collegamenti post-query).
     """
     if not posts_data:
         logger.info("Nessun post da inserire.")
         return 0
+    metrics.add_rows("insert_posts_batch", len(posts_data))
 
-    sql = ''' INSERT OR IGNORE INTO posts(post_id, query_term, titolo, contenuto, categoria, punteggio, url_post)
-              VALUES(?,?,?,?,?,?,?) '''
+    sql = ''' INSERT OR IGNORE INTO posts(post_id, query_term, titolo, contenuto, categoria, punteggio, url_post,
+                                          sentiment_score, sentiment_label, text_hash, sentiment_version,
+                                          keyword_tokens, tokens_version)
+              VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?) '''
+    link_sql = ''' INSERT OR IGNORE INTO post_queries(query_term, post_id) VALUES(?,?) '''
     
+    # Sentiment, token e termini calcolati fuori dalla transazione, solo per i post non ancora salvati
+    known_ids = fetch_existing_post_ids(conn, [post.get('post_id') for post in posts_data])
+    unseen_posts = [post for post in posts_data if post.get('post_id') not in known_ids]
+    sentiments = _compute_sentiment_for_new_posts(unseen_posts)
+    keyword_docs = _compute_keyword_documents(unseen_posts)
+
     # Prepara i dati per l'inserimento, aggiungendo il query_term a ciascun post
     data_to_insert = []
+    links_to_insert = []
     for post in posts_data:
+        sentiment_score, sentiment_label, text_hash, sentiment_version = sentiments.get(post.get('post_id'), (None, None, None, None))
+        keyword_doc = keyword_docs.get(post.get('post_id'))
         data_to_insert.append((
             post.get('post_id'),
             query_term,
@@ -61,59 +350,1404 @@ def insert_posts_batch(conn, posts_data, query_term):
             post.get('contenuto'),
             post.get('categoria'),
             post.get('punteggio'),
-            post.get('url_post')
+            post.get('url_post'),
+            sentiment_score,
+            sentiment_label,
+            text_hash,
+            sentiment_version,
+            keyword_doc[1] if keyword_doc else None,
+            TOKENIZER_VERSION if keyword_doc else None
         ))
+        links_to_insert.append((query_term, post.get('post_id')))
 
     try:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE") # Lock di scrittura subito: la lettura dei link esistenti resta coerente
+        batch_ids = list(dict.fromkeys(post_id for _, post_id in links_to_insert))
+        already_linked = fetch_existing_post_ids(conn, batch_ids, query_term=query_term)
+        new_link_ids = [post_id for post_id in batch_ids if post_id not in already_linked]
+        already_stored = fetch_existing_post_ids(conn, batch_ids)
+        new_post_ids = [post_id for post_id in batch_ids if post_id not in already_stored]
+
         cursor = conn.cursor()
         cursor.executemany(sql, data_to_insert)
+        inserted_posts = cursor.rowcount # Post mai visti prima (da qualsiasi query)
+        cursor.executemany(link_sql, links_to_insert)
+        inserted_rows = cursor.rowcount # Post nuovi per questa query
+        _update_query_catalog(conn, query_term, new_link_ids)
+        _update_subreddit_stats(conn, query_term, new_link_ids)
+        _update_subreddit_stats(conn, ALL_POSTS_ROLLUP_KEY, new_post_ids)
+        _add_keyword_documents(conn, {post_id: keyword_docs[post_id] for post_id in new_post_ids if post_id in keyword_docs})
         conn.commit()
-        inserted_rows = cursor.rowcount # Restituisce il numero di righe effettivamente inserite/modificate
-        logger.info(f"Inserite {inserted_rows} nuove righe di post nel database per la query '{query_term}'.")
+        logger.info(f"Inseriti {inserted_rows} nuovi post per la query '{query_term}' ({inserted_posts} mai visti prima).")
         return inserted_rows
     except sqlite3.Error as e:
+        conn.rollback()
         logger.error(f"Errore durante l'inserimento batch dei post: {e}")
         return 0
 
-def fetch_all_posts_as_df(conn):
-    """ Recupera tutti i post dal database e li restituisce come DataFrame pandas. """
+def _compute_sentiment_for_new_posts(new_posts):
+    """
+    Calcola il sentiment dei post non ancora presenti nel DB.
+    Restituisce {post_id: (sentiment_score, sentiment_label, text_hash, sentiment_version)}.
+    Sempre in un solo processo: l'inserimento avviene anche dal server Streamlit e dai thread di
+    scheduler e worker, dove non si avvia un pool di processi (il pool resta al backfill).
+    """
+    from analysis import score_posts_sentiment, SENTIMENT_ANALYZER_VERSION # Import pigro: NLTK solo se serve
+
+    if not new_posts:
+        return {}
+    try:
+        scores = score_posts_sentiment(new_posts, max_workers=1)
+    except Exception as e:
+        # Il post viene salvato comunque: rescore_post_sentiment() lo recupererà in seguito
+        logger.error(f"Errore durante il calcolo del sentiment all'inserimento: {e}")
+        return {}
+    return {post.get('post_id'): (score, label, text_hash, SENTIMENT_ANALYZER_VERSION)
+            for post, (score, label, text_hash) in zip(new_posts, scores)}
+
+def _content_hash(contenuto):
+    """ Hash del contenuto indicizzato: se cambia, i termini del post vanno ricalcolati. """
+    from analysis import compute_text_hash
+    return compute_text_hash(contenuto or "")
+
+def _compute_keyword_documents(new_posts):
+    """
+    Tokenizza in batch il contenuto dei post indicati e ne calcola i termini per l'indice keyword.
+    Restituisce {post_id: (content_hash, keyword_tokens, Counter dei termini)}.
+    """
+    from analysis import tokenize_keyword_texts, document_terms_from_tokens
+
+    if not new_posts:
+        return {}
     try:
-        df = pd.read_sql_query("SELECT * FROM posts", conn)
-        logger.info(f"Recuperati {len(df)} post dal database.")
+        contents = [post.get('contenuto') for post in new_posts]
+        keyword_tokens = tokenize_keyword_texts(contents)
+        return {post.get('post_id'): (_content_hash(contenuto), tokens, document_terms_from_tokens(tokens))
+                for post, contenuto, tokens in zip(new_posts, contents, keyword_tokens)}
+    except Exception as e:
+        # Il post resta fuori dall'indice: index_post_keywords() lo recupererà in seguito
+        logger.error(f"Errore durante l'estrazione dei termini all'inserimento: {e}")
+        return {}
+
+def _iter_sentiment_rows(conn, post_ids, current_version, batch_size):
+    """
+    Produce blocchi di righe (post_id, titolo, contenuto, text_hash, sentiment_version):
+    per i post_id indicati, oppure (se post_ids è None) per i post senza sentiment
+    o con versione dell'analizzatore diversa da current_version.
+    """
+    columns = "post_id, titolo, contenuto, text_hash, sentiment_version"
+    if post_ids is not None:
+        post_ids = list(post_ids)
+        for start in range(0, len(post_ids), SQLITE_MAX_VARIABLES):
+            chunk = post_ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            yield conn.execute(f"SELECT {columns} FROM posts WHERE post_id IN ({placeholders})", chunk).fetchall()
+        return
+
+    last_rowid = 0
+    while True:
+        rows = conn.execute(f''' SELECT rowid, {columns} FROM posts
+                                 WHERE (sentiment_version IS NULL OR sentiment_version != ?) AND rowid > ?
+                                 ORDER BY rowid LIMIT ? ''', (current_version, last_rowid, batch_size)).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield [row[1:] for row in rows]
+
+def rescore_post_sentiment(conn, post_ids=None, batch_size=1000, max_workers=None):
+    """
+    Ricalcola e salva il sentiment solo dove serve:
+    - con post_ids: per i post indicati il cui hash di titolo/contenuto è cambiato
+      (o la cui versione dell'analizzatore è obsoleta);
+    - senza post_ids: per tutti i post senza sentiment o con versione obsoleta (backfill).
+    Le righe sono lette a blocchi di batch_size, ma i testi da analizzare vengono accumulati fino a
+    SENTIMENT_BACKFILL_MIN_TEXTS prima di ogni calcolo: un backfill grande raggiunge così la soglia
+    del pool di processi di analyze_sentiment_batch() (max_workers, default: numero di CPU).
+    Restituisce il numero di post ricalcolati.
+    """
+    from analysis import (build_sentiment_text, compute_text_hash, score_posts_sentiment,
+                          SENTIMENT_ANALYZER_VERSION, SENTIMENT_BACKFILL_MIN_TEXTS)
+
+    update_sql = ''' UPDATE posts SET sentiment_score = ?, sentiment_label = ?, text_hash = ?, sentiment_version = ?
+                     WHERE post_id = ? '''
+    rescored = 0
+    pending = []
+
+    def flush():
+        nonlocal rescored, pending
+        scores = score_posts_sentiment(pending, max_workers=max_workers)
+        conn.executemany(update_sql, [(score, label, text_hash, SENTIMENT_ANALYZER_VERSION, post['post_id'])
+                                      for post, (score, label, text_hash) in zip(pending, scores)])
+        conn.commit()
+        rescored += len(pending)
+        pending = []
+
+    try:
+        for rows in _iter_sentiment_rows(conn, post_ids, SENTIMENT_ANALYZER_VERSION, batch_size):
+            pending.extend(
+                {'post_id': post_id, 'titolo': titolo, 'contenuto': contenuto}
+                for post_id, titolo, contenuto, stored_hash, stored_version in rows
+                if stored_version != SENTIMENT_ANALYZER_VERSION
+                or stored_hash != compute_text_hash(build_sentiment_text(titolo, contenuto))
+            )
+            if len(pending) >= SENTIMENT_BACKFILL_MIN_TEXTS:
+                flush()
+        if pending:
+            flush()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Errore durante il ricalcolo del sentiment: {e}")
+    except LookupError as e:
+        # Risorse NLTK non installate: i post restano senza sentiment fino al prossimo backfill
+        logger.error(f"Sentiment non ricalcolato: {e}")
+    if rescored:
+        logger.info(f"Sentiment ricalcolato per {rescored} post.")
+    return rescored
+
+def _add_keyword_documents(conn, keyword_docs):
+    """
+    Aggiunge all'indice keyword i documenti {post_id: (content_hash, keyword_tokens, termini)} e incrementa
+    la frequenza documentale dei loro termini. Non effettua il commit.
+    """
+    if not keyword_docs:
+        return
+    conn.executemany(''' INSERT INTO keyword_index_docs(post_id, content_hash, term_total) VALUES(?,?,?) ''',
+                     [(post_id, content_hash, sum(terms.values())) for post_id, (content_hash, _, terms) in keyword_docs.items()])
+    conn.executemany(''' INSERT INTO keyword_doc_terms(post_id, term, term_count) VALUES(?,?,?) ''',
+                     [(post_id, term, count) for post_id, (_, _, terms) in keyword_docs.items() for term, count in terms.items()])
+    doc_freq_delta = Counter(term for _, _, terms in keyword_docs.values() for term in terms)
+    conn.executemany(''' INSERT INTO keyword_doc_freq(term, doc_freq) VALUES(?,?)
+                         ON CONFLICT(term) DO UPDATE SET doc_freq = doc_freq + excluded.doc_freq ''',
+                     doc_freq_delta.items())
+
+def _remove_keyword_documents(conn, post_ids):
+    """
+    Rimuove dall'indice keyword i post indicati e decrementa la frequenza documentale
+    dei loro termini. Non effettua il commit.
+    """
+    post_ids = list(post_ids)
+    doc_freq_delta = Counter()
+    for start in range(0, len(post_ids), SQLITE_MAX_VARIABLES):
+        chunk = post_ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        doc_freq_delta.update(term for (term,) in conn.execute(
+            f"SELECT term FROM keyword_doc_terms WHERE post_id IN ({placeholders})", chunk))
+        conn.execute(f"DELETE FROM keyword_doc_terms WHERE post_id IN ({placeholders})", chunk)
+        conn.execute(f"DELETE FROM keyword_index_docs WHERE post_id IN ({placeholders})", chunk)
+    if doc_freq_delta:
+        conn.executemany("UPDATE keyword_doc_freq SET doc_freq = doc_freq - ? WHERE term = ?",
+                         [(count, term) for term, count in doc_freq_delta.items()])
+        conn.execute("DELETE FROM keyword_doc_freq WHERE doc_freq <= 0")
+
+def _iter_keyword_rows(conn, post_ids, current_version, batch_size):
+    """
+    Produce blocchi di righe (post_id, contenuto, content_hash indicizzato, tokens_version):
+    per i post_id indicati, oppure (se post_ids è None) per i post non ancora presenti
+    nell'indice keyword o con token calcolati da una versione diversa da current_version.
+    """
+    columns = "p.post_id, p.contenuto, d.content_hash, p.tokens_version"
+    if post_ids is not None:
+        post_ids = list(post_ids)
+        for start in range(0, len(post_ids), SQLITE_MAX_VARIABLES):
+            chunk = post_ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            yield conn.execute(f''' SELECT {columns} FROM posts p
+                                    LEFT JOIN keyword_index_docs d ON d.post_id = p.post_id
+                                    WHERE p.post_id IN ({placeholders}) ''', chunk).fetchall()
+        return
+
+    last_rowid = 0
+    while True:
+        rows = conn.execute(f''' SELECT p.rowid, {columns} FROM posts p
+                                 LEFT JOIN keyword_index_docs d ON d.post_id = p.post_id
+                                 WHERE p.rowid > ?
+                                   AND (d.post_id IS NULL OR p.tokens_version IS NULL OR p.tokens_version != ?)
+                                 ORDER BY p.rowid LIMIT ? ''', (last_rowid, current_version, batch_size)).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield [row[1:] for row in rows]
+
+def index_post_keywords(conn, post_ids=None, batch_size=1000):
+    """
+    Aggiorna token salvati e indice keyword solo dove serve:
+    - con post_ids: reindicizza i post indicati il cui contenuto è cambiato (o mai indicizzati);
+    - senza post_ids: indicizza i post assenti dall'indice o con token di una versione
+      obsoleta del tokenizer (backfill).
+    Restituisce il numero di post (re)indicizzati.
+    """
+    update_tokens_sql = ''' UPDATE posts SET keyword_tokens = ?, tokens_version = ? WHERE post_id = ? '''
+    indexed = 0
+    try:
+        for rows in _iter_keyword_rows(conn, post_ids, TOKENIZER_VERSION, batch_size):
+            stale_posts = [{'post_id': post_id, 'contenuto': contenuto}
+                           for post_id, contenuto, stored_hash, tokens_version in rows
+                           if tokens_version != TOKENIZER_VERSION or stored_hash != _content_hash(contenuto)]
+            if not stale_posts:
+                continue
+            keyword_docs = _compute_keyword_documents(stale_posts)
+            conn.executemany(update_tokens_sql, [(keyword_tokens, TOKENIZER_VERSION, post_id)
+                                                 for post_id, (_, keyword_tokens, _) in keyword_docs.items()])
+            _remove_keyword_documents(conn, keyword_docs.keys())
+            _add_keyword_documents(conn, keyword_docs)
+            conn.commit()
+            indexed += len(keyword_docs)
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Errore durante l'aggiornamento dell'indice keyword: {e}")
+    if indexed:
+        logger.info(f"Indice keyword aggiornato per {indexed} post.")
+    return indexed
+
+def fetch_keyword_doc_terms(conn, query_term=None, categoria=None):
+    """
+    Carica le righe sparse dell'indice keyword (post_id, term, term_count, doc_freq)
+    per i post di query_term e/o del subreddit 'categoria' (tutto il corpus se entrambi None).
+    """
+    sql = ''' SELECT t.post_id, t.term, t.term_count, f.doc_freq FROM keyword_doc_terms t
+              JOIN keyword_doc_freq f ON f.term = t.term '''
+    params = []
+    if query_term is not None:
+        sql += " JOIN post_queries q ON q.post_id = t.post_id AND q.query_term = ?"
+        params.append(query_term)
+    if categoria is not None:
+        sql += " JOIN posts p ON p.post_id = t.post_id AND p.categoria = ?"
+        params.append(categoria)
+    try:
+        return _read_sql_query(sql, conn, params=params)
+    except Exception as e:
+        logger.error(f"Errore durante il caricamento dell'indice keyword: {e}")
+        return pd.DataFrame(columns=['post_id', 'term', 'term_count', 'doc_freq'])
+
+def count_indexed_documents(conn):
+    """ Numero di documenti non vuoti nell'indice keyword (N nel calcolo dell'idf). """
+    try:
+        return conn.execute("SELECT COUNT(*) FROM keyword_index_docs WHERE term_total > 0").fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il conteggio dei documenti indicizzati: {e}")
+        return 0
+
+def _update_query_catalog(conn, query_term, new_post_ids):
+    """
+    Aggiorna in modo incrementale le statistiche di query_term nel catalogo 'queries'
+    sommando i post appena collegati. Non effettua il commit (usata dentro insert_posts_batch).
+    """
+    conn.execute(''' INSERT INTO queries(query_term, last_scraped) VALUES(?, CURRENT_TIMESTAMP)
+                     ON CONFLICT(query_term) DO UPDATE SET last_scraped = excluded.last_scraped ''',
+                 (query_term,))
+    for start in range(0, len(new_post_ids), SQLITE_MAX_VARIABLES):
+        chunk = new_post_ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        count, total, lowest, highest = conn.execute(
+            f''' SELECT COUNT(*), COALESCE(SUM(punteggio), 0), MIN(punteggio), MAX(punteggio)
+                 FROM posts WHERE post_id IN ({placeholders}) ''', chunk).fetchone()
+        if not count:
+            continue
+        conn.execute(''' UPDATE queries SET
+                             post_count = post_count + :count,
+                             score_sum = score_sum + :total,
+                             score_min = CASE WHEN score_min IS NULL OR (:lowest IS NOT NULL AND :lowest < score_min)
+                                              THEN :lowest ELSE score_min END,
+                             score_max = CASE WHEN score_max IS NULL OR (:highest IS NOT NULL AND :highest > score_max)
+                                              THEN :highest ELSE score_max END
+                         WHERE query_term = :query_term ''',
+                     {'count': count, 'total': total, 'lowest': lowest, 'highest': highest, 'query_term': query_term})
+
+def rebuild_query_catalog(conn, query_terms=None, commit=True):
+    """
+    Ricalcola da zero le statistiche del catalogo 'queries' per le query indicate
+    (o per tutte). Da usare quando cambiano i punteggi di post già salvati.
+    """
+    params = []
+    where = "WHERE 1" # Necessario per l'upsert su INSERT ... SELECT
+    if query_terms is not None:
+        query_terms = list(query_terms)
+        if not query_terms:
+            return
+        where = f"WHERE pq.query_term IN ({','.join('?' * len(query_terms))})"
+        params = query_terms
+    sql = f''' INSERT INTO queries(query_term, post_count, score_sum, score_min, score_max, last_scraped)
+               SELECT pq.query_term, COUNT(*), COALESCE(SUM(p.punteggio), 0), MIN(p.punteggio), MAX(p.punteggio),
+                      MAX(pq.linked_at)
+               FROM post_queries pq JOIN posts p ON p.post_id = pq.post_id
+               {where}
+               GROUP BY pq.query_term
+               ON CONFLICT(query_term) DO UPDATE SET
+                   post_count = excluded.post_count,
+                   score_sum = excluded.score_sum,
+                   score_min = excluded.score_min,
+                   score_max = excluded.score_max,
+                   last_scraped = COALESCE(queries.last_scraped, excluded.last_scraped) '''
+    try:
+        conn.execute(sql, params)
+        if commit:
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il ricalcolo del catalogo delle query: {e}")
+        raise
+
+def _update_subreddit_stats(conn, rollup_key, new_post_ids):
+    """
+    Somma ai rollup di 'subreddit_stats' (per rollup_key) i post indicati, raggruppati per subreddit.
+    Non effettua il commit (usata dentro insert_posts_batch).
+    """
+    for start in range(0, len(new_post_ids), SQLITE_MAX_VARIABLES):
+        chunk = new_post_ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f''' INSERT INTO subreddit_stats(query_term, categoria, post_count, scored_count, score_sum)
+                          SELECT ?, categoria, COUNT(*), COUNT(punteggio), COALESCE(SUM(punteggio), 0)
+                          FROM posts
+                          WHERE post_id IN ({placeholders}) AND categoria IS NOT NULL
+                          GROUP BY categoria
+                          ON CONFLICT(query_term, categoria) DO UPDATE SET
+                              post_count = post_count + excluded.post_count,
+                              scored_count = scored_count + excluded.scored_count,
+                              score_sum = score_sum + excluded.score_sum ''', [rollup_key] + chunk)
+
+def rebuild_subreddit_stats(conn, query_terms=None, commit=True):
+    """
+    Ricalcola da zero (con GROUP BY categoria) i rollup per subreddit delle query indicate
+    o di tutte; il rollup dell'intero corpus viene sempre ricalcolato.
+    """
+    try:
+        if query_terms is None:
+            conn.execute("DELETE FROM subreddit_stats")
+            conn.execute(''' INSERT INTO subreddit_stats(query_term, categoria, post_count, scored_count, score_sum)
+                             SELECT pq.query_term, p.categoria, COUNT(*), COUNT(p.punteggio), COALESCE(SUM(p.punteggio), 0)
+                             FROM post_queries pq JOIN posts p ON p.post_id = pq.post_id
+                             WHERE p.categoria IS NOT NULL
+                             GROUP BY pq.query_term, p.categoria ''')
+        else:
+            for query_term in query_terms:
+                conn.execute("DELETE FROM subreddit_stats WHERE query_term = ?", (query_term,))
+                conn.execute(''' INSERT INTO subreddit_stats(query_term, categoria, post_count, scored_count, score_sum)
+                                 SELECT pq.query_term, p.categoria, COUNT(*), COUNT(p.punteggio), COALESCE(SUM(p.punteggio), 0)
+                                 FROM post_queries pq JOIN posts p ON p.post_id = pq.post_id
+                                 WHERE pq.query_term = ? AND p.categoria IS NOT NULL
+                                 GROUP BY p.categoria ''', (query_term,))
+            conn.execute("DELETE FROM subreddit_stats WHERE query_term = ?", (ALL_POSTS_ROLLUP_KEY,))
+        conn.execute(''' INSERT INTO subreddit_stats(query_term, categoria, post_count, scored_count, score_sum)
+                         SELECT ?, categoria, COUNT(*), COUNT(punteggio), COALESCE(SUM(punteggio), 0)
+                         FROM posts WHERE categoria IS NOT NULL
+                         GROUP BY categoria ''', (ALL_POSTS_ROLLUP_KEY,))
+        if commit:
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il ricalcolo dei rollup per subreddit: {e}")
+        raise
+
+def rebuild_aggregates(conn, query_terms=None):
+    """
+    Ricalcola catalogo delle query e rollup per subreddit (per le query indicate o per tutte)
+    in un'unica transazione. Da usare dopo aver modificato punteggi o subreddit di post già salvati.
+    """
+    if query_terms is not None:
+        query_terms = list(query_terms)
+    try:
+        rebuild_query_catalog(conn, query_terms, commit=False)
+        rebuild_subreddit_stats(conn, query_terms, commit=False)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+
+def fetch_subreddit_distribution(conn, query_term=None):
+    """
+    Distribuzione dei post per subreddit letta dai rollup precalcolati (nessun caricamento dei post).
+    Restituisce un DataFrame con colonne ['categoria', 'count'], ordinato per count decrescente,
+    come analysis.get_subreddit_distribution().
+    """
+    rollup_key = ALL_POSTS_ROLLUP_KEY if query_term is None else query_term
+    try:
+        df = _read_sql_query(''' SELECT categoria, post_count AS count FROM subreddit_stats
+                                  WHERE query_term = ? AND post_count > 0
+                                  ORDER BY post_count DESC, categoria ''', conn, params=(rollup_key,))
         return df
-    except Exception as e: # pd.read_sql_query può sollevare varie eccezioni
-        logger.error(f"Errore durante il recupero dei post come DataFrame: {e}")
-        return pd.DataFrame() # Restituisce un DataFrame vuoto in caso di errore
+    except Exception as e:
+        logger.error(f"Errore durante la lettura della distribuzione per subreddit: {e}")
+        return pd.DataFrame(columns=['categoria', 'count'])
 
-def fetch_posts_by_query_as_df(conn, query_term):
-    """ Recupera i post per un termine di ricerca specifico. """
+def fetch_average_score_per_subreddit(conn, query_term=None):
+    """
+    Punteggio medio per subreddit letto dai rollup precalcolati.
+    Restituisce un DataFrame con colonne ['categoria', 'average_score'], ordinato per
+    punteggio medio decrescente, come analysis.get_average_score_per_subreddit().
+    """
+    rollup_key = ALL_POSTS_ROLLUP_KEY if query_term is None else query_term
     try:
-        query = "SELECT * FROM posts WHERE query_term = ?"
-        df = pd.read_sql_query(query, conn, params=(query_term,))
-        logger.info(f"Recuperati {len(df)} post per la query '{query_term}'.")
+        df = _read_sql_query(''' SELECT categoria, CAST(score_sum AS REAL) / scored_count AS average_score
+                                  FROM subreddit_stats
+                                  WHERE query_term = ? AND scored_count > 0
+                                  ORDER BY average_score DESC, categoria ''', conn, params=(rollup_key,))
         return df
     except Exception as e:
-        logger.error(f"Errore durante il recupero dei post per query '{query_term}': {e}")
+        logger.error(f"Errore durante la lettura del punteggio medio per subreddit: {e}")
+        return pd.DataFrame(columns=['categoria', 'average_score'])
+
+def fetch_query_catalog(conn):
+    """
+    Restituisce il catalogo delle query (DataFrame con query_term, post_count, score_sum,
+    score_min, score_max, last_scraped, average_score), ordinato per query_term.
+    """
+    try:
+        df = _read_sql_query(''' SELECT query_term, post_count, score_sum, score_min, score_max, last_scraped
+                                  FROM queries ORDER BY query_term ''', conn)
+        df['average_score'] = (df['score_sum'] / df['post_count']).where(df['post_count'] > 0)
+        return df
+    except Exception as e:
+        logger.error(f"Errore durante la lettura del catalogo delle query: {e}")
+        return pd.DataFrame(columns=['query_term', 'post_count', 'score_sum', 'score_min', 'score_max', 'last_scraped', 'average_score'])
+
+def fetch_related_query_terms(conn, query_term=None):
+    """
+    Restituisce le query che condividono almeno un post con query_term
+    (inclusa query_term stessa), oppure tutte le query se query_term è None.
+    """
+    try:
+        if query_term is None:
+            rows = conn.execute("SELECT query_term FROM queries").fetchall()
+        else:
+            rows = conn.execute(''' SELECT DISTINCT other.query_term
+                                     FROM post_queries own JOIN post_queries other ON other.post_id = own.post_id
+                                     WHERE own.query_term = ? ''', (query_term,)).fetchall()
+        return [row[0] for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la lettura delle query correlate a '{query_term}': {e}")
+        return []
+
+def fetch_stored_post_ids(conn, query_term=None):
+    """ Restituisce la lista dei post_id salvati (per una query specifica o per tutte). """
+    try:
+        if query_term is None:
+            rows = conn.execute("SELECT post_id FROM posts").fetchall()
+        else:
+            rows = conn.execute("SELECT post_id FROM post_queries WHERE query_term = ?", (query_term,)).fetchall()
+        return [row[0] for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la lettura dei post_id salvati: {e}")
+        return []
+
+def update_posts_metadata(conn, posts_data):
+    """
+    Aggiorna punteggio e metadati dei post esistenti con un unico executemany.
+    Vengono toccate solo le righe in cui almeno un valore è cambiato; un 'contenuto'
+    None lascia invariato il contenuto salvato.
+    Restituisce il numero di righe modificate.
+    """
+    if not posts_data:
+        return 0
+
+    sql = ''' UPDATE posts SET
+                  titolo = :titolo,
+                  contenuto = COALESCE(:contenuto, contenuto),
+                  categoria = :categoria,
+                  punteggio = :punteggio,
+                  url_post = :url_post
+              WHERE post_id = :post_id
+                AND (punteggio IS NOT :punteggio
+                     OR titolo IS NOT :titolo
+                     OR contenuto IS NOT COALESCE(:contenuto, contenuto)
+                     OR categoria IS NOT :categoria
+                     OR url_post IS NOT :url_post) '''
+    data_to_update = [{
+        'post_id': post.get('post_id'),
+        'titolo': post.get('titolo'),
+        'contenuto': post.get('contenuto'),
+        'categoria': post.get('categoria'),
+        'punteggio': post.get('punteggio'),
+        'url_post': post.get('url_post')
+    } for post in posts_data]
+
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(sql, data_to_update)
+        conn.commit()
+        updated_rows = cursor.rowcount
+        logger.info(f"Aggiornati {updated_rows} post su {len(posts_data)} ricevuti.")
+        return updated_rows
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante l'aggiornamento dei metadati dei post: {e}")
+        return 0
+
+def fetch_existing_post_ids(conn, post_ids, query_term=None):
+    """
+    Restituisce l'insieme dei post_id (tra quelli indicati) già presenti nella tabella posts
+    o, se query_term è indicato, già collegati a quella query.
+    Usa una sola query su una chiave primaria, quindi è una lookup indicizzata.
+    """
+    post_ids = list(post_ids)
+    if query_term is None:
+        sql, prefix = "SELECT post_id FROM posts WHERE post_id IN ({})", []
+    else:
+        sql, prefix = "SELECT post_id FROM post_queries WHERE query_term = ? AND post_id IN ({})", [query_term]
+    existing = set()
+    try:
+        # A blocchi per restare sotto il limite di variabili di SQLite
+        for start in range(0, len(post_ids), SQLITE_MAX_VARIABLES):
+            chunk = post_ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(sql.format(placeholders), prefix + chunk).fetchall()
+            existing.update(row[0] for row in rows)
+        return existing
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la verifica dei post già presenti: {e}")
+        return set()
+
+def get_scrape_cursor(conn, query_term, listing):
+    """
+    Restituisce (after_fullname, posts_fetched) dell'ultimo recupero interrotto
+    per (query_term, listing), oppure None se non c'è nulla da riprendere.
+    """
+    try:
+        row = conn.execute(
+            "SELECT after_fullname, posts_fetched FROM scrape_cursors WHERE query_term = ? AND listing = ?",
+            (query_term, listing)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la lettura del cursore per '{query_term}': {e}")
+        return None
+
+def save_scrape_cursor(conn, query_term, listing, after_fullname, posts_fetched):
+    """ Salva (e committa) il cursore di paginazione per (query_term, listing). """
+    sql = ''' INSERT INTO scrape_cursors(query_term, listing, after_fullname, posts_fetched, updated_at)
+              VALUES(?,?,?,?,CURRENT_TIMESTAMP)
+              ON CONFLICT(query_term, listing) DO UPDATE SET
+                  after_fullname = excluded.after_fullname,
+                  posts_fetched = excluded.posts_fetched,
+                  updated_at = excluded.updated_at '''
+    try:
+        conn.execute(sql, (query_term, listing, after_fullname, posts_fetched))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il salvataggio del cursore per '{query_term}': {e}")
+
+def delete_scrape_cursor(conn, query_term, listing):
+    """ Elimina il cursore di (query_term, listing) a recupero completato. """
+    try:
+        conn.execute("DELETE FROM scrape_cursors WHERE query_term = ? AND listing = ?", (query_term, listing))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante l'eliminazione del cursore per '{query_term}': {e}")
+
+def add_tracked_query(conn, query_term, num_posts, interval_seconds):
+    """
+    Aggiunge (o aggiorna) una query monitorata dallo scheduler di refresh (scheduler.py),
+    con il numero massimo di post da esaminare e l'intervallo tra due aggiornamenti.
+    Il primo aggiornamento è dovuto subito. Restituisce True se la query è stata salvata.
+    """
+    if int(num_posts) <= 0 or int(interval_seconds) <= 0:
+        raise ValueError(f"num_posts e interval_seconds devono essere positivi (ricevuti {num_posts}, {interval_seconds}).")
+    sql = ''' INSERT INTO tracked_queries(query_term, num_posts, interval_seconds, enabled, next_run_at)
+              VALUES(?,?,?,1,CURRENT_TIMESTAMP)
+              ON CONFLICT(query_term) DO UPDATE SET
+                  num_posts = excluded.num_posts,
+                  interval_seconds = excluded.interval_seconds,
+                  enabled = 1,
+                  next_run_at = excluded.next_run_at '''
+    try:
+        with conn:
+            conn.execute(sql, (query_term, int(num_posts), int(interval_seconds)))
+        logger.info(f"Query monitorata: '{query_term}' ({num_posts} post ogni {interval_seconds} s).")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il salvataggio della query monitorata '{query_term}': {e}")
+        return False
+
+def remove_tracked_query(conn, query_term):
+    """ Smette di monitorare una query (lo storico delle esecuzioni resta in scheduler_runs). """
+    try:
+        with conn:
+            removed = conn.execute("DELETE FROM tracked_queries WHERE query_term = ?", (query_term,)).rowcount
+        return removed > 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la rimozione della query monitorata '{query_term}': {e}")
+        return False
+
+def schedule_tracked_query_now(conn, query_term):
+    """ Rende subito dovuto l'aggiornamento di una query monitorata. """
+    try:
+        with conn:
+            updated = conn.execute("UPDATE tracked_queries SET next_run_at = CURRENT_TIMESTAMP WHERE query_term = ?",
+                                   (query_term,)).rowcount
+        return updated > 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la pianificazione della query '{query_term}': {e}")
+        return False
+
+def fetch_tracked_queries(conn, enabled_only=False):
+    """
+    Query monitorate con la prossima esecuzione prevista e l'esito dell'ultima esecuzione
+    (DataFrame ordinato per next_run_at; i tempi sono in UTC come CURRENT_TIMESTAMP).
+    """
+    sql = ''' SELECT t.query_term, t.num_posts, t.interval_seconds, t.enabled, t.next_run_at,
+                     r.finished_at AS last_finished_at, r.status AS last_status,
+                     r.new_posts AS last_new_posts, r.error AS last_error
+              FROM tracked_queries t
+              LEFT JOIN scheduler_runs r
+                     ON r.run_id = (SELECT MAX(run_id) FROM scheduler_runs WHERE query_term = t.query_term) '''
+    if enabled_only:
+        sql += " WHERE t.enabled = 1"
+    sql += " ORDER BY t.next_run_at, t.query_term"
+    try:
+        return _read_sql_query(sql, conn)
+    except Exception as e:
+        logger.error(f"Errore durante la lettura delle query monitorate: {e}")
+        return pd.DataFrame(columns=['query_term', 'num_posts', 'interval_seconds', 'enabled', 'next_run_at',
+                                     'last_finished_at', 'last_status', 'last_new_posts', 'last_error'])
+
+def claim_tracked_query_run(conn, query_term, now, next_run_at):
+    """
+    Prenota l'esecuzione di una query dovuta: sposta atomicamente next_run_at in avanti solo se
+    l'aggiornamento è ancora dovuto a 'now'. Se più scheduler (processi) condividono il DB,
+    solo uno ottiene True per la stessa scadenza. I tempi sono stringhe 'YYYY-MM-DD HH:MM:SS' UTC.
+    """
+    try:
+        with conn:
+            claimed = conn.execute(''' UPDATE tracked_queries SET next_run_at = ?
+                                       WHERE query_term = ? AND enabled = 1 AND next_run_at <= ? ''',
+                                   (next_run_at, query_term, now)).rowcount
+        return claimed > 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la prenotazione dell'aggiornamento di '{query_term}': {e}")
+        return False
+
+def fetch_tracked_query_next_run(conn, query_term):
+    """ next_run_at (UTC, come CURRENT_TIMESTAMP) di una query monitorata attiva; None se assente, disattivata o in caso di errore. """
+    try:
+        row = conn.execute("SELECT next_run_at FROM tracked_queries WHERE query_term = ? AND enabled = 1",
+                           (query_term,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la lettura della prossima esecuzione di '{query_term}': {e}")
+        return None
+
+def record_scheduler_run(conn, query_term, started_at, finished_at, status, fetched=0, new_posts=0, error=None):
+    """ Registra l'esito di un aggiornamento eseguito dallo scheduler. Restituisce il run_id (None in caso di errore). """
+    sql = ''' INSERT INTO scheduler_runs(query_term, started_at, finished_at, status, fetched, new_posts, error)
+              VALUES(?,?,?,?,?,?,?) '''
+    try:
+        with conn:
+            return conn.execute(sql, (query_term, started_at, finished_at, status, fetched, new_posts, error)).lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la registrazione dell'esecuzione per '{query_term}': {e}")
+        return None
+
+def fetch_scheduler_runs(conn, query_term=None, limit=20):
+    """ Ultime esecuzioni dello scheduler (tutte o di una query), dalla più recente. """
+    sql = "SELECT run_id, query_term, started_at, finished_at, status, fetched, new_posts, error FROM scheduler_runs"
+    params = []
+    if query_term is not None:
+        sql += " WHERE query_term = ?"
+        params.append(query_term)
+    sql += " ORDER BY run_id DESC LIMIT ?"
+    params.append(int(limit))
+    try:
+        return _read_sql_query(sql, conn, params=params)
+    except Exception as e:
+        logger.error(f"Errore durante la lettura delle esecuzioni dello scheduler: {e}")
+        return pd.DataFrame(columns=['run_id', 'query_term', 'started_at', 'finished_at', 'status', 'fetched', 'new_posts', 'error'])
+
+def enqueue_job(conn, query_term, num_posts, max_attempts=DEFAULT_JOB_MAX_ATTEMPTS):
+    """
+    Accoda un job di recupero per query_term (coda 'jobs' condivisa dai worker, vedi worker.py).
+    Per ogni query può esistere un solo job in coda o in esecuzione: se c'è già, non ne viene
+    creato un altro. Restituisce il job_id (nuovo o già attivo), oppure None in caso di errore.
+    """
+    if int(num_posts) <= 0 or int(max_attempts) <= 0:
+        raise ValueError(f"num_posts e max_attempts devono essere positivi (ricevuti {num_posts}, {max_attempts}).")
+    try:
+        with conn:
+            cursor = conn.execute(''' INSERT INTO jobs(query_term, num_posts, max_attempts, available_at)
+                                      VALUES(?,?,?,?) ON CONFLICT DO NOTHING ''',
+                                  (query_term, int(num_posts), int(max_attempts), time.time()))
+            if cursor.rowcount:
+                logger.info(f"Job {cursor.lastrowid} accodato per '{query_term}' ({num_posts} post).")
+                return cursor.lastrowid
+            row = conn.execute("SELECT job_id FROM jobs WHERE query_term = ? AND status IN ('queued', 'running')",
+                               (query_term,)).fetchone()
+        logger.info(f"Job per '{query_term}' già in coda o in esecuzione (job {row[0] if row else '?'}).")
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante l'accodamento del job per '{query_term}': {e}")
+        return None
+
+def _requeue_expired_jobs(conn, now):
+    """ Rimette in coda (o segna come falliti, a tentativi esauriti) i job con lease scaduto. Da chiamare in una transazione. """
+    return conn.execute(''' UPDATE jobs
+                            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                                lease_owner = NULL, lease_expires_at = NULL, available_at = ?,
+                                last_error = 'Lease scaduto (worker terminato o bloccato).',
+                                finished_at = CASE WHEN attempts >= max_attempts THEN CURRENT_TIMESTAMP END
+                            WHERE status = 'running' AND lease_expires_at < ? ''', (now, now)).rowcount
+
+def requeue_expired_jobs(conn, now=None):
+    """ Recupera i job dei worker che non rinnovano più il lease. Restituisce il numero di job rimessi in coda o falliti. """
+    now = time.time() if now is None else now
+    try:
+        with conn:
+            requeued = _requeue_expired_jobs(conn, now)
+        if requeued:
+            logger.warning(f"{requeued} job con lease scaduto rimessi in coda (o falliti).")
+        return requeued
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il recupero dei job con lease scaduto: {e}")
+        return 0
+
+def claim_job(conn, worker_id, lease_seconds, now=None):
+    """
+    Prende in carico atomicamente il job in coda più vecchio tra quelli disponibili: in una
+    transazione IMMEDIATE (un solo scrittore alla volta) recupera i lease scaduti, sceglie il job
+    e lo assegna a worker_id con un lease di lease_seconds. Due worker non ottengono mai lo stesso job.
+    Restituisce un dizionario (job_id, query_term, num_posts, attempts, max_attempts) oppure None.
+    """
+    now = time.time() if now is None else now
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _requeue_expired_jobs(conn, now)
+            row = conn.execute(''' SELECT job_id, query_term, num_posts, attempts, max_attempts FROM jobs
+                                   WHERE status = 'queued' AND available_at <= ?
+                                   ORDER BY available_at, job_id LIMIT 1 ''', (now,)).fetchone()
+            if row is not None:
+                conn.execute(''' UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires_at = ?,
+                                                 attempts = attempts + 1, started_at = CURRENT_TIMESTAMP
+                                 WHERE job_id = ? ''', (worker_id, now + lease_seconds, row[0]))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la presa in carico di un job ({worker_id}): {e}")
+        return None
+    if row is None:
+        return None
+    return {'job_id': row[0], 'query_term': row[1], 'num_posts': row[2], 'attempts': row[3] + 1, 'max_attempts': row[4]}
+
+def heartbeat_job(conn, job_id, worker_id, lease_seconds, now=None):
+    """
+    Rinnova il lease di un job in esecuzione. False se il lease non appartiene più a worker_id,
+    None in caso di errore del database (es. lock temporaneo): il chiamante può ritentare.
+    """
+    now = time.time() if now is None else now
+    try:
+        with conn:
+            renewed = conn.execute(''' UPDATE jobs SET lease_expires_at = ?
+                                       WHERE job_id = ? AND lease_owner = ? AND status = 'running' ''',
+                                   (now + lease_seconds, job_id, worker_id)).rowcount
+        return renewed > 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il rinnovo del lease del job {job_id}: {e}")
+        return None
+
+def complete_job(conn, job_id, worker_id, inserted):
+    """ Segna come completato un job di worker_id. False se il lease era già stato perso. """
+    try:
+        with conn:
+            completed = conn.execute(''' UPDATE jobs SET status = 'done', inserted = ?, last_error = NULL,
+                                                         lease_owner = NULL, lease_expires_at = NULL,
+                                                         finished_at = CURRENT_TIMESTAMP
+                                         WHERE job_id = ? AND lease_owner = ? AND status = 'running' ''',
+                                     (inserted, job_id, worker_id)).rowcount
+        return completed > 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il completamento del job {job_id}: {e}")
+        return False
+
+def fail_job(conn, job_id, worker_id, error, retry_delay_seconds=0, now=None):
+    """
+    Registra il fallimento di un job di worker_id: torna in coda dopo retry_delay_seconds se
+    restano tentativi, altrimenti diventa 'failed'. Restituisce il nuovo stato, oppure None se
+    il lease era già stato perso.
+    """
+    now = time.time() if now is None else now
+    try:
+        with conn:
+            updated = conn.execute(''' UPDATE jobs
+                                       SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                                           last_error = ?, available_at = ?, lease_owner = NULL, lease_expires_at = NULL,
+                                           finished_at = CASE WHEN attempts >= max_attempts THEN CURRENT_TIMESTAMP END
+                                       WHERE job_id = ? AND lease_owner = ? AND status = 'running' ''',
+                                   (error, now + retry_delay_seconds, job_id, worker_id)).rowcount
+            if not updated:
+                return None
+            return conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la registrazione del fallimento del job {job_id}: {e}")
+        return None
+
+def release_job(conn, job_id, worker_id, now=None):
+    """
+    Rimette subito in coda un job di worker_id interrotto dall'arresto del worker, senza contare
+    il tentativo (l'arresto non è un errore del job). False se il lease era già stato perso.
+    """
+    now = time.time() if now is None else now
+    try:
+        with conn:
+            released = conn.execute(''' UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0),
+                                                        available_at = ?, lease_owner = NULL, lease_expires_at = NULL
+                                        WHERE job_id = ? AND lease_owner = ? AND status = 'running' ''',
+                                    (now, job_id, worker_id)).rowcount
+        if released:
+            logger.info(f"Job {job_id} rimesso in coda dall'arresto del worker {worker_id}.")
+        return released > 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il rilascio del job {job_id}: {e}")
+        return False
+
+def fetch_jobs(conn, status=None, limit=100):
+    """ Job della coda (tutti o con lo stato indicato), dal più recente. """
+    sql = ''' SELECT job_id, query_term, num_posts, status, attempts, max_attempts, lease_owner,
+                     created_at, started_at, finished_at, inserted, last_error FROM jobs '''
+    params = []
+    if status is not None:
+        sql += " WHERE status = ?"
+        params.append(status)
+    sql += " ORDER BY job_id DESC LIMIT ?"
+    params.append(int(limit))
+    try:
+        return _read_sql_query(sql, conn, params=params)
+    except Exception as e:
+        logger.error(f"Errore durante la lettura dei job: {e}")
+        return pd.DataFrame(columns=['job_id', 'query_term', 'num_posts', 'status', 'attempts', 'max_attempts', 'lease_owner',
+                                     'created_at', 'started_at', 'finished_at', 'inserted', 'last_error'])
+
+def count_jobs_by_status(conn):
+    """ Numero di job per stato: {'queued': n, 'running': n, 'done': n, 'failed': n}. """
+    counts = dict.fromkeys(JOB_STATUSES, 0)
+    try:
+        counts.update(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il conteggio dei job: {e}")
+    return counts
+
+def _create_data_version_tracking(conn):
+    """
+    Contatore persistente delle modifiche ai dati ('data_version' in db_meta), incrementato da
+    trigger a ogni inserimento, modifica o cancellazione in 'posts' e 'post_queries'.
+    Gli snapshot colonnari (snapshots.py) lo usano per capire se sono ancora allineati al DB,
+    insieme a 'db_id': identificativo casuale assegnato alla creazione, che distingue un DB
+    cancellato e ricreato (il cui contatore riparte da 0) da quello originale.
+    """
+    with conn:
+        conn.execute(''' CREATE TABLE IF NOT EXISTS db_meta (
+                             key TEXT PRIMARY KEY,
+                             value INTEGER NOT NULL DEFAULT 0
+                         ) ''')
+        conn.execute("INSERT OR IGNORE INTO db_meta(key, value) VALUES ('data_version', 0)")
+        conn.execute("INSERT OR IGNORE INTO db_meta(key, value) VALUES ('db_id', ?)", (secrets.randbits(63),))
+        for table, event in (('posts', 'INSERT'), ('posts', 'UPDATE'), ('posts', 'DELETE'),
+                             ('post_queries', 'INSERT'), ('post_queries', 'DELETE')):
+            conn.execute(f''' CREATE TRIGGER IF NOT EXISTS {table}_data_version_after_{event.lower()} AFTER {event} ON {table} BEGIN
+                                  UPDATE db_meta SET value = value + 1 WHERE key = 'data_version';
+                              END ''')
+
+def get_data_version(conn):
+    """ Versione corrente dei dati (cambia a ogni modifica di post o collegamenti post-query). """
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'data_version'").fetchone()
+        return row[0] if row else 0
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la lettura della versione dei dati: {e}")
+        return None
+
+def get_db_id(conn):
+    """ Identificativo casuale del DB, assegnato alla creazione (vedi _create_data_version_tracking()), oppure None. """
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'db_id'").fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la lettura dell'identificativo del DB: {e}")
+        return None
+
+def _create_fulltext_index(conn):
+    """
+    Crea l'indice full-text FTS5 'posts_fts' su titolo/contenuto (tabella a contenuto esterno:
+    il testo resta solo in 'posts') e i trigger che lo mantengono allineato.
+    Alla prima creazione indicizza i post già presenti. Restituisce False se FTS5 non è disponibile.
+    """
+    fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'").fetchone()
+    try:
+        with conn:
+            conn.execute(''' CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                                 titolo, contenuto,
+                                 content = 'posts', content_rowid = 'rowid',
+                                 tokenize = 'unicode61 remove_diacritics 2'
+                             ) ''')
+            conn.execute(''' CREATE TRIGGER IF NOT EXISTS posts_fts_after_insert AFTER INSERT ON posts BEGIN
+                                 INSERT INTO posts_fts(rowid, titolo, contenuto) VALUES (new.rowid, new.titolo, new.contenuto);
+                             END ''')
+            conn.execute(''' CREATE TRIGGER IF NOT EXISTS posts_fts_after_delete AFTER DELETE ON posts BEGIN
+                                 INSERT INTO posts_fts(posts_fts, rowid, titolo, contenuto)
+                                 VALUES ('delete', old.rowid, old.titolo, old.contenuto);
+                             END ''')
+            conn.execute(''' CREATE TRIGGER IF NOT EXISTS posts_fts_after_update AFTER UPDATE OF titolo, contenuto ON posts BEGIN
+                                 INSERT INTO posts_fts(posts_fts, rowid, titolo, contenuto)
+                                 VALUES ('delete', old.rowid, old.titolo, old.contenuto);
+                                 INSERT INTO posts_fts(rowid, titolo, contenuto) VALUES (new.rowid, new.titolo, new.contenuto);
+                             END ''')
+            if not fts_exists:
+                conn.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+        return True
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Indice full-text FTS5 non disponibile, ricerca testuale disattivata: {e}")
+        return False
+
+def rebuild_fulltext_index(conn):
+    """
+    Ricostruisce da zero l'indice full-text a partire da 'posts'.
+    Necessario dopo un VACUUM: 'posts' non ha una chiave INTEGER PRIMARY KEY, quindi
+    i rowid (usati per collegare l'indice ai post) possono cambiare. vacuum_database() lo
+    chiama automaticamente; dopo un VACUUM eseguito in altro modo (es. dalla shell sqlite3)
+    va lanciato con: python database.py --rebuild-fts
+    """
+    try:
+        with conn:
+            conn.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+        logger.info("Indice full-text ricostruito.")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante la ricostruzione dell'indice full-text: {e}")
+        return False
+
+def vacuum_database(conn):
+    """
+    Compatta il database (VACUUM) e ricostruisce subito l'indice full-text, i cui collegamenti
+    ai post (rowid) possono essere cambiati. Restituisce True se entrambe le operazioni riescono.
+    """
+    try:
+        conn.execute("VACUUM")
+        logger.info("VACUUM del database completato.")
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il VACUUM del database: {e}")
+        return False
+    return rebuild_fulltext_index(conn)
+
+def quote_fts_query(text):
+    """
+    Converte testo libero in una query FTS5 sicura: ogni parola diventa una frase tra
+    virgolette (tutte richieste, in AND), così caratteri come '-', '+', ':' o '*'
+    non vengono interpretati come operatori.
+    """
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in str(text).split())
+
+def search_posts(conn, fts_query, limit=50, offset=0, query_term=None):
+    """
+    Ricerca full-text nei post salvati (titolo e contenuto) ordinata per rilevanza BM25.
+    Args:
+        conn: Connessione SQLite.
+        fts_query (str): Query in sintassi FTS5 (es. 'python AND "machine learning"', 'svilupp*').
+            Per testo libero digitato dall'utente usare quote_fts_query().
+        limit (int): Numero massimo di risultati.
+        offset (int): Risultati da saltare (paginazione).
+        query_term (str, optional): Limita la ricerca ai post collegati a questa query.
+    Returns:
+        pd.DataFrame: I post trovati (solo le righe corrispondenti) con la colonna 'rank'
+        (punteggio BM25: più basso = più rilevante); vuoto se la query non è valida.
+    """
+    sql = f''' SELECT p.post_id, p.query_term, p.titolo, p.contenuto, p.categoria, p.punteggio, p.url_post,
+                      p.timestamp_retrieval, p.sentiment_score, p.sentiment_label,
+                      bm25(posts_fts, {FTS_BM25_WEIGHTS[0]}, {FTS_BM25_WEIGHTS[1]}) AS rank
+               FROM posts_fts JOIN posts p ON p.rowid = posts_fts.rowid
+               WHERE posts_fts MATCH ? '''
+    params = [fts_query]
+    if query_term is not None:
+        sql += " AND EXISTS (SELECT 1 FROM post_queries pq WHERE pq.post_id = p.post_id AND pq.query_term = ?)"
+        params.append(query_term)
+    sql += " ORDER BY rank LIMIT ? OFFSET ?"
+    params.extend([int(limit), int(offset)])
+    try:
+        df = _read_sql_query(sql, conn, params=params)
+        logger.info(f"Ricerca full-text '{fts_query}': {len(df)} risultati (offset {offset}).")
+        return df
+    except Exception as e: # Sintassi FTS5 non valida o indice assente
+        logger.error(f"Errore durante la ricerca full-text '{fts_query}': {e}")
         return pd.DataFrame()
 
+def count_search_results(conn, fts_query, query_term=None):
+    """ Numero totale di post che soddisfano la query FTS5 (per la paginazione di search_posts). """
+    sql = "SELECT COUNT(*) FROM posts_fts JOIN posts p ON p.rowid = posts_fts.rowid WHERE posts_fts MATCH ?"
+    params = [fts_query]
+    if query_term is not None:
+        sql += " AND EXISTS (SELECT 1 FROM post_queries pq WHERE pq.post_id = p.post_id AND pq.query_term = ?)"
+        params.append(query_term)
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il conteggio dei risultati della ricerca '{fts_query}': {e}")
+        return 0
+
+def fetch_posts_page(conn, query_term=None, after=None, page_size=50, sort_by='timestamp_retrieval',
+                     descending=True, preview_chars=PREVIEW_CHARS):
+    """
+    Una pagina di post con paginazione keyset su (sort_by, post_id): ogni pagina legge solo le
+    proprie righe tramite l'indice, senza OFFSET, e del contenuto solo un'anteprima troncata.
+    Args:
+        conn: Connessione SQLite.
+        query_term (str, optional): Solo i post collegati a questa query (tutti se None).
+        after (tuple, optional): Cursore (valore di sort_by, post_id) dell'ultima riga della pagina
+            precedente, come restituito da questa funzione. None = prima pagina.
+        page_size (int): Righe per pagina.
+        sort_by (str): Colonna di ordinamento, una di PAGE_SORT_COLUMNS. I post con valore NULL sono esclusi.
+        descending (bool): Ordinamento decrescente (default: i più recenti prima).
+        preview_chars (int): Caratteri del contenuto inclusi nell'anteprima.
+    Returns:
+        tuple: (DataFrame della pagina, cursore della pagina successiva oppure None se è l'ultima).
+    """
+    if sort_by not in PAGE_SORT_COLUMNS:
+        raise ValueError(f"Ordinamento non supportato: '{sort_by}'. Valori ammessi: {', '.join(PAGE_SORT_COLUMNS)}")
+    direction, comparison = ("DESC", "<") if descending else ("ASC", ">")
+    sql = f''' SELECT p.post_id, p.titolo, p.categoria, p.punteggio, p.timestamp_retrieval,
+                      substr(p.contenuto, 1, ?) AS anteprima, length(p.contenuto) > ? AS troncato
+               FROM posts p
+               WHERE p.{sort_by} IS NOT NULL '''
+    params = [preview_chars, preview_chars]
+    if query_term is not None:
+        sql += " AND EXISTS (SELECT 1 FROM post_queries pq WHERE pq.query_term = ? AND pq.post_id = p.post_id)"
+        params.append(query_term)
+    if after is not None:
+        sql += f" AND (p.{sort_by}, p.post_id) {comparison} (?, ?)"
+        params.extend(after)
+    sql += f" ORDER BY p.{sort_by} {direction}, p.post_id {direction} LIMIT ?"
+    params.append(int(page_size) + 1) # Una riga in più per sapere se esiste una pagina successiva
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il caricamento della pagina di post: {e}")
+        return pd.DataFrame(columns=PAGE_COLUMNS), None
+
+    has_next_page = len(rows) > page_size
+    rows = rows[:page_size]
+    page = pd.DataFrame(rows, columns=PAGE_COLUMNS + ('troncato',))
+    page['anteprima'] = page['anteprima'].fillna("") + page['troncato'].map({1: "…"}).fillna("")
+    page = page.drop(columns='troncato')
+    next_cursor = None
+    if has_next_page:
+        last_row = rows[-1]
+        next_cursor = (last_row[PAGE_COLUMNS.index(sort_by)], last_row[0])
+    return page, next_cursor
+
+def fetch_post_content(conn, post_id):
+    """ Titolo, contenuto completo e URL di un singolo post (None se non esiste). """
+    try:
+        row = conn.execute("SELECT titolo, contenuto, url_post FROM posts WHERE post_id = ?", (post_id,)).fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Errore durante il caricamento del post {post_id}: {e}")
+        return None
+    if row is None:
+        return None
+    return {'titolo': row[0], 'contenuto': row[1] or "", 'url_post': row[2]}
+
+def compact_post_dtypes(df):
+    """
+    Converte le colonne dei post in tipi compatti: categoriche per i valori molto ripetuti
+    (query_term, categoria, etichette e versioni), int32 per i punteggi, float32 per il
+    sentiment e datetime per timestamp_retrieval. Modifica e restituisce df.
+    """
+    for column in df.columns.intersection(CATEGORICAL_POST_COLUMNS):
+        df[column] = df[column].astype('category')
+    if 'punteggio' in df.columns:
+        scores = pd.to_numeric(df['punteggio'], errors='coerce')
+        df['punteggio'] = scores.astype('Int32' if scores.isna().any() else 'int32')
+    if 'sentiment_score' in df.columns:
+        df['sentiment_score'] = pd.to_numeric(df['sentiment_score'], errors='coerce').astype('float32')
+    if 'timestamp_retrieval' in df.columns:
+        df['timestamp_retrieval'] = pd.to_datetime(df['timestamp_retrieval'], format='ISO8601', errors='coerce')
+    return df
+
+def dataframe_memory_usage(df):
+    """
+    Memoria occupata da un DataFrame, colonna per colonna (in byte, contando il contenuto
+    delle stringhe). Restituisce una Series ordinata per occupazione con la voce 'totale'.
+    """
+    usage = df.memory_usage(deep=True, index=True).sort_values(ascending=False)
+    usage['totale'] = usage.sum()
+    return usage
+
+def _post_columns_sql(columns, query_term):
+    """ Espressioni SELECT per le colonne richieste (query_term dal collegamento se si filtra per query). """
+    expressions = []
+    for column in columns:
+        if column not in POST_COLUMNS:
+            raise ValueError(f"Colonna sconosciuta per i post: '{column}'. Colonne disponibili: {', '.join(POST_COLUMNS)}")
+        expressions.append("pq.query_term" if column == 'query_term' and query_term is not None else f"p.{column}")
+    return ", ".join(expressions)
+
+def load_posts_df(conn, columns=None, query_term=None, chunksize=None, compact_dtypes=True):
+    """
+    Carica dal DB solo le colonne richieste dei post, con tipi compatti.
+    Args:
+        conn: Connessione SQLite.
+        columns (list[str], optional): Colonne da caricare (sottoinsieme di POST_COLUMNS).
+            Default: tutte. Escludere 'contenuto' quando non serve riduce molto la memoria.
+        query_term (str, optional): Solo i post collegati a questa query (tutti se None).
+        chunksize (int, optional): Se indicato restituisce un generatore di DataFrame da
+            'chunksize' righe ciascuno, per elaborare il corpus in streaming. Le categorie
+            sono calcolate per blocco.
+        compact_dtypes (bool): Applica compact_post_dtypes() al risultato.
+    Returns:
+        pd.DataFrame (o generatore di DataFrame con chunksize). In caso di errore un DataFrame vuoto.
+    """
+    columns = list(columns) if columns is not None else list(POST_COLUMNS)
+    sql = f"SELECT {_post_columns_sql(columns, query_term)} FROM posts p"
+    params = ()
+    if query_term is not None:
+        sql += " JOIN post_queries pq ON pq.post_id = p.post_id WHERE pq.query_term = ?"
+        params = (query_term,)
+
+    if chunksize is not None:
+        return _iter_post_chunks(conn, sql, params, columns, chunksize, compact_dtypes)
+    try:
+        df = _read_sql_query(sql, conn, params=params)
+    except Exception as e:
+        logger.error(f"Errore durante il caricamento dei post ({', '.join(columns)}): {e}")
+        return pd.DataFrame(columns=columns)
+    if compact_dtypes:
+        compact_post_dtypes(df)
+    logger.info(f"Caricati {len(df)} post ({len(columns)} colonne, query '{query_term}'): "
+                f"{dataframe_memory_usage(df)['totale'] / 1024 ** 2:.1f} MB in memoria.")
+    return df
+
+def _iter_post_chunks(conn, sql, params, columns, chunksize, compact_dtypes):
+    """ Generatore di blocchi di post per load_posts_df(chunksize=...). """
+    try:
+        for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=chunksize):
+            yield compact_post_dtypes(chunk) if compact_dtypes else chunk
+    except Exception as e:
+        logger.error(f"Errore durante il caricamento a blocchi dei post ({', '.join(columns)}): {e}")
+
+def fetch_all_posts_as_df(conn):
+    """ Recupera tutti i post dal database e li restituisce come DataFrame pandas. """
+    return load_posts_df(conn, compact_dtypes=False)
+
+def fetch_posts_by_query_as_df(conn, query_term):
+    """ Recupera i post per un termine di ricerca specifico. """
+    return load_posts_df(conn, query_term=query_term, compact_dtypes=False)
+
+def _export_format_from_path(path):
+    """ Formato e compressione dedotti dal nome del file (es. 'post.ndjson.gz' -> ('ndjson', True)). """
+    compress = path.endswith('.gz')
+    base = path[:-3] if compress else path
+    return ('ndjson' if base.endswith(('.ndjson', '.jsonl')) else 'csv'), compress
+
+def _iter_export_batches(cursor, fmt, columns, fetch_size):
+    """ Generatore di (numero di righe, testo) per ogni blocco letto con fetchmany dal cursore. """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    try:
+        if fmt == 'csv':
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+                text = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                text = "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            yield len(rows), text
+        if fmt == 'csv' and buffer.tell(): # Solo l'intestazione (nessun post)
+            yield 0, buffer.getvalue()
+    finally:
+        cursor.close()
+
+def _encode_export_batches(batches, compress):
+    """ Codifica in UTF-8 (e comprime in gzip se richiesto) il testo di _iter_export_batches(). """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None # 16+: formato gzip
+    for _, text in batches:
+        data = text.encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+def _open_export_cursor(conn, fmt, query_term, columns):
+    """ Valida formato e colonne ed esegue la SELECT dell'esportazione (ordinata per post_id). """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato di esportazione non supportato: '{fmt}'. Valori ammessi: {', '.join(EXPORT_FORMATS)}")
+    columns = list(columns) if columns is not None else list(EXPORT_COLUMNS)
+    sql = f"SELECT {_post_columns_sql(columns, query_term)} FROM posts p"
+    params = ()
+    if query_term is not None:
+        sql += " JOIN post_queries pq ON pq.post_id = p.post_id WHERE pq.query_term = ?"
+        params = (query_term,)
+    sql += " ORDER BY p.post_id"
+    return conn.execute(sql, params), columns
+
+def iter_posts_export(conn, fmt='csv', query_term=None, columns=None, compress=False, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Esporta i post in streaming: generatore di blocchi di byte CSV o NDJSON (un oggetto JSON
+    per riga), opzionalmente compressi in gzip. Il cursore è letto con fetchmany a blocchi di
+    'fetch_size' righe, quindi la memoria usata non dipende dal numero di post.
+    Args:
+        conn: Connessione SQLite.
+        fmt (str): 'csv' (con intestazione) o 'ndjson'.
+        query_term (str, optional): Solo i post collegati a questa query (tutti se None).
+        columns (list[str], optional): Colonne da esportare (default: EXPORT_COLUMNS).
+        compress (bool): Comprime l'output in formato gzip.
+        fetch_size (int): Righe lette dal DB per ogni blocco.
+    Returns:
+        generator[bytes]. Formato o colonne non validi sollevano ValueError subito;
+        gli errori SQLite durante la lettura sono propagati dal generatore.
+    """
+    cursor, columns = _open_export_cursor(conn, fmt, query_term, columns)
+    return _encode_export_batches(_iter_export_batches(cursor, fmt, columns, fetch_size), compress)
+
+class _ChunkStream(io.RawIOBase):
+    """
+    File binario in sola lettura sopra un generatore di blocchi di byte. Non è riposizionabile:
+    seek() accetta solo la posizione corrente (st.download_button esegue seek(0) prima di leggere).
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (whence, offset) not in ((io.SEEK_SET, self._position), (io.SEEK_CUR, 0)):
+            raise io.UnsupportedOperation("L'esportazione in streaming non è riposizionabile.")
+        return self._position
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        self._position += size
+        return size
+
+    def close(self):
+        self._chunks.close()
+        super().close()
+
+def open_posts_export(conn, fmt='csv', query_term=None, columns=None, compress=False, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Come iter_posts_export(), ma restituisce un file binario leggibile (es. per
+    st.download_button o shutil.copyfileobj) che produce l'esportazione man mano che viene letto.
+    """
+    return _ChunkStream(iter_posts_export(conn, fmt, query_term, columns, compress, fetch_size))
+
+def export_posts(conn, output, fmt=None, query_term=None, columns=None, compress=None, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Scrive l'esportazione dei post su file (o su stdout con output='-') in memoria costante.
+    Formato e compressione, se non indicati, sono dedotti dal nome del file
+    ('.csv', '.ndjson'/'.jsonl', con '.gz' per gzip). Il file viene sostituito solo a
+    esportazione completata.
+    Returns:
+        int | None: Numero di post esportati, oppure None in caso di errore.
+    """
+    inferred_fmt, inferred_compress = _export_format_from_path(output)
+    fmt = fmt or inferred_fmt
+    compress = inferred_compress if compress is None else compress
+    cursor, columns = _open_export_cursor(conn, fmt, query_term, columns)
+    exported_count = 0
+
+    def counted_batches():
+        nonlocal exported_count
+        for row_count, text in _iter_export_batches(cursor, fmt, columns, fetch_size):
+            exported_count += row_count
+            yield row_count, text
+
+    tmp_path = None
+    try:
+        if output == '-':
+            for chunk in _encode_export_batches(counted_batches(), compress):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            output_dir = os.path.dirname(output) or "."
+            os.makedirs(output_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in _encode_export_batches(counted_batches(), compress):
+                    f.write(chunk)
+            os.chmod(tmp_path, 0o644) # mkstemp crea file leggibili solo dal proprietario
+            os.replace(tmp_path, output)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Errore durante l'esportazione dei post in '{output}': {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    finally:
+        cursor.close()
+    logger.info(f"Esportati {exported_count} post (query '{query_term}') in '{output}' ({fmt}{', gzip' if compress else ''}).")
+    return exported_count
+
 # Funzione di setup iniziale
-def initialize_database():
-    import os
-    if not os.path.exists('data'):
-        os.makedirs('data')
-        logger.info("Cartella 'data' creata.")
+def initialize_database(db_file=DB_NAME):
+    """
+    Crea (se necessario) la cartella e le tabelle del database.
+    Nello stesso processo lo schema viene verificato una sola volta per file.
+    """
+    if db_file in _initialized_dbs and os.path.exists(db_file):
+        return
+
+    db_dir = os.path.dirname(db_file)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+        logger.info(f"Cartella '{db_dir}' creata.")
         
-    conn = create_connection()
+    conn = create_connection(db_file)
     if conn:
         create_table(conn)
         conn.close()
+        _initialized_dbs.add(db_file)
         logger.info("Database inizializzato.")
     else:
         logger.error("Impossibile inizializzare il database: connessione fallita.")
 
+def main(argv=None):
+    """ Inizializza il database ed esporta i post: python database.py --export post.ndjson.gz [--query Q]. """
+    parser = argparse.ArgumentParser(description="Inizializza il database e, con --export, esporta i post salvati.")
+    parser.add_argument("--vacuum", action="store_true", help="Compatta il database e ricostruisce l'indice full-text.")
+    parser.add_argument("--rebuild-fts", action="store_true",
+                        help="Ricostruisce l'indice full-text (dopo un VACUUM eseguito fuori da questo comando).")
+    parser.add_argument("--db", default=DB_NAME, help=f"Database SQLite (default: {DB_NAME}).")
+    parser.add_argument("--export", metavar="FILE",
+                        help="Esporta i post in FILE ('-' = stdout). Formato e gzip dedotti dall'estensione "
+                             "(.csv, .ndjson/.jsonl, + .gz) se non indicati.")
+    parser.add_argument("--query", help="Esporta solo i post di questa query (default: tutti).")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Formato dell'esportazione.")
+    parser.add_argument("--gzip", action="store_true", default=None, help="Comprime l'esportazione in gzip.")
+    args = parser.parse_args(argv)
+
+    initialize_database(args.db)
+    if args.export is None and not args.vacuum and not args.rebuild_fts:
+        return 0
+    conn = create_connection(args.db)
+    if conn is None:
+        return 1
+    ok = True
+    try:
+        if args.vacuum:
+            ok = vacuum_database(conn)
+        elif args.rebuild_fts:
+            ok = rebuild_fulltext_index(conn)
+        if args.export is not None:
+            ok = export_posts(conn, args.export, fmt=args.format, query_term=args.query, compress=args.gzip) is not None and ok
+    finally:
+        conn.close()
+    return 0 if ok else 1
+
 if __name__ == '__main__':
     # Esempio di inizializzazione e test
-    initialize_database()
+    raise SystemExit(main())
     
     # conn = create_connection()
     # if conn:
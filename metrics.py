@@ -0,0 +1,307 @@
+# reddit_analyzer/metrics.py
+import bisect
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+METRICS_ENV_VAR = "REDDIT_ANALYZER_METRICS"
+METRIC_PREFIX = "reddit_analyzer"
+# Limiti superiori (secondi) dei bucket degli istogrammi di durata
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_FORMATS = ('prometheus', 'json')
+# Descrizioni (# HELP) delle metriche registrate dagli span e dai moduli strumentati
+METRIC_HELP = {
+    'span_seconds': "Durata delle fasi strumentate, in secondi.",
+    'span_rows_total': "Righe (post, testi, righe SQL) elaborate dalle fasi strumentate.",
+    'span_bytes_total': "Byte elaborati dalle fasi strumentate (es. risposte HTTP scaricate).",
+    'span_errors_total': "Fasi strumentate terminate con un'eccezione.",
+    'http_responses_total': "Risposte HTTP ricevute da Reddit, per codice di stato.",
+    'http_cache_hits_total': "Risposte lette dalla cache su disco senza richieste di rete.",
+}
+
+# Raccolta spenta di default: span() restituisce allora uno span vuoto condiviso e timed() chiama
+# direttamente la funzione (costo di un controllo di flag). Metriche globali al processo.
+_enabled = os.environ.get(METRICS_ENV_VAR, "").strip().lower() in ("1", "true", "yes", "on")
+_lock = threading.Lock()
+_counters = {} # (nome, etichette) -> valore
+_histograms = {} # (nome, etichette) -> _Histogram
+
+
+def enable():
+    """ Attiva la raccolta delle metriche per tutto il processo. """
+    global _enabled
+    _enabled = True
+
+def disable():
+    """ Disattiva la raccolta (le metriche già raccolte restano disponibili). """
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """ Azzera tutte le metriche raccolte. """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+class _Histogram:
+    """ Istogramma cumulativo a bucket fissi, come gli histogram di Prometheus. """
+    __slots__ = ('buckets', 'bucket_counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value) # Primo bucket con limite >= value
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def cumulative_counts(self):
+        """ Conteggi cumulativi per bucket (le = limite), l'ultimo valore è il totale (+Inf). """
+        total, cumulative = 0, []
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+            cumulative.append(total)
+        return cumulative
+
+    def quantile(self, q):
+        """ Quantile approssimato: limite superiore del bucket che lo contiene (al massimo il valore massimo osservato). """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, cumulative in zip(self.buckets, self.cumulative_counts()):
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    """ Incrementa il contatore name (con le etichette indicate). Nessun effetto se la raccolta è spenta. """
+    if not _enabled:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """ Registra un valore nell'istogramma name. Nessun effetto se la raccolta è spenta. """
+    if not _enabled:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def add_rows(span_name, count):
+    """ Aggiunge count righe elaborate allo span span_name (per le funzioni decorate con timed()). """
+    inc('span_rows_total', count, span=span_name)
+
+def add_bytes(span_name, count):
+    """ Aggiunge count byte elaborati allo span span_name. """
+    inc('span_bytes_total', count, span=span_name)
+
+
+class _Span:
+    """ Misura una fase: durata in 'span_seconds', righe e byte nei contatori, eccezioni in 'span_errors_total'. """
+    __slots__ = ('name', 'rows', 'bytes', '_started')
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.bytes = 0
+
+    def add_rows(self, count):
+        self.rows += count
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self._started
+        key = (('span', self.name),)
+        with _lock:
+            histogram = _histograms.get(('span_seconds', key))
+            if histogram is None:
+                histogram = _histograms[('span_seconds', key)] = _Histogram(LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+            if self.rows:
+                _counters[('span_rows_total', key)] = _counters.get(('span_rows_total', key), 0) + self.rows
+            if self.bytes:
+                _counters[('span_bytes_total', key)] = _counters.get(('span_bytes_total', key), 0) + self.bytes
+            if exc_type is not None:
+                _counters[('span_errors_total', key)] = _counters.get(('span_errors_total', key), 0) + 1
+        return False
+
+
+class _NullSpan:
+    """ Span vuoto restituito quando la raccolta è spenta: non misura nulla. """
+    __slots__ = ()
+
+    def add_rows(self, count):
+        pass
+
+    def add_bytes(self, count):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name):
+    """ Context manager che misura la fase name (vedi _Span); con la raccolta spenta non fa nulla. """
+    return _Span(name) if _enabled else _NULL_SPAN
+
+def timed(name=None):
+    """ Decoratore: misura ogni chiamata della funzione come span name (default: nome della funzione). """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def span_summary():
+    """
+    Riepilogo per span, ordinato per tempo totale decrescente: lista di dizionari con
+    span, calls, errors, total_seconds, mean_ms, p95_ms (approssimato), max_ms, rows,
+    rows_per_second e bytes.
+    """
+    with _lock:
+        histograms = {dict(labels).get('span'): histogram for (name, labels), histogram in _histograms.items()
+                      if name == 'span_seconds'}
+        counters = dict(_counters)
+        summary = []
+        for span_name, histogram in histograms.items():
+            key = (('span', span_name),)
+            rows = counters.get(('span_rows_total', key), 0)
+            summary.append({
+                'span': span_name,
+                'calls': histogram.count,
+                'errors': counters.get(('span_errors_total', key), 0),
+                'total_seconds': round(histogram.sum, 4),
+                'mean_ms': round(1000 * histogram.sum / histogram.count, 3) if histogram.count else 0.0,
+                'p95_ms': round(1000 * histogram.quantile(0.95), 3),
+                'max_ms': round(1000 * histogram.max, 3),
+                'rows': rows,
+                'rows_per_second': round(rows / histogram.sum, 1) if rows and histogram.sum > 0 else None,
+                'bytes': counters.get(('span_bytes_total', key), 0),
+            })
+    return sorted(summary, key=lambda entry: entry['total_seconds'], reverse=True)
+
+def snapshot():
+    """ Tutte le metriche come dizionario serializzabile in JSON (contatori, istogrammi e riepilogo degli span). """
+    with _lock:
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(_counters.items())]
+        histograms = [{'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                       'max': histogram.max, 'buckets': dict(zip(map(str, histogram.buckets), histogram.cumulative_counts()))}
+                      for (name, labels), histogram in sorted(_histograms.items())]
+    return {'generated_at': time.time(), 'enabled': _enabled, 'counters': counters,
+            'histograms': histograms, 'spans': span_summary()}
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def to_prometheus():
+    """ Metriche nel formato testo di Prometheus (es. per il textfile collector di node_exporter). """
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = [(key, histogram.buckets, histogram.cumulative_counts(), histogram.sum, histogram.count)
+                      for key, histogram in sorted(_histograms.items())]
+    lines = []
+    declared = set()
+
+    def declare(name, metric_type):
+        if name in declared:
+            return
+        declared.add(name)
+        if name in METRIC_HELP:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {METRIC_HELP[name]}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+
+    for (name, labels), value in counters:
+        declare(name, 'counter')
+        lines.append(f"{METRIC_PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), buckets, cumulative, total, count in histograms:
+        declare(name, 'histogram')
+        for bound, bucket_count in zip(buckets, cumulative):
+            lines.append(f"{METRIC_PREFIX}_{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+        lines.append(f"{METRIC_PREFIX}_{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{METRIC_PREFIX}_{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{METRIC_PREFIX}_{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+def to_json():
+    return json.dumps(snapshot(), ensure_ascii=False, indent=2)
+
+def write_metrics(path, fmt=None):
+    """
+    Scrive le metriche su file in modo atomico: JSON se fmt='json' o il file termina con '.json',
+    altrimenti formato testo di Prometheus (es. 'metrics.prom'). Restituisce True se riuscita.
+    """
+    fmt = fmt or ('json' if path.lower().endswith('.json') else 'prometheus')
+    if fmt not in METRICS_FORMATS:
+        raise ValueError(f"Formato delle metriche non supportato: '{fmt}'. Formati disponibili: {', '.join(METRICS_FORMATS)}")
+    tmp_path = None
+    try:
+        output_dir = os.path.dirname(path) or "."
+        os.makedirs(output_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(to_json() + "\n" if fmt == 'json' else to_prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Errore durante la scrittura delle metriche '{path}': {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    logger.info(f"Metriche scritte in '{path}'.")
+    return True
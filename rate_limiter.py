@@ -0,0 +1,152 @@
+# reddit_analyzer/rate_limiter.py
+import math
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Reddit tollera circa una richiesta ogni 2 secondi per client non autenticati
+DEFAULT_RATE_PER_SECOND = 0.5
+DEFAULT_BURST = 2
+
+
+class TokenBucket:
+    """
+    Rate limiter token-bucket thread-safe, condivisibile tra più scraper.
+    Ogni richiesta consuma un token; i token si ricaricano a velocità costante
+    fino a un massimo di 'capacity' (burst).
+    """
+
+    def __init__(self, rate_per_second=DEFAULT_RATE_PER_SECOND, capacity=DEFAULT_BURST):
+        """
+        Args:
+            rate_per_second (float): Token aggiunti al secondo (throughput massimo sostenuto).
+            capacity (int): Numero massimo di token accumulabili (burst iniziale).
+        """
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second deve essere maggiore di zero.")
+        self.rate = float(rate_per_second)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last_refill = now
+
+    def _try_acquire(self, now, tokens):
+        """
+        Prova a consumare i token (da chiamare con il lock acquisito).
+        Restituisce 0 in caso di successo, altrimenti i secondi da attendere.
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Blocca finché non sono disponibili 'tokens' token, poi li consuma.
+        Restituisce il tempo (in secondi) trascorso in attesa.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait_time = self._try_acquire(time.monotonic(), tokens)
+            if wait_time <= 0:
+                return waited
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def pause(self, seconds):
+        """ Sospende tutte le richieste per 'seconds' secondi (es. dopo un HTTP 429). """
+        if seconds <= 0:
+            return
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"Rate limit: richieste sospese per {seconds:.1f} secondi.")
+
+    def update_from_headers(self, headers):
+        """ Il token bucket semplice ignora gli header di rate limit del server. """
+        return None
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket che si adatta agli header di rate limit restituiti da Reddit.
+    Finché il server dichiara budget residuo ('x-ratelimit-remaining') le richieste
+    partono senza attese; quando il budget è esaurito tutti i worker attendono
+    esattamente fino al reset ('x-ratelimit-reset'). Senza header validi si
+    torna al comportamento token-bucket classico.
+    """
+
+    def __init__(self, rate_per_second=DEFAULT_RATE_PER_SECOND, capacity=DEFAULT_BURST):
+        super().__init__(rate_per_second=rate_per_second, capacity=capacity)
+        self._budget_remaining = None
+        self._budget_reset_at = 0.0
+
+    def _try_acquire(self, now, tokens):
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._budget_remaining is not None:
+            if now < self._budget_reset_at:
+                if self._budget_remaining >= tokens:
+                    self._budget_remaining -= tokens
+                    return 0.0
+                return self._budget_reset_at - now
+            # Finestra scaduta: il server ha rinnovato il budget. Una richiesta parte subito
+            # e la sua risposta ci dirà il nuovo budget; le altre usano il token bucket.
+            self._budget_remaining = None
+            return 0.0
+        return super()._try_acquire(now, tokens)
+
+    def update_from_headers(self, headers):
+        """
+        Aggiorna il budget a partire dagli header 'x-ratelimit-remaining' e
+        'x-ratelimit-reset' di una risposta. Header assenti o non validi vengono ignorati.
+        """
+        remaining = _parse_float(headers.get('x-ratelimit-remaining'))
+        reset = _parse_float(headers.get('x-ratelimit-reset'))
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self._budget_remaining = max(0, math.floor(remaining))
+            self._budget_reset_at = time.monotonic() + max(0.0, reset)
+        if remaining < 1:
+            logger.info(f"Budget di rate limit esaurito, reset tra {reset:.0f} secondi.")
+
+
+def parse_retry_after(value):
+    """
+    Interpreta l'header 'Retry-After' (secondi o data HTTP).
+    Restituisce i secondi da attendere, oppure None se l'header non è valido.
+    """
+    if not value:
+        return None
+    seconds = _parse_float(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def _parse_float(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,110 @@
+# reddit_analyzer/response_cache.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_DIR = "data/http_cache"
+DEFAULT_TTL_SECONDS = 15 * 60
+DEFAULT_MAX_SIZE_BYTES = 100 * 1024 * 1024 # 100 MB
+
+
+class ResponseCache:
+    """
+    Cache su disco delle risposte JSON dell'API di Reddit.
+    Ogni risposta è salvata in un file JSON il cui nome è l'hash di (url, parametri).
+    Le voci più vecchie di 'ttl_seconds' vengono ignorate; quando la dimensione
+    totale supera 'max_size_bytes' si eliminano i file meno recenti.
+    Con ttl_seconds=None (riproduzione di risposte registrate) non si elimina mai nulla.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl_seconds=DEFAULT_TTL_SECONDS, max_size_bytes=DEFAULT_MAX_SIZE_BYTES):
+        """
+        Args:
+            cache_dir (str): Cartella dei file di cache (creata se non esiste).
+            ttl_seconds (float | None): Validità di una voce in secondi. None = nessuna scadenza
+                (utile per riprodurre risposte registrate offline).
+            max_size_bytes (int): Dimensione massima complessiva della cache (ignorata se ttl_seconds è None,
+                per non eliminare le risposte registrate).
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(url, params):
+        """ Chiave stabile per (url, parametri), indipendente dall'ordine dei parametri. """
+        normalized = json.dumps([url, sorted((str(k), str(v)) for k, v in (params or {}).items())])
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, url, params):
+        """ Restituisce il JSON in cache per (url, params), oppure None se assente o scaduto. """
+        path = self._path(self.make_key(url, params))
+        try:
+            if self.ttl_seconds is not None and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)['payload']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Voce di cache non leggibile ({path}): {e}")
+            return None
+
+    def put(self, url, params, payload):
+        """ Salva (in modo atomico) la risposta JSON per (url, params). """
+        key = self.make_key(url, params)
+        entry = {'url': url, 'params': params, 'stored_at': time.time(), 'payload': payload}
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, TypeError) as e:
+            logger.warning(f"Impossibile scrivere la voce di cache per {url}: {e}")
+            return
+        if self.ttl_seconds is not None:
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """ Elimina le voci meno recenti finché la cache non rientra in max_size_bytes. """
+        with self._lock:
+            entries = []
+            total_size = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+            if total_size <= self.max_size_bytes:
+                return
+            entries.sort()
+            removed = 0
+            for _, size, path in entries:
+                if total_size <= self.max_size_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total_size -= size
+                    removed += 1
+                except OSError:
+                    pass
+            logger.info(f"Cache HTTP: eliminate {removed} voci meno recenti (dimensione attuale: {total_size} byte).")
+
+    def clear(self):
+        """ Svuota la cache. """
+        with self._lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith('.json'):
+                    os.remove(entry.path)
@@ -0,0 +1,290 @@
+# reddit_analyzer/scheduler.py
+import argparse
+import calendar
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils import setup_logger
+from rate_limiter import AdaptiveRateLimiter
+from database import (
+    create_connection,
+    initialize_database,
+    add_tracked_query,
+    remove_tracked_query,
+    fetch_tracked_queries,
+    claim_tracked_query_run,
+    fetch_tracked_query_next_run,
+    record_scheduler_run
+)
+
+logger = setup_logger(__name__)
+
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S" # Come CURRENT_TIMESTAMP di SQLite (UTC)
+DEFAULT_REFRESH_INTERVAL_SECONDS = 3600
+MIN_REFRESH_INTERVAL_SECONDS = 60
+DEFAULT_JITTER_FRACTION = 0.1 # Ritardo casuale fino al 10% dell'intervallo, per non far coincidere le query
+DEFAULT_MAX_WORKERS = 2
+RELOAD_INTERVAL_SECONDS = 30 # Ogni quanto rileggere 'tracked_queries' (query aggiunte/rimosse da altri processi)
+
+def to_db_time(epoch):
+    """ Timestamp Unix -> stringa UTC nel formato di CURRENT_TIMESTAMP. """
+    return time.strftime(DB_TIME_FORMAT, time.gmtime(epoch))
+
+def from_db_time(text):
+    """ Stringa UTC nel formato di CURRENT_TIMESTAMP -> timestamp Unix. """
+    return calendar.timegm(time.strptime(text, DB_TIME_FORMAT))
+
+def next_run_time(interval_seconds, jitter_fraction=DEFAULT_JITTER_FRACTION, now=None):
+    """ Prossima esecuzione: now + intervallo + un ritardo casuale tra 0 e jitter_fraction * intervallo. """
+    now = time.time() if now is None else now
+    return now + interval_seconds + random.uniform(0, jitter_fraction * interval_seconds)
+
+
+class RefreshScheduler:
+    """
+    Daemon che aggiorna periodicamente le query monitorate (tabella 'tracked_queries') in
+    background, fuori dal thread dell'interfaccia. Le scadenze sono tenute in una coda di
+    priorità (heap); ogni query dovuta viene prenotata nel DB, aggiornata con un recupero
+    incrementale su un piccolo pool di thread e l'esito viene salvato in 'scheduler_runs'.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, jitter_fraction=DEFAULT_JITTER_FRACTION,
+                 rate_limiter=None, cache=None, reload_interval=RELOAD_INTERVAL_SECONDS):
+        """
+        Args:
+            max_workers (int): Query aggiornate contemporaneamente.
+            jitter_fraction (float): Ritardo casuale massimo aggiunto a ogni scadenza, in frazione dell'intervallo.
+            rate_limiter (TokenBucket, optional): Rate limiter condiviso dai worker. Default: AdaptiveRateLimiter().
+            cache (ResponseCache, optional): Cache delle risposte. Default: nessuna, un refresh vuole dati nuovi.
+            reload_interval (float): Secondi tra due letture di 'tracked_queries'.
+        """
+        self.max_workers = max(1, max_workers)
+        self.jitter_fraction = jitter_fraction
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+        self.cache = cache
+        self.reload_interval = reload_interval
+        self._queue = [] # Heap di (scadenza Unix, query_term)
+        self._tracked = {} # query_term -> (num_posts, interval_seconds)
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Avvia il thread daemon dello scheduler (nessun effetto se è già attivo). """
+        if self.is_running:
+            return
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="refresh-worker")
+        self._thread = threading.Thread(target=self._run, name="refresh-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduler di refresh avviato ({self.max_workers} worker).")
+
+    def stop(self, wait_for_jobs=True):
+        """ Ferma lo scheduler; con wait_for_jobs=True attende gli aggiornamenti in corso. """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait_for_jobs)
+            self._executor = None
+        logger.info("Scheduler di refresh fermato.")
+
+    def wake(self):
+        """ Rilegge subito le query monitorate (es. dopo add_tracked_query o schedule_tracked_query_now). """
+        self._wakeup.set()
+
+    def track(self, query_term, num_posts, interval_seconds=DEFAULT_REFRESH_INTERVAL_SECONDS):
+        """ Monitora una query (aggiornamento immediato, poi ogni interval_seconds). Restituisce True se salvata. """
+        if interval_seconds < MIN_REFRESH_INTERVAL_SECONDS:
+            raise ValueError(f"L'intervallo minimo di aggiornamento è {MIN_REFRESH_INTERVAL_SECONDS} secondi (ricevuti {interval_seconds}).")
+        conn = create_connection()
+        if conn is None:
+            return False
+        try:
+            tracked = add_tracked_query(conn, query_term, num_posts, interval_seconds)
+        finally:
+            conn.close()
+        self.wake()
+        return tracked
+
+    def run_pending(self):
+        """
+        Esegue una sola volta tutti gli aggiornamenti dovuti e ne attende la fine, senza thread
+        daemon (per cron). Restituisce il numero di aggiornamenti eseguiti.
+        """
+        conn = create_connection()
+        if conn is None:
+            return 0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="refresh-worker")
+        try:
+            self._reload(conn)
+            futures = self._dispatch_due(conn, time.time())
+            wait(futures)
+            return len(futures)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            conn.close()
+
+    def _run(self):
+        """ Ciclo del thread daemon: rilegge le query, avvia quelle dovute e dorme fino alla prossima scadenza. """
+        conn = create_connection() # Connessione dedicata al thread dello scheduler
+        if conn is None:
+            logger.error("Scheduler di refresh non avviato: connessione al database fallita.")
+            return
+        next_reload = 0.0
+        try:
+            while not self._stopping.is_set():
+                now = time.time()
+                if now >= next_reload or self._wakeup.is_set():
+                    self._wakeup.clear()
+                    self._reload(conn)
+                    next_reload = now + self.reload_interval
+                self._dispatch_due(conn, now)
+                next_due = self._queue[0][0] if self._queue else next_reload
+                self._wakeup.wait(max(0.0, min(next_due, next_reload) - time.time()))
+        except Exception as e:
+            logger.error(f"Errore nel thread dello scheduler di refresh: {e}", exc_info=True)
+        finally:
+            conn.close()
+
+    def _reload(self, conn):
+        """ Ricostruisce la coda delle scadenze dalle query monitorate attive nel DB. """
+        tracked_df = fetch_tracked_queries(conn, enabled_only=True)
+        self._tracked = {row.query_term: (int(row.num_posts), int(row.interval_seconds))
+                         for row in tracked_df.itertuples(index=False)}
+        self._queue = [(from_db_time(row.next_run_at), row.query_term) for row in tracked_df.itertuples(index=False)]
+        heapq.heapify(self._queue)
+
+    def _dispatch_due(self, conn, now):
+        """
+        Avvia sui worker le query con scadenza superata. Restituisce i future avviati.
+        Le query non avviate restano in coda con la scadenza successiva: quelle ancora in corso
+        dopo un intervallo, quelle prenotate da un altro scheduler alla scadenza scritta nel DB.
+        """
+        futures = []
+        deferred = []
+        while self._queue and self._queue[0][0] <= now:
+            _, query_term = heapq.heappop(self._queue)
+            if query_term not in self._tracked:
+                continue
+            num_posts, interval_seconds = self._tracked[query_term]
+            next_due = next_run_time(interval_seconds, self.jitter_fraction, now)
+            with self._lock:
+                already_running = query_term in self._running
+            if already_running: # Aggiornamento precedente ancora in corso
+                deferred.append((next_due, query_term))
+                continue
+            # La prenotazione nel DB evita esecuzioni doppie se più scheduler condividono il DB
+            if not claim_tracked_query_run(conn, query_term, to_db_time(now), to_db_time(next_due)):
+                claimed_next_run = fetch_tracked_query_next_run(conn, query_term)
+                if claimed_next_run is not None: # None: query rimossa o disattivata nel frattempo
+                    claimed_due = from_db_time(claimed_next_run)
+                    # Scadenza nel DB ancora passata: prenotazione fallita per un errore, si ritenta con next_due
+                    # (o alla rilettura successiva di 'tracked_queries')
+                    deferred.append((claimed_due if claimed_due > now else next_due, query_term))
+                continue
+            heapq.heappush(self._queue, (next_due, query_term))
+            with self._lock:
+                self._running.add(query_term)
+            futures.append(self._executor.submit(self._refresh, query_term, num_posts))
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+        return futures
+
+    def _refresh(self, query_term, num_posts):
+        """ Aggiornamento incrementale di una query (eseguito su un worker) e registrazione dell'esito. """
+        from scraper import RedditScraper # Import pigro: la dashboard avvia lo scheduler senza caricare lo scraper
+        started_at = to_db_time(time.time())
+        status, stats, error = 'ok', {'fetched': 0, 'new': 0}, None
+        try:
+            scraper = RedditScraper(query=query_term, num_posts=num_posts, rate_limiter=self.rate_limiter, cache=self.cache)
+            stats = scraper.scrape_incremental()
+            if scraper.interrupted:
+                status = 'interrupted'
+        except Exception as e:
+            status, error = 'failed', str(e)
+            logger.error(f"Errore durante l'aggiornamento in background di '{query_term}': {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._running.discard(query_term)
+
+        conn = create_connection()
+        if conn is not None:
+            try:
+                record_scheduler_run(conn, query_term, started_at, to_db_time(time.time()), status,
+                                     fetched=stats['fetched'], new_posts=stats['new'], error=error)
+            finally:
+                conn.close()
+        logger.info(f"Aggiornamento in background di '{query_term}': {status}, {stats['new']} post nuovi.")
+        return status
+
+
+def main(argv=None):
+    """ Gestione delle query monitorate ed esecuzione dello scheduler in primo piano. """
+    parser = argparse.ArgumentParser(description="Scheduler di refresh delle query monitorate.")
+    parser.add_argument("--track", metavar="QUERY", help="Aggiunge (o aggiorna) una query monitorata.")
+    parser.add_argument("--posts", type=int, default=100, help="Post massimi esaminati per aggiornamento (con --track).")
+    parser.add_argument("--interval", type=int, default=DEFAULT_REFRESH_INTERVAL_SECONDS,
+                        help=f"Secondi tra due aggiornamenti (con --track, minimo {MIN_REFRESH_INTERVAL_SECONDS}).")
+    parser.add_argument("--untrack", metavar="QUERY", help="Smette di monitorare una query.")
+    parser.add_argument("--list", action="store_true", help="Elenca le query monitorate ed esce.")
+    parser.add_argument("--once", action="store_true", help="Esegue gli aggiornamenti dovuti ed esce (per cron).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    if args.track and args.interval < MIN_REFRESH_INTERVAL_SECONDS:
+        parser.error(f"--interval deve essere almeno {MIN_REFRESH_INTERVAL_SECONDS} secondi.")
+    initialize_database()
+    scheduler = RefreshScheduler(max_workers=args.workers)
+    if args.track:
+        if not scheduler.track(args.track, args.posts, args.interval):
+            return 1
+    if args.untrack:
+        conn = create_connection()
+        if conn is None:
+            return 1
+        try:
+            removed = remove_tracked_query(conn, args.untrack)
+        finally:
+            conn.close()
+        if not removed:
+            return 1
+    if args.list:
+        conn = create_connection()
+        if conn is None:
+            return 1
+        print(fetch_tracked_queries(conn).to_string(index=False))
+        conn.close()
+        return 0
+    if args.track or args.untrack:
+        return 0
+    if args.once:
+        scheduler.run_pending()
+        return 0
+
+    scheduler.start()
+    try:
+        while scheduler.is_running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Interruzione richiesta: attendo la fine degli aggiornamenti in corso...")
+    finally:
+        scheduler.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
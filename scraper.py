@@ -1,165 +1,659 @@
 # reddit_analyzer/scraper.py
 import requests
 import time
-import re
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from utils import setup_logger
-from database import create_connection, insert_posts_batch, initialize_database
+import metrics
+from text_processing import normalize_text
+from database import (
+    create_connection, insert_posts_batch, initialize_database,
+    get_scrape_cursor, save_scrape_cursor, delete_scrape_cursor, fetch_existing_post_ids,
+    fetch_stored_post_ids, update_posts_metadata, rebuild_aggregates, fetch_related_query_terms,
+    rescore_post_sentiment, index_post_keywords
+)
+from rate_limiter import AdaptiveRateLimiter, parse_retry_after
 
 logger = setup_logger(__name__)
 
+def _create_pooled_session(pool_size):
+    """
+    Crea una requests.Session con un pool di connessioni keep-alive
+    dimensionato per il numero di worker.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 class RedditScraper:
     """
     Una classe per cercare post su Reddit.
     """
 
-    def __init__(self, query, num_posts=25):
+    def __init__(self, query, num_posts=25, rate_limiter=None, session=None, cache=None,
+                 sort='relevance', time_filter=None, subreddit=None):
         """
         Inizializza lo scraper.
 
         Args:
             query (str): La stringa di ricerca per i post di Reddit.
             num_posts (int): Il numero massimo di post da recuperare.
+            rate_limiter (TokenBucket, optional): Rate limiter da usare prima di ogni richiesta.
+                Se condiviso tra più scraper, limita il throughput complessivo.
+                Default: AdaptiveRateLimiter, guidato dagli header di rate limit di Reddit.
+            session (requests.Session, optional): Sessione HTTP (con pool di connessioni) da riutilizzare.
+                Default: una nuova sessione keep-alive dedicata a questo scraper.
+            cache (ResponseCache, optional): Cache su disco delle risposte; se presente, le pagine
+                già scaricate e non scadute vengono lette dal disco senza richieste di rete.
+            sort (str): Ordinamento del listing ('relevance', 'hot', 'top', 'new', 'comments').
+            time_filter (str, optional): Finestra temporale ('hour', 'day', 'week', 'month', 'year', 'all').
+            subreddit (str, optional): Se indicato, la ricerca è ristretta a questo subreddit.
         """
         self.query = query
         self.num_posts_target = num_posts
-        self.base_url = "https://www.reddit.com/search.json"
+        self.subreddit = subreddit
+        if subreddit:
+            self.base_url = f"https://www.reddit.com/r/{subreddit}/search.json"
+        else:
+            self.base_url = "https://www.reddit.com/search.json"
+        self.info_url = "https://www.reddit.com/api/info.json"
+        self.sort = sort
+        self.time_filter = time_filter
+        self.interrupted = False
+        self._cancel_event = threading.Event()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36'
         }
         # Non memorizziamo più fetched_posts_data qui, fetch_posts lo restituirà
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+        self.session = session if session is not None else _create_pooled_session(1)
+        self.cache = cache
+        self.max_retries = 5 # Ritentativi per errori 5xx / di connessione
+        self.max_rate_limit_waits = 10 # Attese consecutive tollerate dopo un HTTP 429
+        self.backoff_base = 1.0
+        self.backoff_max = 60.0
 
-    def _make_request(self, params):
+    def cancel(self):
         """
-        Effettua una singola richiesta all'API di Reddit.
+        Chiede di interrompere il recupero in corso (anche da un altro thread): fetch_pages si ferma
+        prima della pagina successiva e imposta self.interrupted, come per un errore.
         """
-        try:
-            # logger.debug(f"Requesting URL: {self.base_url} with params: {params}")
-            response = requests.get(self.base_url, headers=self.headers, params=params, timeout=15) # Timeout aumentato
+        self._cancel_event.set()
+
+    def _make_request(self, params, url=None, use_cache=True):
+        """
+        Effettua una richiesta all'API di Reddit, con ritentativi.
+        url è l'endpoint da interrogare (default: self.base_url).
+        Se è configurata una cache (e use_cache è True), le risposte valide vengono lette/salvate su disco.
+        - HTTP 429: attende esattamente quanto indicato da 'Retry-After' / 'x-ratelimit-reset'
+          (sospendendo tutti i worker che condividono il rate limiter) e ritenta.
+        - HTTP 5xx, errori di connessione e timeout: backoff esponenziale con jitter.
+        - Altri errori: nessun ritentativo.
+        Restituisce il JSON decodificato, oppure None in caso di errore definitivo.
+        """
+        url = url or self.base_url
+        use_cache = use_cache and self.cache is not None
+        if use_cache:
+            cached = self.cache.get(url, params)
+            if cached is not None:
+                logger.debug(f"Risposta letta dalla cache per params: {params}")
+                metrics.inc('http_cache_hits_total')
+                return cached
+
+        error_attempts = 0
+        rate_limited_attempts = 0
+
+        while True:
+            self.rate_limiter.acquire() # Rispetta i rate limits (condivisi se il limiter è condiviso)
+            try:
+                # logger.debug(f"Requesting URL: {self.base_url} with params: {params}")
+                with metrics.span("http_fetch") as span: # Latenza per tentativo (attesa del rate limiter esclusa)
+                    response = self.session.get(url, headers=self.headers, params=params, timeout=15) # Timeout aumentato
+                    span.add_bytes(len(response.content))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as conn_err:
+                error_attempts += 1
+                if error_attempts > self.max_retries:
+                    logger.error(f"Errore di connessione/timeout dopo {self.max_retries} ritentativi: {conn_err}")
+                    return None
+                delay = self._backoff_delay(error_attempts)
+                logger.warning(f"Errore di connessione/timeout: {conn_err}. Ritento tra {delay:.1f} secondi ({error_attempts}/{self.max_retries})...")
+                time.sleep(delay)
+                continue
+            except requests.exceptions.RequestException as req_err:
+                logger.error(f"Errore generico durante la richiesta: {req_err}")
+                return None
+
             # logger.debug(f"Response status code: {response.status_code}, Headers: {response.headers}")
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as http_err:
-            logger.error(f"Errore HTTP durante la richiesta: {http_err}")
-            if http_err.response is not None:
-                logger.error(f"Contenuto della risposta (HTTPError): {http_err.response.text[:500]}...")
-        except requests.exceptions.ConnectionError as conn_err:
-            logger.error(f"Errore di connessione: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
-            logger.error(f"Timeout della richiesta: {timeout_err}")
-        except requests.exceptions.JSONDecodeError as json_err:
-            logger.error(f"Errore di decodifica JSON: {json_err}")
-            # 'response' potrebbe non essere definita se l'errore avviene prima
-            # if 'response' in locals() and response is not None:
-            #    logger.error(f"Testo della risposta non decodificabile: {response.text[:500]}...")
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Errore generico durante la richiesta: {req_err}")
-        return None
+            self.rate_limiter.update_from_headers(response.headers)
+            metrics.inc('http_responses_total', status=str(response.status_code))
+
+            if response.status_code == 429:
+                rate_limited_attempts += 1
+                if rate_limited_attempts > self.max_rate_limit_waits:
+                    logger.error(f"HTTP 429 ricevuto {rate_limited_attempts} volte consecutive. Interruzione.")
+                    return None
+                delay = parse_retry_after(response.headers.get('Retry-After'))
+                if delay is None:
+                    delay = parse_retry_after(response.headers.get('x-ratelimit-reset'))
+                if delay is None:
+                    delay = self._backoff_delay(rate_limited_attempts)
+                logger.warning(f"HTTP 429 (Too Many Requests). Attendo {delay:.1f} secondi prima di ritentare...")
+                self.rate_limiter.pause(delay)
+                continue
+
+            if response.status_code >= 500:
+                error_attempts += 1
+                if error_attempts > self.max_retries:
+                    logger.error(f"Errore HTTP {response.status_code} dopo {self.max_retries} ritentativi.")
+                    return None
+                delay = self._backoff_delay(error_attempts)
+                logger.warning(f"Errore HTTP {response.status_code} dal server. Ritento tra {delay:.1f} secondi ({error_attempts}/{self.max_retries})...")
+                time.sleep(delay)
+                continue
+
+            try:
+                response.raise_for_status()
+                data = response.json()
+                if use_cache:
+                    self.cache.put(url, params, data)
+                return data
+            except requests.exceptions.HTTPError as http_err:
+                logger.error(f"Errore HTTP durante la richiesta: {http_err}")
+                logger.error(f"Contenuto della risposta (HTTPError): {response.text[:500]}...")
+            except requests.exceptions.JSONDecodeError as json_err:
+                logger.error(f"Errore di decodifica JSON: {json_err}")
+                logger.error(f"Testo della risposta non decodificabile: {response.text[:500]}...")
+            return None
+
+    def _backoff_delay(self, attempt):
+        """
+        Backoff esponenziale con "full jitter": un valore casuale tra 0 e
+        min(backoff_max, backoff_base * 2^(attempt-1)).
+        """
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
 
+    @metrics.timed("normalize_content")
     def _normalize_content(self, content_text):
         """
         Pulisce il contenuto del post: rimuove newline e normalizza gli spazi.
         """
-        if not content_text:
-            return ""
-        content = content_text.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-        content = content.replace('\t', ' ')
-        content = re.sub(r'\s+', ' ', content).strip()
-        return content
+        return normalize_text(content_text)
 
-    def fetch_posts(self):
+    def _parse_post(self, post):
         """
-        Recupera i post da Reddit. Gestisce la paginazione.
-        Restituisce una lista di dizionari, ognuno rappresentante un post.
+        Converte i dati grezzi di un post (campo 'data' di un child) nel dizionario salvato nel DB.
         """
-        logger.info(f"Inizio recupero di circa {self.num_posts_target} post per la query: '{self.query}'...")
-        fetched_posts_data = []
-        last_post_fullname = None
-        posts_retrieved_count = 0
-        retries = 0
-        max_retries = 3 # Numero di tentativi in caso di errore temporaneo
+        return {
+            'post_id': post.get('id', 'N/A'),
+            'titolo': self._normalize_content(post.get('title', 'N/A')), # Normalizza anche il titolo
+            'contenuto': self._normalize_content(post.get('selftext', '')),
+            'categoria': post.get('subreddit', 'N/A'),
+            'punteggio': post.get('score', 0),
+            'url_post': f"https://www.reddit.com{post.get('permalink', '')}"
+        }
+
+    @property
+    def listing_key(self):
+        """ Identifica il listing paginato (usato come chiave del cursore salvato nel DB). """
+        parts = [self.sort]
+        if self.time_filter:
+            parts.append(f"t={self.time_filter}")
+        if self.subreddit:
+            parts.append(f"r={self.subreddit}")
+        return ":".join(parts)
+
+    def fetch_pages(self, after=None, already_fetched=0, sort=None, use_cache=True):
+        """
+        Generatore che recupera i post da Reddit una pagina alla volta.
+        Produce tuple (posts_pagina, after_successivo), dove posts_pagina è una lista
+        di dizionari e after_successivo è il fullname da cui riprendere (None se il
+        listing è terminato o il target è stato raggiunto).
+
+        Args:
+            after (str, optional): Fullname da cui riprendere la paginazione.
+            already_fetched (int): Post già recuperati in una esecuzione precedente,
+                conteggiati nel target num_posts.
+            sort (str, optional): Ordinamento del listing; default self.sort.
+            use_cache (bool): Se False le pagine vengono sempre richieste a Reddit, anche con una cache configurata.
+
+        Se la paginazione si interrompe per un errore (o per cancel()), self.interrupted diventa True.
+        """
+        logger.info(f"Inizio recupero di circa {self.num_posts_target} post per la query: '{self.query}' (listing: {self.listing_key})...")
+        self.interrupted = False
+        sort = sort or self.sort
+        last_post_fullname = after
+        posts_retrieved_count = already_fetched
 
         while posts_retrieved_count < self.num_posts_target:
+            if self._cancel_event.is_set():
+                logger.warning(f"Recupero per '{self.query}' annullato su richiesta.")
+                self.interrupted = True
+                break
             limit_per_request = min(100, self.num_posts_target - posts_retrieved_count)
             if limit_per_request <= 0:
                 break
 
             params = {
                 'q': self.query,
-                'sort': 'relevance',
+                'sort': sort,
                 'limit': limit_per_request
             }
+            if self.time_filter:
+                params['t'] = self.time_filter
+            if self.subreddit:
+                params['restrict_sr'] = 1
             if last_post_fullname:
                 params['after'] = last_post_fullname
 
-            logger.info(f"Recupero post (limite: {limit_per_request}, dopo: {last_post_fullname}, tentativo: {retries + 1})...")
-            data = self._make_request(params)
+            logger.info(f"Recupero post (limite: {limit_per_request}, dopo: {last_post_fullname})...")
+            data = self._make_request(params, use_cache=use_cache)
 
-            if data and 'data' in data and 'children' in data['data']:
-                posts_batch = data['data']['children']
-                retries = 0 # Reset retries on success
+            if not (data and 'data' in data and 'children' in data['data']):
+                # _make_request ha già esaurito i ritentativi (backoff / attese di rate limit)
+                logger.error("Errore nel recuperare o parsare i dati da Reddit. Interruzione del recupero per questa query.")
+                self.interrupted = True
+                break
 
-                if not posts_batch:
-                    logger.info("Nessun altro post trovato per questa query o pagina.")
-                    break
+            posts_batch = data['data']['children']
+            if not posts_batch:
+                logger.info("Nessun altro post trovato per questa query o pagina.")
+                break
+
+            page_posts = []
+            for post_entry in posts_batch:
+                if 'data' in post_entry:
+                    page_posts.append(self._parse_post(post_entry['data']))
+                    posts_retrieved_count += 1
+                    if posts_retrieved_count >= self.num_posts_target:
+                        break
 
-                for post_entry in posts_batch:
-                    if 'data' in post_entry:
-                        post = post_entry['data']
-                        post_details = {
-                            'post_id': post.get('id', 'N/A'),
-                            'titolo': self._normalize_content(post.get('title', 'N/A')), # Normalizza anche il titolo
-                            'contenuto': self._normalize_content(post.get('selftext', '')),
-                            'categoria': post.get('subreddit', 'N/A'),
-                            'punteggio': post.get('score', 0),
-                            'url_post': f"https://www.reddit.com{post.get('permalink', '')}"
-                        }
-                        fetched_posts_data.append(post_details)
-                        posts_retrieved_count += 1
-                        if posts_retrieved_count >= self.num_posts_target:
-                            break
-                
-                if posts_batch and posts_retrieved_count < self.num_posts_target:
-                    last_post_fullname = posts_batch[-1]['data']['name']
-                
-                if posts_retrieved_count < self.num_posts_target and posts_batch:
-                    logger.info(f"Recuperati finora: {posts_retrieved_count} post. Attendo 2 secondi...")
-                    time.sleep(2) # Rispetta i rate limits
+            # Reddit restituisce after=None quando il listing è terminato
+            next_after = data['data'].get('after', posts_batch[-1]['data'].get('name'))
+            if posts_retrieved_count >= self.num_posts_target:
+                next_after = None
             else:
-                logger.warning("Errore nel recuperare o parsare i dati da Reddit, o nessun post trovato in questo batch.")
-                retries += 1
-                if retries >= max_retries:
-                    logger.error(f"Massimo numero di tentativi ({max_retries}) raggiunto. Interruzione del recupero per questa query.")
-                    break
-                logger.info(f"Attendo 5 secondi prima di ritentare (tentativo {retries}/{max_retries})...")
-                time.sleep(5) # Pausa più lunga in caso di errore
+                logger.info(f"Recuperati finora: {posts_retrieved_count} post.")
+
+            yield page_posts, next_after
 
-        logger.info(f"Recupero completato per '{self.query}'. Trovati {len(fetched_posts_data)} post.")
+            if not next_after:
+                break
+            last_post_fullname = next_after
+
+        logger.info(f"Recupero completato per '{self.query}'. Recuperati {posts_retrieved_count} post.")
+
+    def fetch_posts(self):
+        """
+        Recupera i post da Reddit. Gestisce la paginazione.
+        Restituisce una lista di dizionari, ognuno rappresentante un post.
+        Per elaborare i post pagina per pagina senza tenerli tutti in memoria usare fetch_pages().
+        """
+        fetched_posts_data = []
+        for page_posts, _ in self.fetch_pages():
+            fetched_posts_data.extend(page_posts)
         return fetched_posts_data
 
-    def scrape_and_store(self):
+    def scrape_and_store(self, resume=True):
         """
-        Esegue il recupero dei post e li salva nel database SQLite.
+        Esegue il recupero dei post e li salva nel database SQLite pagina per pagina:
+        ogni pagina viene salvata appena arriva e il cursore 'after' del listing viene
+        memorizzato nella tabella scrape_cursors. Se un recupero precedente si è interrotto,
+        con resume=True riparte dall'ultimo cursore salvato.
         Restituisce il numero di post effettivamente inseriti nel DB.
         """
         initialize_database() # Assicura che DB e tabella esistano
-        
-        posts = self.fetch_posts()
-        if not posts:
-            logger.info(f"Nessun post recuperato per la query '{self.query}'. Nessun dato da salvare.")
-            return 0
 
         conn = create_connection()
-        inserted_count = 0
-        if conn:
-            try:
-                inserted_count = insert_posts_batch(conn, posts, self.query)
-            finally:
-                conn.close()
-        else:
+        if not conn:
             logger.error("Impossibile connettersi al database per salvare i post.")
-        
+            return 0
+
+        inserted_count = 0
+        try:
+            after, fetched_count = None, 0
+            if resume:
+                saved_cursor = get_scrape_cursor(conn, self.query, self.listing_key)
+                if saved_cursor:
+                    after, fetched_count = saved_cursor
+                    logger.info(f"Ripresa del recupero per '{self.query}' dal cursore {after} ({fetched_count} post già recuperati).")
+
+            for page_posts, next_after in self.fetch_pages(after=after, already_fetched=fetched_count):
+                if page_posts:
+                    inserted_count += insert_posts_batch(conn, page_posts, self.query)
+                fetched_count += len(page_posts)
+                if next_after:
+                    save_scrape_cursor(conn, self.query, self.listing_key, next_after, fetched_count)
+
+            if not self.interrupted:
+                delete_scrape_cursor(conn, self.query, self.listing_key)
+            else:
+                logger.warning(f"Recupero per '{self.query}' interrotto: il cursore resta salvato per riprendere in seguito.")
+        finally:
+            conn.close()
+
+        if fetched_count == 0:
+            logger.info(f"Nessun post recuperato per la query '{self.query}'. Nessun dato da salvare.")
         return inserted_count
 
+    def refresh_stored_posts(self, batch_size=100):
+        """
+        Aggiorna punteggio e metadati dei post già salvati per questa query
+        (o di tutti i post, se self.query è None). Gli id vengono richiesti all'endpoint
+        /api/info di Reddit a blocchi di 'batch_size' fullname (massimo 100) per richiesta,
+        quindi 10k post richiedono circa 100 richieste. Le risposte non passano dalla cache.
+        Restituisce il numero di post effettivamente modificati nel DB.
+        """
+        batch_size = max(1, min(100, batch_size))
+        initialize_database()
+        conn = create_connection()
+        if not conn:
+            logger.error("Impossibile connettersi al database per aggiornare i post.")
+            return 0
+
+        updated_count = 0
+        try:
+            post_ids = fetch_stored_post_ids(conn, self.query)
+            logger.info(f"Aggiornamento di {len(post_ids)} post salvati (query: {self.query!r}) in blocchi da {batch_size}...")
+            for start in range(0, len(post_ids), batch_size):
+                batch_ids = post_ids[start:start + batch_size]
+                params = {'id': ",".join(f"t3_{post_id}" for post_id in batch_ids), 'limit': len(batch_ids)}
+                data = self._make_request(params, url=self.info_url, use_cache=False)
+                if not (data and 'data' in data and 'children' in data['data']):
+                    logger.error(f"Risposta non valida da /api/info per il blocco {start // batch_size + 1}. Interruzione dell'aggiornamento.")
+                    break
+                refreshed = []
+                for post_entry in data['data']['children']:
+                    if 'data' not in post_entry:
+                        continue
+                    post_details = self._parse_post(post_entry['data'])
+                    # Per i post rimossi/cancellati si conserva il contenuto già salvato
+                    if post_entry['data'].get('selftext') in ('[removed]', '[deleted]'):
+                        post_details['contenuto'] = None
+                    refreshed.append(post_details)
+                updated_count += update_posts_metadata(conn, refreshed)
+                # Ricalcola sentiment e termini indicizzati solo dei post il cui testo è effettivamente cambiato
+                refreshed_ids = [post['post_id'] for post in refreshed]
+                rescore_post_sentiment(conn, refreshed_ids)
+                index_post_keywords(conn, refreshed_ids)
+            if updated_count:
+                # I punteggi cambiati alterano le statistiche di tutte le query che condividono quei post
+                rebuild_aggregates(conn, fetch_related_query_terms(conn, self.query))
+        finally:
+            conn.close()
+
+        logger.info(f"Aggiornamento completato: {updated_count} post modificati.")
+        return updated_count
+
+    def scrape_incremental(self):
+        """
+        Recupero incrementale "dall'ultima esecuzione": scorre il listing ordinato per 'new',
+        confronta gli id di ogni pagina con quelli già salvati (una sola lookup indicizzata
+        per pagina) e smette di paginare alla prima pagina composta solo da post già noti.
+        num_posts resta il limite massimo di post esaminati.
+
+        Returns:
+            dict: {'fetched': post scaricati, 'new': post nuovi salvati,
+                   'skipped': post già presenti, 'pages': pagine richieste}
+        """
+        initialize_database()
+        stats = {'fetched': 0, 'new': 0, 'skipped': 0, 'pages': 0}
+
+        conn = create_connection()
+        if not conn:
+            logger.error("Impossibile connettersi al database per il recupero incrementale.")
+            return stats
+
+        try:
+            # Senza cache: una pagina di 'new' letta dalla cache mostrerebbe solo post già noti
+            for page_posts, _ in self.fetch_pages(sort='new', use_cache=False):
+                stats['pages'] += 1
+                stats['fetched'] += len(page_posts)
+                known_ids = fetch_existing_post_ids(conn, [p['post_id'] for p in page_posts], query_term=self.query)
+                new_posts = [p for p in page_posts if p['post_id'] not in known_ids]
+                stats['skipped'] += len(page_posts) - len(new_posts)
+                if new_posts:
+                    stats['new'] += insert_posts_batch(conn, new_posts, self.query)
+                else:
+                    logger.info(f"Pagina composta solo da post già noti: recupero incrementale per '{self.query}' terminato.")
+                    break
+        finally:
+            conn.close()
+
+        logger.info(f"Recupero incrementale per '{self.query}': {stats['fetched']} scaricati, {stats['new']} nuovi, {stats['skipped']} già presenti ({stats['pages']} pagine).")
+        return stats
+
+def _unique_query_targets(query_targets):
+    """
+    Lista di tuple (query, num_posts) senza query ripetute, nell'ordine della prima occorrenza
+    (per una query ripetuta vale l'ultimo num_posts, come in cli.read_queries_file): i risultati
+    sono indicizzati per query, quindi un duplicato ripeterebbe la stessa ricerca sovrascrivendola.
+    """
+    items = query_targets.items() if isinstance(query_targets, dict) else query_targets
+    return list(dict(items).items())
+
+def scrape_queries_concurrently(query_targets, max_workers=4, rate_limiter=None, cache=None):
+    """
+    Recupera i post per più query in parallelo su un pool di thread.
+    Tutti i worker condividono un'unica sessione HTTP e un unico rate limiter,
+    così il throughput complessivo resta entro i limiti di Reddit.
+
+    Args:
+        query_targets (dict | list): {query: num_posts} oppure lista di tuple (query, num_posts);
+            le query ripetute vengono recuperate una sola volta (vedi _unique_query_targets).
+        max_workers (int): Numero di query recuperate contemporaneamente.
+        rate_limiter (TokenBucket, optional): Rate limiter condiviso. Default: AdaptiveRateLimiter().
+        cache (ResponseCache, optional): Cache su disco delle risposte, condivisa tra i worker.
+
+    Returns:
+        dict: {query: lista di dizionari dei post}, nello stesso formato di fetch_posts().
+    """
+    items = _unique_query_targets(query_targets)
+    if not items:
+        return {}
+
+    shared_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+    workers = max(1, min(max_workers, len(items)))
+    logger.info(f"Avvio recupero concorrente di {len(items)} query con {workers} worker...")
+
+    results = {}
+    session = _create_pooled_session(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for query, num_posts in items:
+                scraper = RedditScraper(query=query, num_posts=num_posts, rate_limiter=shared_limiter, session=session, cache=cache)
+                futures[executor.submit(scraper.fetch_posts)] = query
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    results[query] = future.result()
+                except Exception as e:
+                    logger.error(f"Errore durante il recupero concorrente per la query '{query}': {e}", exc_info=True)
+                    results[query] = []
+    finally:
+        session.close()
+
+    logger.info(f"Recupero concorrente completato: {sum(len(p) for p in results.values())} post per {len(results)} query.")
+    return results
+
+def scrape_and_store_queries(query_targets, max_workers=4, rate_limiter=None, cache=None):
+    """
+    Come scrape_queries_concurrently, ma salva i risultati nel database.
+    Le scritture avvengono nel thread chiamante, una query alla volta.
+    Restituisce un dizionario {query: numero di post inseriti}.
+    """
+    initialize_database()
+    results = scrape_queries_concurrently(query_targets, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache)
+
+    inserted = {query: 0 for query in results}
+    conn = create_connection()
+    if conn:
+        try:
+            for query, posts in results.items():
+                if posts:
+                    inserted[query] = insert_posts_batch(conn, posts, query)
+        finally:
+            conn.close()
+    else:
+        logger.error("Impossibile connettersi al database per salvare i post.")
+    return inserted
+
+def scrape_and_store_queries_resumable(query_targets, max_workers=4, rate_limiter=None, cache=None):
+    """
+    Recupera e salva più query in parallelo con RedditScraper.scrape_and_store(): ogni worker
+    salva le proprie pagine appena arrivano (le connessioni WAL permettono scritture da più thread)
+    e un recupero interrotto riprende dal cursore salvato alla prossima esecuzione.
+    Sessione HTTP, rate limiter e cache sono condivisi come in scrape_queries_concurrently.
+
+    Returns:
+        dict: {query: {'inserted': int, 'interrupted': bool, 'seconds': float | None, 'error': str | None}}.
+            'interrupted' è True se il recupero si è fermato per errori di rete/API,
+            'error' contiene l'eccezione che ha fatto fallire il worker.
+    """
+    items = _unique_query_targets(query_targets)
+    if not items:
+        return {}
+
+    initialize_database()
+    shared_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+    workers = max(1, min(max_workers, len(items)))
+    logger.info(f"Avvio recupero e salvataggio di {len(items)} query con {workers} worker...")
+
+    def run(scraper):
+        started = time.perf_counter()
+        inserted = scraper.scrape_and_store()
+        return {'inserted': inserted, 'interrupted': scraper.interrupted,
+                'seconds': round(time.perf_counter() - started, 2), 'error': None}
+
+    results = {}
+    session = _create_pooled_session(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for query, num_posts in items:
+                scraper = RedditScraper(query=query, num_posts=num_posts, rate_limiter=shared_limiter, session=session, cache=cache)
+                futures[executor.submit(run, scraper)] = query
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    results[query] = future.result()
+                except Exception as e:
+                    logger.error(f"Errore durante il recupero della query '{query}': {e}", exc_info=True)
+                    results[query] = {'inserted': 0, 'interrupted': True, 'seconds': None, 'error': str(e)}
+    finally:
+        session.close()
+
+    logger.info(f"Recupero e salvataggio completati: {sum(r['inserted'] for r in results.values())} post inseriti per {len(results)} query.")
+    return results
+
+# Reddit interrompe ogni listing di ricerca a circa 1000 risultati
+LISTING_RESULT_CAP = 1000
+DEEP_CRAWL_SORTS = ('relevance', 'top', 'comments', 'new', 'hot')
+DEEP_CRAWL_TIME_FILTERS = ('hour', 'day', 'week', 'month', 'year', 'all')
+# Ordinamenti per cui il parametro 't' restringe effettivamente i risultati
+_TIME_FILTERED_SORTS = ('relevance', 'top', 'comments')
+
+def build_crawl_partitions(sorts=DEEP_CRAWL_SORTS, time_filters=DEEP_CRAWL_TIME_FILTERS, subreddits=None):
+    """
+    Restituisce la lista delle partizioni (sort, time_filter, subreddit) di un deep crawl.
+    Il time_filter si applica solo agli ordinamenti che lo supportano; se sono indicati
+    dei subreddit, le partizioni ristrette si aggiungono a quelle senza restrizione.
+    """
+    partitions = []
+    for subreddit in [None] + list(subreddits or []):
+        for sort in sorts:
+            for time_filter in (time_filters if sort in _TIME_FILTERED_SORTS else [None]):
+                partitions.append((sort, time_filter, subreddit))
+    return partitions
+
+def deep_crawl(query, sorts=DEEP_CRAWL_SORTS, time_filters=DEEP_CRAWL_TIME_FILTERS, subreddits=None,
+               posts_per_partition=LISTING_RESULT_CAP, max_workers=4, rate_limiter=None, cache=None):
+    """
+    Deep crawl di una query oltre il limite di ~1000 risultati per listing: la query viene
+    suddivisa in più listing (ogni sort, ogni finestra temporale 't' e opzionalmente ogni
+    subreddit), recuperati in parallelo e uniti deduplicando per post_id.
+
+    Args:
+        query (str): La stringa di ricerca.
+        sorts (iterable): Ordinamenti da usare come partizioni.
+        time_filters (iterable): Finestre temporali per gli ordinamenti che le supportano.
+        subreddits (iterable, optional): Subreddit in cui restringere la ricerca (oltre a nessuna restrizione).
+        posts_per_partition (int): Post massimi per listing (al più LISTING_RESULT_CAP).
+        max_workers (int): Partizioni recuperate contemporaneamente.
+        rate_limiter (TokenBucket, optional): Rate limiter condiviso. Default: AdaptiveRateLimiter().
+        cache (ResponseCache, optional): Cache su disco delle risposte.
+
+    Returns:
+        tuple: (lista dei post unici, report) dove report è una lista di dizionari
+               {'partition', 'fetched', 'new_unique'} nell'ordine di completamento:
+               'new_unique' indica quanti post non visti in precedenza la partizione ha aggiunto.
+    """
+    partitions = build_crawl_partitions(sorts, time_filters, subreddits)
+    posts_per_partition = min(posts_per_partition, LISTING_RESULT_CAP)
+    shared_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+    workers = max(1, min(max_workers, len(partitions)))
+    logger.info(f"Avvio deep crawl per '{query}': {len(partitions)} partizioni, {workers} worker...")
+
+    seen_ids = set()
+    unique_posts = []
+    report = []
+    session = _create_pooled_session(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for sort, time_filter, subreddit in partitions:
+                scraper = RedditScraper(query=query, num_posts=posts_per_partition, rate_limiter=shared_limiter,
+                                        session=session, cache=cache, sort=sort, time_filter=time_filter,
+                                        subreddit=subreddit)
+                futures[executor.submit(scraper.fetch_posts)] = scraper.listing_key
+            for future in as_completed(futures):
+                partition = futures[future]
+                try:
+                    partition_posts = future.result()
+                except Exception as e:
+                    logger.error(f"Errore nella partizione '{partition}' del deep crawl: {e}", exc_info=True)
+                    partition_posts = []
+                new_unique = 0
+                for post in partition_posts:
+                    if post['post_id'] not in seen_ids:
+                        seen_ids.add(post['post_id'])
+                        unique_posts.append(post)
+                        new_unique += 1
+                report.append({'partition': partition, 'fetched': len(partition_posts), 'new_unique': new_unique})
+                logger.info(f"Partizione '{partition}': {len(partition_posts)} post, {new_unique} nuovi (totale unici: {len(unique_posts)}).")
+    finally:
+        session.close()
+
+    logger.info(f"Deep crawl completato per '{query}': {len(unique_posts)} post unici da {len(partitions)} partizioni.")
+    return unique_posts, report
+
+def deep_crawl_and_store(query, **kwargs):
+    """
+    Esegue deep_crawl() e salva i post unici nel database.
+    Accetta gli stessi argomenti di deep_crawl().
+    Restituisce (numero di post inseriti, report delle partizioni).
+    """
+    initialize_database()
+    posts, report = deep_crawl(query, **kwargs)
+    if not posts:
+        return 0, report
+
+    inserted_count = 0
+    conn = create_connection()
+    if conn:
+        try:
+            inserted_count = insert_posts_batch(conn, posts, query)
+        finally:
+            conn.close()
+    else:
+        logger.error("Impossibile connettersi al database per salvare i post.")
+    return inserted_count, report
+
 # --- Esempio di utilizzo dello script (per testare lo scraper e il DB) ---
 if __name__ == "__main__":
     logger.info("Avvio script scraper in modalità test.")
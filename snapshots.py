@@ -0,0 +1,257 @@
+# reddit_analyzer/snapshots.py
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+
+from utils import setup_logger
+from database import DB_NAME, create_connection, initialize_database, get_data_version, get_db_id, load_posts_df
+
+logger = setup_logger(__name__)
+
+# Snapshot colonnari accanto al DB (data/reddit_posts.db -> data/snapshots/)
+SNAPSHOT_DIR = os.path.join(os.path.dirname(DB_NAME), "snapshots")
+SNAPSHOT_FORMATS = {'feather': '.feather', 'parquet': '.parquet'}
+DEFAULT_SNAPSHOT_FORMAT = 'feather' # Arrow IPC non compresso: può essere letto in memory-map
+# Chiavi dei metadati dello schema Arrow: leggibili anche dai notebook (pyarrow/pandas)
+METADATA_DATA_VERSION = b'reddit_analyzer.data_version'
+METADATA_DB_ID = b'reddit_analyzer.db_id'
+METADATA_QUERY_TERM = b'reddit_analyzer.query_term'
+
+_pyarrow_warning_logged = False
+
+
+def _import_pyarrow():
+    """ Import pigro di pyarrow (dipendenza opzionale). Restituisce None se non è installato. """
+    global _pyarrow_warning_logged
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.ipc
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        if not _pyarrow_warning_logged:
+            logger.info("pyarrow non installato: snapshot colonnari disattivati, i dati verranno letti da SQLite.")
+            _pyarrow_warning_logged = True
+        return None
+
+def _db_identity(conn):
+    """ (db_id, data_version) del DB: uno snapshot è aggiornato solo se coincidono entrambi. None in caso di errore. """
+    data_version = get_data_version(conn)
+    db_id = get_db_id(conn)
+    if data_version is None or db_id is None:
+        return None
+    return db_id, data_version
+
+def snapshot_path(query_term=None, fmt=DEFAULT_SNAPSHOT_FORMAT, snapshot_dir=SNAPSHOT_DIR, columns=None):
+    """
+    Percorso dello snapshot per una query (o per l'intero corpus se query_term è None).
+    Il nome contiene una versione leggibile della query e un hash per evitare collisioni;
+    gli snapshot con solo alcune colonne hanno un suffisso che identifica le colonne.
+    Il nome fino al primo punto identifica la query (vedi _remove_superseded_snapshots()).
+    """
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Formato di snapshot non supportato: '{fmt}'. Valori ammessi: {', '.join(SNAPSHOT_FORMATS)}")
+    if query_term is None:
+        name = "all_posts"
+    else:
+        slug = re.sub(r'[^\w-]+', '_', query_term.lower()).strip('_')[:40] or "query"
+        name = f"query_{slug}_{hashlib.sha1(query_term.encode('utf-8')).hexdigest()[:8]}"
+    if columns is not None:
+        name += f".cols-{hashlib.sha1(','.join(columns).encode('utf-8')).hexdigest()[:8]}"
+    return os.path.join(snapshot_dir, name + SNAPSHOT_FORMATS[fmt])
+
+def write_snapshot(conn, query_term=None, fmt=DEFAULT_SNAPSHOT_FORMAT, columns=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Scrive lo snapshot colonnare dei post di query_term (o di tutti i post), con tipi compatti,
+    marcato con l'identificativo del DB e la versione dei dati al momento della lettura.
+    Args:
+        conn: Connessione SQLite.
+        query_term (str, optional): Query da esportare; None = intero corpus.
+        fmt (str): 'feather' (default, memory-mappable) o 'parquet' (compresso, più piccolo).
+        columns (list[str], optional): Colonne da includere (default: tutte quelle dei post).
+            Uno snapshot parziale ha un nome diverso e non sostituisce quello completo.
+        snapshot_dir (str): Cartella degli snapshot.
+    Returns:
+        str | None: Percorso del file scritto, oppure None se pyarrow non è disponibile o in caso di errore.
+    """
+    pa = _import_pyarrow()
+    if pa is None:
+        return None
+    # La versione va letta prima dei dati: se il DB cambia durante la lettura lo snapshot
+    # risulterà obsoleto (e verrà riscritto), mai "fresco" con dati vecchi
+    identity = _db_identity(conn)
+    if identity is None:
+        return None
+    df = load_posts_df(conn, columns=columns, query_term=query_term)
+    return _write_dataframe_snapshot(pa, df, snapshot_path(query_term, fmt, snapshot_dir, columns),
+                                     identity, query_term, fmt)
+
+def _write_dataframe_snapshot(pa, df, path, identity, query_term, fmt):
+    """
+    Scrive df nello snapshot 'path' (in modo atomico) con identificativo del DB e versione dei dati
+    nei metadati, poi elimina gli snapshot obsoleti della stessa query.
+    """
+    db_id, data_version = identity
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[METADATA_DATA_VERSION] = str(data_version).encode()
+        metadata[METADATA_DB_ID] = str(db_id).encode()
+        metadata[METADATA_QUERY_TERM] = (query_term or "").encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        if fmt == 'feather':
+            pa.feather.write_feather(table, tmp_path, compression='uncompressed')
+        else:
+            pa.parquet.write_table(table, tmp_path)
+        os.replace(tmp_path, path) # Scrittura atomica: i lettori vedono il vecchio o il nuovo file
+    except (OSError, pa.ArrowException) as e:
+        logger.error(f"Errore durante la scrittura dello snapshot {path}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    logger.info(f"Snapshot scritto: {path} ({len(df)} post, versione dati {data_version}).")
+    _remove_superseded_snapshots(path, identity)
+    return path
+
+def _remove_superseded_snapshots(path, identity):
+    """
+    Elimina gli snapshot della stessa query di 'path' (altre colonne o altro formato) non allineati
+    a identity: verrebbero comunque riscritti, e senza pulizia la cartella crescerebbe a ogni
+    nuova combinazione di colonne. Gli snapshot ancora aggiornati restano.
+    """
+    snapshot_dir, name = os.path.split(path)
+    base_name = name.partition('.')[0]
+    try:
+        siblings = [entry for entry in os.listdir(snapshot_dir)
+                    if entry != name and entry.partition('.')[0] == base_name
+                    and os.path.splitext(entry)[1] in SNAPSHOT_FORMATS.values()]
+    except OSError as e:
+        logger.warning(f"Impossibile elencare gli snapshot in {snapshot_dir}: {e}")
+        return
+    for entry in siblings:
+        sibling_path = os.path.join(snapshot_dir, entry)
+        if read_snapshot_identity(sibling_path) == tuple(identity):
+            continue
+        try:
+            os.remove(sibling_path)
+            logger.info(f"Snapshot obsoleto eliminato: {sibling_path}.")
+        except OSError as e:
+            logger.warning(f"Impossibile eliminare lo snapshot obsoleto {sibling_path}: {e}")
+
+def read_snapshot_identity(path):
+    """
+    (db_id, data_version) registrati nello snapshot (letti solo dallo schema), oppure None.
+    db_id è None per gli snapshot scritti prima che venisse registrato (mai considerati aggiornati).
+    """
+    pa = _import_pyarrow()
+    if pa is None or not os.path.exists(path):
+        return None
+    try:
+        if path.endswith(SNAPSHOT_FORMATS['parquet']):
+            metadata = pa.parquet.read_schema(path).metadata
+        else:
+            with pa.memory_map(path) as source:
+                metadata = pa.ipc.open_file(source).schema.metadata
+        db_id = metadata.get(METADATA_DB_ID)
+        return (int(db_id) if db_id is not None else None), int(metadata[METADATA_DATA_VERSION])
+    except (OSError, KeyError, ValueError, TypeError, pa.ArrowException) as e:
+        logger.warning(f"Snapshot non leggibile ({path}): {e}")
+        return None
+
+def load_snapshot(conn, query_term=None, fmt=DEFAULT_SNAPSHOT_FORMAT, columns=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Carica lo snapshot di query_term se è aggiornato rispetto al DB (stesso identificativo del DB
+    e stessa versione dei dati):
+    quello con esattamente le colonne richieste oppure, in mancanza, le colonne richieste dello
+    snapshot completo. Il file Feather è letto in memory-map. Restituisce None se non c'è uno
+    snapshot aggiornato o pyarrow non è disponibile.
+    """
+    pa = _import_pyarrow()
+    if pa is None:
+        return None
+    current_identity = _db_identity(conn)
+    if current_identity is None:
+        return None
+    candidates = [snapshot_path(query_term, fmt, snapshot_dir, columns)]
+    if columns is not None:
+        candidates.append(snapshot_path(query_term, fmt, snapshot_dir))
+    for path in candidates:
+        snapshot_identity = read_snapshot_identity(path)
+        if snapshot_identity is None:
+            continue
+        if snapshot_identity != current_identity:
+            logger.info(f"Snapshot obsoleto: {path} (DB e versione {snapshot_identity}, attuali {current_identity}).")
+            continue
+        df = _read_snapshot(pa, path, fmt, columns)
+        if df is not None:
+            return df
+    return None
+
+def _read_snapshot(pa, path, fmt, columns):
+    """ Legge uno snapshot (Feather in memory-map) come DataFrame; None se illeggibile o senza le colonne richieste. """
+    try:
+        if fmt == 'feather':
+            table = pa.feather.read_table(path, columns=columns, memory_map=True)
+        else:
+            table = pa.parquet.read_table(path, columns=columns, memory_map=True)
+    except (OSError, KeyError, pa.ArrowException) as e:
+        logger.warning(f"Impossibile leggere lo snapshot {path}: {e}")
+        return None
+    logger.info(f"Caricato lo snapshot {path} ({table.num_rows} post).")
+    return table.to_pandas()
+
+def load_posts_with_snapshot(conn, columns=None, query_term=None, fmt=DEFAULT_SNAPSHOT_FORMAT,
+                             refresh=True, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Come database.load_posts_df(), ma legge dallo snapshot colonnare quando è aggiornato.
+    Se lo snapshot manca o è obsoleto legge da SQLite e (con refresh=True) riscrive lo snapshot
+    delle sole colonne richieste, così il caricamento successivo non passa da SQLite.
+    """
+    df = load_snapshot(conn, query_term=query_term, fmt=fmt, columns=columns, snapshot_dir=snapshot_dir)
+    if df is not None:
+        return df
+    pa = _import_pyarrow() if refresh else None
+    identity = _db_identity(conn) if pa is not None else None # Letta prima dei dati, come in write_snapshot()
+    df = load_posts_df(conn, columns=columns, query_term=query_term)
+    if identity is not None:
+        _write_dataframe_snapshot(pa, df, snapshot_path(query_term, fmt, snapshot_dir, columns),
+                                  identity, query_term, fmt)
+    return df
+
+
+def main(argv=None):
+    """ Esporta snapshot per i notebook: python snapshots.py [--query Q ...] [--format parquet]. """
+    parser = argparse.ArgumentParser(description="Esporta snapshot colonnari (Feather/Parquet) dei post salvati.")
+    parser.add_argument("--query", action="append", dest="queries",
+                        help="Query da esportare (ripetibile). Default: l'intero corpus.")
+    parser.add_argument("--format", choices=sorted(SNAPSHOT_FORMATS), default=DEFAULT_SNAPSHOT_FORMAT)
+    parser.add_argument("--output-dir", default=SNAPSHOT_DIR, help=f"Cartella di destinazione (default: {SNAPSHOT_DIR}).")
+    parser.add_argument("--db", default=DB_NAME, help=f"Database SQLite (default: {DB_NAME}).")
+    args = parser.parse_args(argv)
+
+    if _import_pyarrow() is None:
+        parser.error("pyarrow è necessario per scrivere gli snapshot (pip install pyarrow).")
+    initialize_database(args.db)
+    conn = create_connection(args.db)
+    if conn is None:
+        return 1
+    try:
+        paths = [write_snapshot(conn, query_term=query, fmt=args.format, snapshot_dir=args.output_dir)
+                 for query in (args.queries or [None])]
+    finally:
+        conn.close()
+    for path in paths:
+        if path:
+            print(path)
+    return 0 if all(paths) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,6 @@
+# reddit_analyzer/tests/conftest.py
+import os
+import sys
+
+# I moduli del progetto sono nella radice del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+# reddit_analyzer/tests/test_job_queue.py
+import threading
+import time
+
+import pytest
+
+import worker
+from database import (
+    create_connection,
+    initialize_database,
+    enqueue_job,
+    claim_job,
+    heartbeat_job,
+    complete_job,
+    fail_job,
+    release_job,
+    count_jobs_by_status
+)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    initialize_database(path)
+    return path
+
+@pytest.fixture
+def conn(db_path):
+    conn = create_connection(db_path)
+    yield conn
+    conn.close()
+
+def _job_row(conn, job_id):
+    return conn.execute("SELECT status, attempts, lease_owner FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+
+def test_duplicate_enqueue_returns_active_job(conn):
+    job_id = enqueue_job(conn, "python", 50)
+
+    assert enqueue_job(conn, "python", 50) == job_id
+    assert count_jobs_by_status(conn)['queued'] == 1
+
+def test_claims_are_disjoint(conn):
+    first = enqueue_job(conn, "python", 10)
+    second = enqueue_job(conn, "rust", 10)
+
+    claimed = [claim_job(conn, "w1", 60), claim_job(conn, "w2", 60)]
+
+    assert sorted(job['job_id'] for job in claimed) == sorted([first, second])
+    assert claim_job(conn, "w3", 60) is None
+
+def test_expired_lease_is_reclaimed_and_stale_worker_rejected(conn):
+    job_id = enqueue_job(conn, "python", 10)
+    now = time.time()
+    assert claim_job(conn, "w1", 60, now=now)['attempts'] == 1
+
+    reclaimed = claim_job(conn, "w2", 60, now=now + 61) # Lease di w1 scaduto senza heartbeat
+
+    assert reclaimed['job_id'] == job_id and reclaimed['attempts'] == 2
+    assert _job_row(conn, job_id) == ('running', 2, 'w2')
+    assert heartbeat_job(conn, job_id, "w1", 60) is False
+    assert complete_job(conn, job_id, "w1", inserted=5) is False
+    assert complete_job(conn, job_id, "w2", inserted=5) is True
+    assert _job_row(conn, job_id) == ('done', 2, None)
+
+def test_failures_retry_until_max_attempts(conn):
+    job_id = enqueue_job(conn, "python", 10, max_attempts=2)
+
+    now = time.time()
+    claim_job(conn, "w1", 60, now=now)
+    assert fail_job(conn, job_id, "w1", "errore", retry_delay_seconds=30, now=now) == 'queued'
+    assert claim_job(conn, "w1", 60, now=now + 10) is None # Ancora in attesa del ritentativo
+    assert claim_job(conn, "w1", 60, now=now + 31)['attempts'] == 2
+    assert fail_job(conn, job_id, "w1", "errore", now=now + 31) == 'failed'
+
+def test_release_refunds_the_attempt(conn):
+    job_id = enqueue_job(conn, "python", 10, max_attempts=1)
+    claim_job(conn, "w1", 60)
+
+    assert release_job(conn, job_id, "w2") is False
+    assert release_job(conn, job_id, "w1") is True
+    assert _job_row(conn, job_id) == ('queued', 0, None)
+
+
+class BlockingScraper:
+    """ Scraper finto: resta "in recupero" finché non viene annullato. """
+
+    def __init__(self, **kwargs):
+        self.interrupted = False
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def scrape_and_store(self):
+        self._cancelled.wait(5)
+        self.interrupted = self._cancelled.is_set()
+        return 0
+
+class StoringScraper(BlockingScraper):
+    def scrape_and_store(self):
+        return 3
+
+
+@pytest.fixture
+def job_worker(db_path, monkeypatch):
+    monkeypatch.setattr(worker, "create_connection", lambda: create_connection(db_path))
+    return worker.JobWorker(worker_id="w1", lease_seconds=30, rate_limiter=object())
+
+def test_worker_completes_job(conn, job_worker, monkeypatch):
+    monkeypatch.setattr(worker, "RedditScraper", StoringScraper)
+    job_id = enqueue_job(conn, "python", 10)
+
+    results = job_worker.run(exit_when_idle=True)
+
+    assert results['done'] == 1
+    assert conn.execute("SELECT status, inserted FROM jobs WHERE job_id = ?", (job_id,)).fetchone() == ('done', 3)
+
+def test_worker_stop_requeues_job_on_last_attempt(conn, job_worker, monkeypatch):
+    monkeypatch.setattr(worker, "RedditScraper", BlockingScraper)
+    job_id = enqueue_job(conn, "python", 10, max_attempts=1)
+    threading.Timer(0.2, job_worker.stop).start()
+
+    results = job_worker.run(exit_when_idle=True)
+
+    assert results['released'] == 1 and results['failed'] == 0
+    assert _job_row(conn, job_id) == ('queued', 0, None)
@@ -0,0 +1,61 @@
+# reddit_analyzer/tests/test_response_cache.py
+import os
+import shutil
+
+from response_cache import ResponseCache
+from scraper import RedditScraper
+
+# Due pagine di /search.json per q=python registrate con ResponseCache.put (ttl_seconds=None)
+RECORDED_SEARCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "recorded_search_python")
+
+
+class OfflineSession:
+    """ Sessione HTTP che fallisce a ogni richiesta: il test deve essere servito solo dalla cache. """
+
+    def get(self, *args, **kwargs):
+        raise AssertionError(f"Richiesta di rete inattesa: {args} {kwargs}")
+
+    def close(self):
+        pass
+
+
+def _recorded_cache(tmp_path, **kwargs):
+    cache_dir = tmp_path / "http_cache"
+    shutil.copytree(RECORDED_SEARCH_DIR, cache_dir)
+    return ResponseCache(cache_dir=str(cache_dir), ttl_seconds=None, **kwargs)
+
+
+def test_scrape_offline_from_recorded_responses(tmp_path):
+    scraper = RedditScraper(query="python", num_posts=5, session=OfflineSession(), cache=_recorded_cache(tmp_path))
+
+    posts = scraper.fetch_posts()
+
+    assert not scraper.interrupted
+    assert [post['post_id'] for post in posts] == ['rec001', 'rec002', 'rec003']
+    assert posts[0]['contenuto'] == "Sto iniziando con Python, quale libro consigliate?"
+    assert posts[2]['titolo'] == "Script Python lento"
+    assert posts[1]['url_post'] == "https://www.reddit.com/r/Python/comments/rec002/"
+
+
+def test_recorded_responses_ignore_age(tmp_path):
+    cache = _recorded_cache(tmp_path)
+    for entry in os.scandir(cache.cache_dir):
+        os.utime(entry.path, (0, 0)) # Registrate nel 1970: con un TTL sarebbero scadute
+
+    assert cache.get("https://www.reddit.com/search.json", {'q': 'python', 'sort': 'relevance', 'limit': 5}) is not None
+
+
+def test_replay_mode_never_evicts(tmp_path):
+    cache = _recorded_cache(tmp_path, max_size_bytes=1)
+
+    cache.put("https://www.reddit.com/search.json", {'q': 'rust'}, {'data': {'children': []}})
+
+    assert len(os.listdir(cache.cache_dir)) == 3
+
+
+def test_eviction_with_ttl(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl_seconds=60, max_size_bytes=1)
+
+    cache.put("https://www.reddit.com/search.json", {'q': 'rust'}, {'data': {'children': []}})
+
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,76 @@
+# reddit_analyzer/text_processing.py
+import re
+
+import pandas as pd
+
+from utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Versione della tokenizzazione per keyword: i token salvati nel DB con una versione
+# diversa vengono ricalcolati (come SENTIMENT_ANALYZER_VERSION per il sentiment)
+TOKENIZER_VERSION = "kw-1"
+
+MIN_TOKEN_LENGTH = 3
+
+# Pattern precompilato: punteggiatura e cifre in un solo passaggio
+# (equivale a re.sub(r'[^\w\s]', '') seguito da re.sub(r'\d+', ''))
+PUNCTUATION_AND_DIGITS_RE = re.compile(r'[^\w\s]|\d')
+
+# Contrazioni che il tokenizer Treebank di NLTK (word_tokenize) separa anche
+# dopo la rimozione della punteggiatura: mantenute per produrre gli stessi token
+TREEBANK_CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+
+def normalize_text(text):
+    """
+    Pulisce un titolo o un contenuto: newline, tabulazioni e spazi multipli
+    diventano un singolo spazio, senza spazi iniziali/finali.
+    """
+    if not text:
+        return ""
+    # str.split() senza argomenti separa sugli stessi caratteri di \s ed elimina
+    # gli spazi agli estremi: equivale a re.sub(r'\s+', ' ', text).strip(), ma è più veloce
+    return " ".join(text.split())
+
+def _filter_tokens(raw_tokens, stopwords):
+    """ Separa le contrazioni e tiene i token alfabetici di almeno MIN_TOKEN_LENGTH caratteri non stopword. """
+    tokens = []
+    for token in raw_tokens:
+        for part in TREEBANK_CONTRACTIONS.get(token, (token,)):
+            if len(part) >= MIN_TOKEN_LENGTH and part.isalpha() and part not in stopwords:
+                tokens.append(part)
+    return tokens
+
+def tokenize_text(text, stopwords=frozenset()):
+    """
+    Tokenizza un testo per l'estrazione di keyword:
+    minuscolo, rimozione di punteggiatura e numeri, split sugli spazi, filtro delle stopword.
+    Args:
+        text (str): Testo da tokenizzare (None/NaN -> nessun token).
+        stopwords (frozenset): Stopword da escludere.
+    Returns:
+        list[str]: Token puliti, nell'ordine del testo.
+    """
+    if not text or pd.isna(text):
+        return []
+    return _filter_tokens(PUNCTUATION_AND_DIGITS_RE.sub('', str(text).lower()).split(), stopwords)
+
+def tokenize_series(series, stopwords=frozenset()):
+    """
+    Versione batch di tokenize_text(): minuscolo e rimozione di punteggiatura/numeri
+    sono operazioni vettoriali sulla Series, il filtro dei token usa un frozenset.
+    Restituisce una Series (stesso indice) con i token uniti da spazi.
+    """
+    if series.empty:
+        return pd.Series([], index=series.index, dtype=object)
+    cleaned = series.fillna("").astype(str).str.lower().str.replace(PUNCTUATION_AND_DIGITS_RE, '', regex=True)
+    return pd.Series([" ".join(_filter_tokens(text.split(), stopwords)) for text in cleaned],
+                     index=series.index, dtype=object)
@@ -4,9 +4,11 @@ import plotly.graph_objects as go
 import pandas as pd
 
 from utils import setup_logger
+import metrics
 
 logger = setup_logger(__name__)
 
+@metrics.timed()
 def plot_sentiment_distribution(df_sentiment_counts):
     """
     Crea un grafico a barre orizzontali per la distribuzione del sentiment
@@ -49,6 +51,7 @@ def plot_sentiment_distribution(df_sentiment_counts):
     fig.update_layout(showlegend=False)
     return fig
 
+@metrics.timed()
 def plot_subreddit_distribution(df_subreddit_dist, top_n=15):
     """
     Crea un grafico a barre per la distribuzione dei post per subreddit.
@@ -67,6 +70,7 @@ def plot_subreddit_distribution(df_subreddit_dist, top_n=15):
     fig.update_layout(xaxis_title="Subreddit", yaxis_title="Numero di Post")
     return fig
 
+@metrics.timed()
 def plot_average_score_per_subreddit(df_avg_scores, top_n=15):
     """
     Crea un grafico a barre per il punteggio medio per subreddit.
@@ -86,6 +90,7 @@ def plot_average_score_per_subreddit(df_avg_scores, top_n=15):
     fig.update_layout(xaxis_title="Subreddit", yaxis_title="Punteggio Medio")
     return fig
 
+@metrics.timed()
 def plot_score_distribution(df, score_column='punteggio'):
     """
     Crea un istogramma per la distribuzione dei punteggi dei post.
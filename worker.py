@@ -0,0 +1,226 @@
+# reddit_analyzer/worker.py
+import argparse
+import os
+import signal
+import socket
+import threading
+
+from utils import setup_logger
+from rate_limiter import AdaptiveRateLimiter, DEFAULT_RATE_PER_SECOND
+from response_cache import ResponseCache
+from scraper import RedditScraper
+from database import (
+    create_connection,
+    initialize_database,
+    enqueue_job,
+    claim_job,
+    heartbeat_job,
+    complete_job,
+    fail_job,
+    release_job,
+    count_jobs_by_status,
+    DEFAULT_JOB_MAX_ATTEMPTS
+)
+
+logger = setup_logger(__name__)
+
+DEFAULT_LEASE_SECONDS = 120 # Un job il cui worker non rinnova il lease per 2 minuti torna in coda
+DEFAULT_POLL_INTERVAL_SECONDS = 5 # Attesa tra due tentativi di presa in carico a coda vuota
+RETRY_BASE_DELAY_SECONDS = 30 # Ritardo del primo ritentativo, raddoppiato a ogni tentativo fallito
+
+def default_worker_id():
+    """ Identificativo del worker, univoco tra macchine e processi che condividono il DB. """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobWorker:
+    """
+    Worker della coda 'jobs': prende in carico un job alla volta con un lease, lo esegue con
+    RedditScraper.scrape_and_store() e rinnova il lease con un heartbeat finché il recupero è
+    in corso. Si possono avviare più worker (anche su macchine diverse) sullo stesso DB.
+    """
+
+    def __init__(self, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL_SECONDS,
+                 rate_limiter=None, cache=None):
+        """
+        Args:
+            worker_id (str, optional): Identificativo del worker. Default: host:pid.
+            lease_seconds (float): Durata del lease; l'heartbeat lo rinnova ogni lease_seconds / 3.
+            poll_interval (float): Secondi di attesa quando la coda è vuota.
+            rate_limiter (TokenBucket, optional): Rate limiter del worker. Con più worker conviene
+                dividere tra loro il budget di richieste (es. rate_per_second / numero di worker).
+            cache (ResponseCache, optional): Cache su disco delle risposte.
+        """
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+        self.cache = cache
+        self._stopping = threading.Event()
+        self._current_scraper = None
+
+    def stop(self):
+        """ Chiede al worker di fermarsi: il job in corso viene interrotto e torna in coda. """
+        self._stopping.set()
+        scraper = self._current_scraper
+        if scraper is not None:
+            scraper.cancel()
+
+    def run(self, max_jobs=None, exit_when_idle=False):
+        """
+        Ciclo principale: prende in carico ed esegue job finché non viene fermato.
+        Args:
+            max_jobs (int, optional): Numero massimo di job da eseguire.
+            exit_when_idle (bool): Termina quando la coda non ha job disponibili.
+        Returns:
+            dict: Conteggio dei job per esito ('done', 'retry', 'failed', 'lost', 'released').
+        """
+        results = {'done': 0, 'retry': 0, 'failed': 0, 'lost': 0, 'released': 0}
+        conn = create_connection()
+        if conn is None:
+            logger.error(f"Worker {self.worker_id}: connessione al database fallita.")
+            return results
+        logger.info(f"Worker {self.worker_id} avviato (lease {self.lease_seconds} s).")
+        try:
+            while not self._stopping.is_set() and (max_jobs is None or sum(results.values()) < max_jobs):
+                job = claim_job(conn, self.worker_id, self.lease_seconds)
+                if job is None:
+                    if exit_when_idle:
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                results[self.run_job(conn, job)] += 1
+        finally:
+            conn.close()
+        logger.info(f"Worker {self.worker_id} terminato: {results}.")
+        return results
+
+    def run_job(self, conn, job):
+        """
+        Esegue un job già preso in carico e ne registra l'esito. Restituisce 'done', 'retry', 'failed',
+        'lost' oppure 'released' se il worker è stato fermato durante il recupero (il job torna in coda
+        senza consumare un tentativo). Un KeyboardInterrupt rilascia il job e viene poi rilanciato.
+        """
+        query_term = job['query_term']
+        logger.info(f"Worker {self.worker_id}: job {job['job_id']} '{query_term}' (tentativo {job['attempts']}/{job['max_attempts']}).")
+        scraper = RedditScraper(query=query_term, num_posts=job['num_posts'], rate_limiter=self.rate_limiter, cache=self.cache)
+        self._current_scraper = scraper
+        job_finished = threading.Event()
+        lease_lost = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(job['job_id'], scraper, job_finished, lease_lost),
+                                     name=f"heartbeat-{job['job_id']}", daemon=True)
+        heartbeat.start()
+        inserted, error, keyboard_interrupt = 0, None, False
+        try:
+            inserted = scraper.scrape_and_store()
+            if scraper.interrupted:
+                error = "Recupero interrotto (errori di rete/API o arresto del worker)."
+        except KeyboardInterrupt:
+            keyboard_interrupt = True
+            self.stop()
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Worker {self.worker_id}: errore nel job {job['job_id']} '{query_term}': {e}", exc_info=True)
+        finally:
+            job_finished.set()
+            heartbeat.join()
+            self._current_scraper = None
+
+        if lease_lost.is_set():
+            logger.warning(f"Worker {self.worker_id}: lease del job {job['job_id']} perso, esito non registrato.")
+            if keyboard_interrupt:
+                raise KeyboardInterrupt
+            return 'lost'
+        if keyboard_interrupt or (error is not None and self._stopping.is_set()):
+            # Arresto del worker (stop(), SIGTERM o Ctrl+C): non è un errore del job, che torna subito in coda
+            released = release_job(conn, job['job_id'], self.worker_id)
+            if keyboard_interrupt:
+                raise KeyboardInterrupt
+            return 'released' if released else 'lost'
+        if error is None:
+            return 'done' if complete_job(conn, job['job_id'], self.worker_id, inserted) else 'lost'
+        # Il recupero riprende dal cursore salvato: il ritentativo non riscarica le pagine già salvate
+        retry_delay = RETRY_BASE_DELAY_SECONDS * 2 ** (job['attempts'] - 1)
+        status = fail_job(conn, job['job_id'], self.worker_id, error, retry_delay_seconds=retry_delay)
+        if status is None:
+            return 'lost'
+        return 'retry' if status == 'queued' else 'failed'
+
+    def _keep_lease(self, job_id, scraper, job_finished, lease_lost):
+        """
+        Heartbeat (thread dedicato, con la propria connessione): rinnova il lease finché il job è in corso.
+        Un errore temporaneo del database non interrompe il job: il rinnovo viene ritentato al giro
+        successivo (ogni lease_seconds / 3, quindi prima che il lease scada).
+        """
+        conn = create_connection()
+        try:
+            while not job_finished.wait(self.lease_seconds / 3):
+                if conn is None:
+                    conn = create_connection()
+                renewed = heartbeat_job(conn, job_id, self.worker_id, self.lease_seconds) if conn is not None else None
+                if renewed is None:
+                    logger.warning(f"Worker {self.worker_id}: rinnovo del lease del job {job_id} non riuscito, ritento.")
+                    continue
+                if not renewed:
+                    # Il job è stato riassegnato (lease scaduto): si interrompe per non recuperarlo due volte
+                    logger.warning(f"Worker {self.worker_id}: lease del job {job_id} non rinnovato, interrompo il recupero.")
+                    lease_lost.set()
+                    scraper.cancel()
+                    return
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def main(argv=None):
+    """ Worker della coda dei job: python worker.py [--enqueue QUERY ...] [--exit-when-idle]. """
+    parser = argparse.ArgumentParser(description="Worker della coda di recupero condivisa (tabella 'jobs').")
+    parser.add_argument("--enqueue", action="append", metavar="QUERY", help="Accoda un job per QUERY ed esce (ripetibile).")
+    parser.add_argument("--enqueue-file", metavar="FILE", help="Accoda le query di un file (formato di cli.py) ed esce.")
+    parser.add_argument("--posts", type=int, default=100, help="Post da recuperare per i job accodati con --enqueue.")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_JOB_MAX_ATTEMPTS)
+    parser.add_argument("--status", action="store_true", help="Mostra il numero di job per stato ed esce.")
+    parser.add_argument("--worker-id", help="Identificativo del worker (default: host:pid).")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help=f"Durata del lease in secondi (default: {DEFAULT_LEASE_SECONDS}).")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_SECOND,
+                        help="Richieste al secondo di questo worker: con N worker usare il budget totale / N.")
+    parser.add_argument("--max-jobs", type=int, help="Termina dopo aver eseguito questo numero di job.")
+    parser.add_argument("--exit-when-idle", action="store_true", help="Termina quando non ci sono job disponibili.")
+    parser.add_argument("--no-cache", action="store_true", help="Non usare la cache su disco delle risposte HTTP.")
+    args = parser.parse_args(argv)
+
+    initialize_database()
+    if args.enqueue or args.enqueue_file or args.status:
+        targets = [(query, args.posts) for query in args.enqueue or []]
+        if args.enqueue_file:
+            from cli import read_queries_file
+            try:
+                targets.extend(read_queries_file(args.enqueue_file, default_num_posts=args.posts))
+            except (OSError, ValueError) as e:
+                parser.error(str(e))
+        conn = create_connection()
+        if conn is None:
+            return 1
+        try:
+            job_ids = [enqueue_job(conn, query, num_posts, max_attempts=args.max_attempts) for query, num_posts in targets]
+            if args.status:
+                print(count_jobs_by_status(conn))
+        finally:
+            conn.close()
+        return 0 if all(job_id is not None for job_id in job_ids) else 1
+
+    worker = JobWorker(worker_id=args.worker_id, lease_seconds=args.lease,
+                       rate_limiter=AdaptiveRateLimiter(rate_per_second=args.rate),
+                       cache=None if args.no_cache else ResponseCache())
+    # SIGTERM (es. da systemd o docker stop) come Ctrl+C: il job in corso torna in coda
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        results = worker.run(max_jobs=args.max_jobs, exit_when_idle=args.exit_when_idle)
+    except KeyboardInterrupt:
+        worker.stop()
+        return 130
+    return 0 if results['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())